@@ -4,17 +4,36 @@
 Created on Sun Feb  5 17:32:12 2023
 
 @author: bill
+
+Run as a script to generate, plot and save the experiment with the parameters below.
+Imported, generate(params) returns K_g for any set of parameters and sweep(paramSets)
+generates many experiments in parallel, each into its own folder:
+
+    import GEN
+    paramSets = GEN.parameterGrid(smt_t=[.1, .3, .5], KeyTol=[1, 2])
+    GEN.sweep(paramSets, "Actuation_data/sweep")
 """
 # Import numpy and matplotlib
 import csv
+import itertools
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+# the payload and experiment file formats are shared with the overseer one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shiveFormat import experimentFileHeader, mapExperimentFile, packActuationData  # noqa: E402
 
-# Import python wrapped Fortran functions for calculation
-import Test
+# Import the NumPy port of the Fortran functions for calculation
+import TestFunctions
+
+# Set to True to evaluate with the compiled Fortran module (Test) instead of NumPy
+use_fortran = False
 
 
 #### Definition of Inputs####
+# these are the defaults, generate() takes any of them from its params dictionary instead
 # Spatial Parameters
 a = 0
 b = 1  # Total interval for spatial points
@@ -37,38 +56,72 @@ V = .1  # Lamination velocity -- Only Used for Lamination
 # Not used Currently
 # c1=1.1; c2=2.3; # Values of Material Properties in material 1 and 2
 
+# The selected function, "fg_cbd" for the FG Checkerboard or "fg_lam" for the FG Lamination
+geometry = "fg_cbd"
+
 ###############################################################################
 # Plotting Parameters
 M = 400
 N = 400  # Number of sample points along x and t for fine plot
 ###############################################################################
 
-
-#### Creation of fine mesh for pcolor plotting evaluation and verification ####
-x = np.linspace(a, b, M)
-t = np.linspace(T0, Tf, N)
-X, T = np.meshgrid(x, t)
-xx = X.flatten(order='F')
-tt = T.flatten(order='F')
-
 #### Shive Machine- Set the number of spatial elements and the sample rate ####
 N_SpatElem = 40  # Number of Spatial Elements on the Device
 Mat1 = 0
 Mat2 = 255  # Material Range from Material 1 to Material 2
 t_SampPeri = 1/1000.  # Time Sample Period in Milliseconds
-N_SampTime = int((Tf-T0)/t_SampPeri)  # Number of sample times
 ###############################################################################
 
-# Evenly spaced array of spatial location of elements from a to b
-x_SpatElem = np.linspace(a, b, N_SpatElem)
-# Evenly spaced array of time values from T0 to Tf
-t_SampTime = np.linspace(T0, Tf, N_SampTime)
+# How K_g marks the samples a segment does not need, "keyframes" (makeKeyframes) or "gradient" (makeK_g)
+simplify = "keyframes"
+# Largest difference in material units (0-255) between the segment's playback and Z_g, see makeKeyframes
+KeyTol = 1.
+
+# Maximum tolerance of gradient, see makeK_g
+GradTol = .1
+
+# generateBlocks evaluates about this many samples (sample times x segments) at once, which bounds its memory use
+#    (the evaluation keeps a few dozen float64 arrays of that size, about 70 MB)
+blockElements = 1 << 18
+
+# Folder the experiment files are written to
+folderName = "Actuation_data"
+
+
+# all parameters of an experiment as a dictionary, the module defaults updated with params
+def defaultParameters(params=None):
+    parameters = {"a": a, "b": b, "T0": T0, "Tf": Tf, "eps": eps, "tau": tau,
+                  "m1": m1, "n1": n1, "smt_x": smt_x, "smt_t": smt_t, "V": V,
+                  "geometry": geometry, "N_SpatElem": N_SpatElem,
+                  "Mat1": Mat1, "Mat2": Mat2, "t_SampPeri": t_SampPeri, "simplify": simplify, "KeyTol": KeyTol,
+                  "GradTol": GradTol}
+    unknown = set(params or {}) - set(parameters) - {"name"}
+    if unknown:
+        raise ValueError("Unknown parameters: {}".format(", ".join(sorted(unknown))))
+    parameters.update(params or {})
+    return parameters
 
-# Creates a meshgrid array of elements to capture all of the possible locations in space-time
-X_Samp, T_Samp = np.meshgrid(x_SpatElem, t_SampTime)
-xx_Samp = X_Samp.flatten(order='F')
-# Flattens the previously created meshgrid (in Fortran Order) to allow for faster calculation
-tt_Samp = T_Samp.flatten(order='F')
+
+def sampleCount(params):  # Number of sample times
+    return int((params["Tf"]-params["T0"])/params["t_SampPeri"])
+
+
+# Evenly spaced arrays of the spatial location of the elements from a to b and of the sample times from T0 to Tf
+def sampleGrid(params):
+    N_SampTime = sampleCount(params)
+    x_SpatElem = np.linspace(params["a"], params["b"], params["N_SpatElem"])
+    t_SampTime = np.linspace(params["T0"], params["Tf"], N_SampTime)
+    return x_SpatElem, t_SampTime
+
+
+# the sample times start to end-1 of sampleGrid without the ones before, the same values np.linspace gives
+def sampleTimes(params, start, end):
+    N_SampTime = sampleCount(params)
+    step = (params["Tf"]-params["T0"])/(N_SampTime - 1) if N_SampTime > 1 else 0.
+    t = np.arange(start, end) * step + params["T0"]
+    if end == N_SampTime and end > start and N_SampTime > 1:
+        t[-1] = params["Tf"]
+    return t
 
 
 # #### The following code names the functions from the fortran module as python functions
@@ -77,35 +130,37 @@ tt_Samp = T_Samp.flatten(order='F')
 # g3=Test.testfunctions.psi_cbd # Sharp Checkoerboard
 # g4=Test.testfunctions.psi_fg_cbd # Functionally Graded Checkerboard
 # g5=Test.testfunctions.f_u # Piecewise Functionally Graded Checkerboard
+# Each of these also has an array version taking xx_Samp and tt_Samp whole,
+# e.g. Test.testfunctions.psi_fg_cbd_vec(xx_Samp,tt_Samp,Mat1,Mat2,m1,n1,eps,tau,smt_x,smt_t)
 
 # The following code is the selected function that we will be using in the project, the FG Checkerboard
-# I am using the functionally graded checkerboard option here but this can be changed to any of the other
-# functions found in the Fortran Module I have included the FG lamination commented out below
-
-g = Test.testfunctions.psi_fg_cbd
-# This function maps g onto the previously created arrays xx and tt
-zz_g = np.array(list(map(lambda x, t: g(x, t, Mat1, Mat2, m1, n1, eps,
-                tau, smt_x, smt_t), xx_Samp, tt_Samp)))  # FG CBD on Shive Devices
-zz_fine = np.array(list(map(lambda x, t: g(x, t, Mat1, Mat2, m1,
-                   n1, eps, tau, smt_x, smt_t), xx, tt)))  # FG CBD on Fine Mesh
+# by default, params["geometry"] = "fg_lam" gives the FG Lamination instead
+#    the functions take the whole flattened arrays xx and tt at once
+def evaluate(params, xx, tt):
+    p = params
+    if use_fortran:
+        # Import python wrapped Fortran functions for calculation
+        import Test
+
+        # The *_vec subroutines take the whole flattened arrays in one f2py call
+        if p["geometry"] == "fg_lam":
+            return Test.testfunctions.psi_fg_lam_vec(xx, tt, p["Mat1"], p["Mat2"], p["m1"], p["eps"], p["V"], p["smt_x"])
+        return Test.testfunctions.psi_fg_cbd_vec(xx, tt, p["Mat1"], p["Mat2"], p["m1"], p["n1"], p["eps"],
+                                                 p["tau"], p["smt_x"], p["smt_t"])
+
+    if p["geometry"] == "fg_lam":
+        return TestFunctions.psi_FG_lam(xx, tt, p["Mat1"], p["Mat2"], p["m1"], p["eps"], p["V"], p["smt_x"])
+    if p["geometry"] == "fg_cbd":
+        return TestFunctions.psi_FG_cbd(xx, tt, p["Mat1"], p["Mat2"], p["m1"], p["n1"], p["eps"],
+                                        p["tau"], p["smt_x"], p["smt_t"])
+    raise ValueError("Unknown geometry: {}".format(p["geometry"]))
 
 
-# Uncomment the following lines to get the functionally graded lamination instead of CB
-# g=Test.testfunctions.psi_fg_lam
-# ## This function maps g onto the previously created arrays xx and tt
-# zz_g=np.array(list(map(lambda x,t: g(x,t,Mat1,Mat2,m1,eps,V,smt_x),xx_Samp,tt_Samp))) #FG LAM on Shive Devices
-# zz_fine=np.array(list(map(lambda x,t: g(x,t,Mat1,Mat2,m1,eps,V,smt_x),xx,tt))) #FG LAM on Fine Mesh
-
 ###############################################################################
 
 # What follows is definition of one of the output objects. All are matrix
 # arrays of size (N_SampTime,N_SpatElem)
 
-# The values in Z_g are floats ranging from 0 (material 1) to 255 (material 2)
-Z_g = zz_g.reshape(X_Samp.shape, order='F')
-# The following is the integer conversion of the previous output object
-Z_g_int = np.asarray(Z_g, dtype='int')
-
 # The values in K_g range from 0 (material 1) to 255 (material 2)
 # only in regions where the material is changing more than some tolerance
 # and -100 in regions where the material properties are approximately constant
@@ -113,78 +168,188 @@ Z_g_int = np.asarray(Z_g, dtype='int')
 # The point of the array K_g is to identify regions of constant material properties
 # using a maximum gradient value as a tolerance by identifying regions of constancy
 # by flagging cell values whose gradient (rate of change) is very small.
-GradTol = .1  # Maximum tolerance of gradient
-
-K_g = np.zeros(Z_g.shape)  # Preallocating K_g array
-
-indx_Const = np.where(np.abs(np.gradient(Z_g, axis=0)) <=
-                      GradTol)  # Approximately constant cells
-indx_Chang = np.where(np.abs(np.gradient(Z_g, axis=0)) >=
-                      GradTol)  # Changing material property cells
+def makeK_g(Z_g, GradTol):
+    gradient = np.abs(np.gradient(Z_g, axis=0))
+    # Approximately constant cells get -100, changing material property cells keep their value
+    return np.where(gradient <= GradTol, -100., np.where(gradient >= GradTol, Z_g, 0.))
+
+
+# The keyframe version of K_g keeps the fewest points of Z_g a segment needs to stay within KeyTol of it.
+# A segment holds each value until the next point (it does not interpolate), so every point starts a run
+# of samples that all lie within KeyTol of the point's value. The value is a whole number within KeyTol of
+# the first sample, on the side the pattern is heading to: a rising ramp starts at the top of the band,
+# so the run covers twice KeyTol of the ramp. The next point is placed at the first sample out of the band.
+# Only the samples up to the point and the one after it decide a value, so blocks of rows can be
+# simplified one after another: held carries the values of the open runs over, lookahead is the row
+# after the last one (None at the end of the experiment). Returns the K_g rows and the held values.
+def makeKeyframes(Z_g, KeyTol, held=None, lookahead=None):
+    if KeyTol < .5:
+        raise ValueError("KeyTol must be at least 0.5, the segments take whole numbers")
+    K_g = np.full(Z_g.shape, -100.)
+    held = np.full(Z_g.shape[1], np.nan) if held is None else held.copy()
+    for time_index in range(len(Z_g)):
+        row = Z_g[time_index]
+        # a NaN held value (before the first point) always starts a run
+        outside = ~(np.abs(row - held) <= KeyTol)
+        if outside.any():
+            following = Z_g[time_index + 1] if time_index + 1 < len(Z_g) else lookahead
+            heading = np.sign(following - row) if following is not None else np.zeros_like(row)
+            value = np.where(heading > 0, np.floor(row + KeyTol),
+                             np.where(heading < 0, np.ceil(row - KeyTol), np.rint(row)))
+            value = np.clip(value, 0, 255)
+            held[outside] = value[outside]
+            K_g[time_index, outside] = value[outside]
+    return K_g, held
+
+
+# the value every segment plays at every sample time, it holds each point until the next one
+#    a segment starts at 127 if the first sample is skipped, as packActuationData writes it
+def holdPlayback(K_g):
+    rows = np.where(K_g != -100, np.arange(len(K_g))[:, np.newaxis], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    played = np.rint(K_g[rows, np.arange(K_g.shape[1])])
+    return np.where(played != -100, played, 127.)
+
+
+# how much smaller K_g is than the dense experiment, and with Z_g the largest error of the playback
+def keyframeReport(K_g, Z_g=None):
+    points = np.count_nonzero(K_g != -100, axis=0)
+    report = {"samples": int(K_g.size), "points": int(points.sum()),
+              "points_min": int(points.min()), "points_max": int(points.max()),
+              "compression_ratio": K_g.size / max(int(points.sum()), 1)}
+    if Z_g is not None:
+        report["max_error"] = float(np.max(np.abs(holdPlayback(K_g) - Z_g)))
+    return report
+
+
+def printKeyframeReport(report):
+    print("K_g keeps {} of {} samples ({:.1f}x fewer), {} to {} points per segment".format(
+        report["points"], report["samples"], report["compression_ratio"], report["points_min"], report["points_max"]))
+    if "max_error" in report:
+        print("Largest difference between the segments' playback and Z_g: {:.2f}".format(report["max_error"]))
+
+
+# K_g from Z_g with the method of params["simplify"]
+def simplifyZ_g(Z_g, params):
+    if params["simplify"] == "keyframes":
+        return makeKeyframes(Z_g, params["KeyTol"])[0]
+    if params["simplify"] == "gradient":
+        return makeK_g(Z_g, params["GradTol"])
+    raise ValueError("Unknown simplify method: {}".format(params["simplify"]))
 
-K_g[indx_Chang] = Z_g[indx_Chang]
-K_g[indx_Const] = -100
 
+# The values in Z_g are floats ranging from 0 (material 1) to 255 (material 2)
+def makeZ_g(params):
+    x_SpatElem, t_SampTime = sampleGrid(params)
+    return evaluateGrid(params, x_SpatElem, t_SampTime)
+
+
+# the pattern at every element position and sample time, Z[time index, element index]
+def evaluateGrid(params, x_SpatElem, t_SampTime):
+    # Creates a meshgrid array of elements to capture all of the possible locations in space-time
+    X_Samp, T_Samp = np.meshgrid(x_SpatElem, t_SampTime)
+    # Flattens the meshgrid (in Fortran Order) to allow for faster calculation
+    xx_Samp = X_Samp.flatten(order='F')
+    tt_Samp = T_Samp.flatten(order='F')
+    return evaluate(params, xx_Samp, tt_Samp).reshape(X_Samp.shape, order='F')
+
+
+# the actuation values of every segment at every sample time, K_g[time index, segment index]
+def generate(params=None):
+    params = defaultParameters(params)
+    return simplifyZ_g(makeZ_g(params), params)
+
+
+# K_g in blocks of consecutive sample times as (index of the first sample time, sample times, K_g rows),
+#    for experiments too long or too dense to hold whole; the blocks stacked are equal to generate(params)
+# every block is evaluated with one more sample time on each side, so the gradient at the block edges
+#    is the same central difference it is in the whole matrix, and the keyframes see the sample after the block
+def generateBlocks(params=None, blockElements=blockElements):
+    params = defaultParameters(params)
+    if params["simplify"] not in ("keyframes", "gradient"):
+        raise ValueError("Unknown simplify method: {}".format(params["simplify"]))
+    x_SpatElem = np.linspace(params["a"], params["b"], params["N_SpatElem"])
+    N_SampTime = sampleCount(params)
+    blockSize = max(1, blockElements // max(1, len(x_SpatElem)))
+    held = None  # the keyframe values carried from one block to the next
+    for start in range(0, N_SampTime, blockSize):
+        end = min(start + blockSize, N_SampTime)
+        first, last = max(start - 1, 0), min(end + 1, N_SampTime)
+        t_SampTime = sampleTimes(params, first, last)
+        Z_g = evaluateGrid(params, x_SpatElem, t_SampTime)
+        if params["simplify"] == "keyframes":
+            K_g, held = makeKeyframes(Z_g[start - first:end - first], params["KeyTol"], held,
+                                      Z_g[end - first] if end < N_SampTime else None)
+        else:
+            K_g = makeK_g(Z_g, params["GradTol"])[start - first:end - first]
+        yield start, t_SampTime[start - first:end - first], K_g
 
-###############################################################################
-# Creation of fine mesh arrays for plotting 2d pcolormesh
-Z_fine = zz_fine.reshape(X.shape, order='F')
-Z_fine_int = np.asarray(Z_fine, dtype='int')
 
 ###############################################################################
-# The following code is for plotting and verification and can be commented
-# out before running
-
-# Plot of the 2D pcolor in space and time
-fig6 = plt.figure(6)
-ax6_1 = plt.axes()
-plot6_1 = ax6_1.pcolormesh(X, T, Z_fine, zorder=0, shading='gouraud')
-plt.colorbar(plot6_1)
-ax6_1.set_xlabel(r'$z$')
-ax6_1.set_ylabel(r'$t$')
-
-
-# Plot of the 1D time
-fig7 = plt.figure(7)
-ax7_1 = plt.axes()
-plot7_1 = ax7_1.plot(T_Samp[:], Z_g[:])
-ax7_1.set_xlabel(r'$t$')
-ax7_1.set_ylabel(r'$u$')
-
-
-fig8 = plt.figure(8)
-ax8_1 = plt.axes()
-plot8_1 = ax8_1.pcolormesh(X, T, Z_fine_int)
-plt.colorbar(plot8_1)
-ax8_1.set_xlabel(r'$z$')
-ax8_1.set_ylabel(r'$t$')
-
-
-fig9 = plt.figure(9)
-ax9_1 = plt.axes()
-plot9_1 = ax9_1.plot(T_Samp[:], Z_g_int[:])
-ax9_1.set_xlabel(r'$t$')
-ax9_1.set_ylabel(r'$u$')
-# plt.savefig("plot.png")
-
-
-fig9 = plt.figure(10)
-ax10_1 = plt.axes()
-plot10_1 = ax10_1.plot(T_Samp[0:-1], np.diff(Z_g, axis=0), c='r')
-plot10_2 = ax10_1.plot(T_Samp[:], np.gradient(Z_g, axis=0), c='b')
-
-ax10_1.set_xlabel(r'$t$')
-ax10_1.set_ylabel(r'$u$')
-
-
-fig11 = plt.figure(11)
-ax11_1 = plt.axes()
-
-plot11_1 = ax11_1.scatter(T_Samp[:, :], K_g[:, :], s=1)
-plot11_2 = ax11_1.plot(T_Samp[:, :], K_g[:, :])
-plt.colorbar(plot11_1)
-ax11_1.set_xlabel(r'$z$')
-ax11_1.set_ylabel(r'$t$')
+# The following code is for plotting and verification, it only runs when GEN.py is run as a script
+def plotExperiment(params, Z_g, K_g):
+    import matplotlib.pyplot as plt
+
+    #### Creation of fine mesh for pcolor plotting evaluation and verification ####
+    x = np.linspace(params["a"], params["b"], M)
+    t = np.linspace(params["T0"], params["Tf"], N)
+    X, T = np.meshgrid(x, t)
+    xx = X.flatten(order='F')
+    tt = T.flatten(order='F')
+
+    # Creation of fine mesh arrays for plotting 2d pcolormesh
+    Z_fine = evaluate(params, xx, tt).reshape(X.shape, order='F')
+    Z_fine_int = np.asarray(Z_fine, dtype='int')
+    # The following is the integer conversion of Z_g
+    Z_g_int = np.asarray(Z_g, dtype='int')
+    x_SpatElem, t_SampTime = sampleGrid(params)
+    X_Samp, T_Samp = np.meshgrid(x_SpatElem, t_SampTime)
+
+    # Plot of the 2D pcolor in space and time
+    fig6 = plt.figure(6)
+    ax6_1 = plt.axes()
+    plot6_1 = ax6_1.pcolormesh(X, T, Z_fine, zorder=0, shading='gouraud')
+    plt.colorbar(plot6_1)
+    ax6_1.set_xlabel(r'$z$')
+    ax6_1.set_ylabel(r'$t$')
+
+    # Plot of the 1D time
+    fig7 = plt.figure(7)
+    ax7_1 = plt.axes()
+    plot7_1 = ax7_1.plot(T_Samp[:], Z_g[:])
+    ax7_1.set_xlabel(r'$t$')
+    ax7_1.set_ylabel(r'$u$')
+
+    fig8 = plt.figure(8)
+    ax8_1 = plt.axes()
+    plot8_1 = ax8_1.pcolormesh(X, T, Z_fine_int)
+    plt.colorbar(plot8_1)
+    ax8_1.set_xlabel(r'$z$')
+    ax8_1.set_ylabel(r'$t$')
+
+    fig9 = plt.figure(9)
+    ax9_1 = plt.axes()
+    plot9_1 = ax9_1.plot(T_Samp[:], Z_g_int[:])
+    ax9_1.set_xlabel(r'$t$')
+    ax9_1.set_ylabel(r'$u$')
+    # plt.savefig("plot.png")
+
+    fig9 = plt.figure(10)
+    ax10_1 = plt.axes()
+    plot10_1 = ax10_1.plot(T_Samp[0:-1], np.diff(Z_g, axis=0), c='r')
+    plot10_2 = ax10_1.plot(T_Samp[:], np.gradient(Z_g, axis=0), c='b')
+
+    ax10_1.set_xlabel(r'$t$')
+    ax10_1.set_ylabel(r'$u$')
+
+    fig11 = plt.figure(11)
+    ax11_1 = plt.axes()
+
+    plot11_1 = ax11_1.scatter(T_Samp[:, :], K_g[:, :], s=1)
+    plot11_2 = ax11_1.plot(T_Samp[:, :], K_g[:, :])
+    plt.colorbar(plot11_1)
+    ax11_1.set_xlabel(r'$z$')
+    ax11_1.set_ylabel(r'$t$')
 
 
 ### Old Test Code ################
@@ -261,14 +426,17 @@ ax11_1.set_ylabel(r'$t$')
 # plt.colorbar(plot5_1)
 
 
+
+
 # ------------------#
 
 # a function that takes the K_g array and creates a CVS file for the each segment in the format of "timestamp, material"
 
 
-def makeCVSfiles():  # the array K_g stores the material values for each segment at each time step including time steps where the material is not changing
-    folderName = "Actuation_data"
-    total_number_segments = N_SpatElem
+def makeCVSfiles(K_g, params=None, folderName=folderName):  # the array K_g stores the material values for each segment at each time step including time steps where the material is not changing
+    params = defaultParameters(params)
+    x_SpatElem, t_SampTime = sampleGrid(params)
+    total_number_segments = K_g.shape[1]
 
     try:
         # check that the total runtime is not greater than 65535 milliseconds
@@ -304,4 +472,176 @@ def makeCVSfiles():  # the array K_g stores the material values for each segment
         return False
 
 
-print("Generating actuation data successful?: {}".format(makeCVSfiles()))
+# a function that takes the K_g array and writes the binary payload for each segment as "<segment>.bin"
+def makeBINfiles(K_g, params=None, folderName=folderName):
+    params = defaultParameters(params)
+    x_SpatElem, t_SampTime = sampleGrid(params)
+    total_number_segments = K_g.shape[1]
+
+    try:
+        # check that the total runtime is not greater than 65535 milliseconds
+        if len(t_SampTime) > 65535:
+            raise ValueError("Total runtime must be less than 65535 ms")
+
+        # convert to milliseconds and material values as integers for all segments at once
+        timestamps = np.rint(t_SampTime * 1000).astype(np.int64)
+        values = np.rint(K_g).astype(np.int64)
+
+        for segment_number in range(total_number_segments):
+            segmentFilePath = folderName + '/' + \
+                str(segment_number + 1) + ".bin"
+            with open(segmentFilePath, 'wb') as file:
+                file.write(packActuationData(
+                    timestamps, values[:, segment_number]))
+        return True
+
+    except Exception as e:
+        print("Failed to save actuation data: {}".format(e))
+        return False
+
+
+def removeFile(filePath):  # remove a file if it exists, used to clean up after a failed write
+    try:
+        os.remove(filePath)
+    except FileNotFoundError:
+        pass
+
+
+# a function that writes the whole K_g array and its metadata into a single experiment file
+#    the format is defined in shiveFormat.py, the overseer memory-maps the file and slices out one segment column
+#    the file is written next to the target and renamed over it, so swapping experiments is atomic
+def makeExperimentFile(K_g, params=None, folderName=folderName, fileName="experiment.shive"):
+    params = defaultParameters(params)
+    x_SpatElem, t_SampTime = sampleGrid(params)
+    filePath = folderName + '/' + fileName
+
+    try:
+        # check that the total runtime is not greater than 65535 milliseconds
+        if len(t_SampTime) > 65535:
+            raise ValueError("Total runtime must be less than 65535 ms")
+
+        timestamps = np.rint(t_SampTime * 1000).astype('<u2')
+        values = np.ascontiguousarray(np.rint(K_g), dtype='<i2')
+
+        try:
+            with open(filePath + ".tmp", 'wb') as file:
+                file.write(experimentFileHeader(params, values.shape[0], values.shape[1]))
+                file.write(timestamps.tobytes())
+                file.write(values.tobytes())
+            os.replace(filePath + ".tmp", filePath)
+        except BaseException:  # also when interrupted, a half-written .tmp file is not left behind
+            removeFile(filePath + ".tmp")
+            raise
+        return True
+
+    except Exception as e:
+        print("Failed to save experiment file: {}".format(e))
+        return False
+
+
+# generate the experiment and write it block by block, each block of K_g rows goes to the file straight away
+#    so the memory use stays the same however long or dense the experiment is;
+#    the file is the same as makeExperimentFile(generate(params), params) writes
+def makeExperimentFileStreamed(params=None, folderName=folderName, fileName="experiment.shive",
+                               blockElements=blockElements):
+    params = defaultParameters(params)
+    N_SampTime = sampleCount(params)
+    filePath = folderName + '/' + fileName
+
+    try:
+        # check that the total runtime is not greater than 65535 milliseconds
+        if N_SampTime > 65535:
+            raise ValueError("Total runtime must be less than 65535 ms")
+
+        try:
+            with open(filePath + ".tmp", 'wb') as file:
+                file.write(experimentFileHeader(params, N_SampTime, params["N_SpatElem"]))
+                # all timestamps come before the values, they need no evaluation
+                file.write(np.rint(sampleTimes(params, 0, N_SampTime) * 1000).astype('<u2').tobytes())
+                for start, t_SampTime, K_g in generateBlocks(params, blockElements):
+                    file.write(np.ascontiguousarray(np.rint(K_g), dtype='<i2').tobytes())
+            os.replace(filePath + ".tmp", filePath)
+        except BaseException:  # a block that fails to generate or write leaves no partial .tmp file behind
+            removeFile(filePath + ".tmp")
+            raise
+        return True
+
+    except Exception as e:
+        print("Failed to save experiment file: {}".format(e))
+        return False
+
+
+# K_g as stored in an experiment file (rounded, -100 = skip), memory-mapped instead of read
+def loadExperimentFile(folderName=folderName, fileName="experiment.shive"):
+    return mapExperimentFile(folderName + '/' + fileName)[2]
+
+
+# ------------------#
+# Parameter sweeps: every parameter set is generated in its own process and written to its own folder
+#    only the file name and the outcome go back to the main process, never the arrays
+
+
+# every combination of the given parameter values as a list of params dictionaries
+#    e.g. parameterGrid(smt_t=[.1, .5], KeyTol=[1, 2]) gives 4 parameter sets
+def parameterGrid(**values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+# the folder name of a parameter set, its "name" if given, otherwise the parameters that differ from the defaults
+def experimentName(params):
+    defaultParameters(params)  # a misspelled parameter raises its ValueError here, before it is compared
+    if "name" in params:
+        return str(params["name"])
+    defaults = defaultParameters()
+    return "_".join("{}={}".format(key, value) for key, value in sorted(params.items())
+                    if value != defaults[key]) or "default"
+
+
+# generate one experiment and write it into folderName, returns (folderName, success)
+#    a module-level function, so ProcessPoolExecutor can send it to the worker processes
+#    the experiment file is written block by block, the .bin and .csv files are made from it
+def generateExperiment(params, folderName=folderName, output_bin=False, output_csv=False):
+    try:
+        os.makedirs(folderName, exist_ok=True)
+        success = makeExperimentFileStreamed(params, folderName)
+        if not success or not (output_bin or output_csv):
+            return folderName, success
+        K_g = loadExperimentFile(folderName)
+        if output_bin:
+            success = makeBINfiles(K_g, params, folderName) and success
+        if output_csv:
+            success = makeCVSfiles(K_g, params, folderName) and success
+        return folderName, success
+    except Exception as e:
+        print("Failed to generate experiment {}: {}".format(folderName, e))
+        return folderName, False
+
+
+# generate all parameter sets in parallel, each into outputFolder/<experiment name>
+#    max_workers defaults to the number of cores, returns [(folder, success)] in the order of paramSets
+def sweep(paramSets, outputFolder=folderName + "/sweep", max_workers=None, output_bin=False, output_csv=False):
+    folders = [outputFolder + '/' + experimentName(params) for params in paramSets]
+    if len(set(folders)) != len(folders):
+        raise ValueError("Two parameter sets have the same name, give them a distinct \"name\"")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(generateExperiment, paramSets, folders,
+                                 itertools.repeat(output_bin), itertools.repeat(output_csv)))
+
+
+if __name__ == "__main__":
+    params = defaultParameters()
+    Z_g = makeZ_g(params)
+    K_g = simplifyZ_g(Z_g, params)
+    printKeyframeReport(keyframeReport(K_g, Z_g))
+    plotExperiment(params, Z_g, K_g)
+
+    # Set to True to also write the per-segment .bin or .csv files, the overseer uses the experiment file when present
+    output_bin = False
+    output_csv = False
+
+    print("Generating experiment file successful?: {}".format(makeExperimentFile(K_g, params)))
+    if output_bin:
+        print("Generating .bin actuation data successful?: {}".format(makeBINfiles(K_g, params)))
+    if output_csv:
+        print("Generating .csv actuation data successful?: {}".format(makeCVSfiles(K_g, params)))
@@ -419,6 +419,138 @@ c        # FG Checkerboard - psi_FG_cbd(x,t,u1,u2,m,n,eps,tau,smt_x,smt_t)
 
 
 
+c     =================================================
+c     Array versions of the functions above
+c     Each takes the flattened x and t arrays (xx_Samp, tt_Samp in
+c     GEN.py) and returns the whole result vector in one call
+c     =================================================
+
+c     =================================================
+      subroutine psi_lam_vec(xx,tt,npts,u1,u2,m,eps,V,zz)
+c     =================================================
+
+      implicit none
+
+      integer npts, i
+      double precision xx(npts), tt(npts), zz(npts)
+      double precision u1, u2, m, eps, V
+
+cf2py intent(in) xx, tt, u1, u2, m, eps, V
+cf2py integer intent(hide), depend(xx) :: npts=len(xx)
+cf2py intent(out) zz
+
+      do i=1,npts
+         zz(i)=psi_lam(xx(i),tt(i),u1,u2,m,eps,V)
+      enddo
+
+      return
+      end subroutine psi_lam_vec
+
+
+
+
+
+c     =================================================
+      subroutine psi_FG_lam_vec(xx,tt,npts,u1,u2,m,eps,V,smt,zz)
+c     =================================================
+
+      implicit none
+
+      integer npts, i
+      double precision xx(npts), tt(npts), zz(npts)
+      double precision u1, u2, m, eps, V, smt
+
+cf2py intent(in) xx, tt, u1, u2, m, eps, V, smt
+cf2py integer intent(hide), depend(xx) :: npts=len(xx)
+cf2py intent(out) zz
+
+      do i=1,npts
+         zz(i)=psi_FG_lam(xx(i),tt(i),u1,u2,m,eps,V,smt)
+      enddo
+
+      return
+      end subroutine psi_FG_lam_vec
+
+
+
+
+
+c     =================================================
+      subroutine psi_FG_cbd_vec(xx,tt,npts,u1,u2,m,n,eps,tau,
+     &                                            smt_x,smt_t,zz)
+c     =================================================
+
+      implicit none
+
+      integer npts, i
+      double precision xx(npts), tt(npts), zz(npts)
+      double precision u1, u2, m, n, eps, tau, smt_x, smt_t
+
+cf2py intent(in) xx, tt, u1, u2, m, n, eps, tau, smt_x, smt_t
+cf2py integer intent(hide), depend(xx) :: npts=len(xx)
+cf2py intent(out) zz
+
+      do i=1,npts
+         zz(i)=psi_FG_cbd(xx(i),tt(i),u1,u2,m,n,eps,tau,smt_x,smt_t)
+      enddo
+
+      return
+      end subroutine psi_FG_cbd_vec
+
+
+
+
+
+c     =================================================
+      subroutine psi_cbd_vec(xx,tt,npts,u1,u2,m,n,eps,tau,zz)
+c     =================================================
+
+      implicit none
+
+      integer npts, i
+      double precision xx(npts), tt(npts), zz(npts)
+      double precision u1, u2, m, n, eps, tau
+
+cf2py intent(in) xx, tt, u1, u2, m, n, eps, tau
+cf2py integer intent(hide), depend(xx) :: npts=len(xx)
+cf2py intent(out) zz
+
+      do i=1,npts
+         zz(i)=psi_cbd(xx(i),tt(i),u1,u2,m,n,eps,tau)
+      enddo
+
+      return
+      end subroutine psi_cbd_vec
+
+
+
+
+
+c     =================================================
+      subroutine f_u_vec(xx,tt,npts,u1,u2,geo,zz)
+c     =================================================
+
+      implicit none
+
+      integer npts, i, geo
+      double precision xx(npts), tt(npts), zz(npts)
+      double precision u1, u2
+
+cf2py intent(in) xx, tt, u1, u2, geo
+cf2py integer intent(hide), depend(xx) :: npts=len(xx)
+cf2py intent(out) zz
+
+      do i=1,npts
+         zz(i)=f_u(xx(i),tt(i),u1,u2,geo)
+      enddo
+
+      return
+      end subroutine f_u_vec
+
+
+
+
+
 
 
 
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy port of the property-control functions in TestFunctions.f90
+
+Every function takes whole arrays for x and t (scalars work as well) and
+returns an array of the broadcast shape, so a complete mesh is evaluated
+in a single call instead of one Fortran call per point.
+The argument order and names follow the Fortran module one-to-one.
+"""
+import numpy as np
+
+
+power = 4.  # same as the /pow/ common block in the Fortran module
+
+# Geometry used by f_u, same as the /DM_Geo_Param/ block in the Fortran module
+f_u_eps = 1.
+f_u_tau = 1.
+f_u_m1 = float(np.float32(.4))  # single precision literal (m1=.4) in Fortran
+f_u_n1 = .5
+f_u_alp = .5
+f_u_bet = .5
+f_u_Vel = 1.
+f_u_x1 = -2.
+f_u_x2 = 8.
+
+
+def f(x):
+    x = np.asarray(x, dtype=float)
+    return np.where(x > 0., 1. - 1./(1. + np.where(x > 0., x, 0.)**power), 0.)
+
+
+def H(x, smt):
+    # smt = 0 gives the sharp step; the division is left to IEEE rules like in Fortran
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (np.asarray(x, dtype=float) + smt/2.)/smt
+        fx = f(x)
+        return fx/(fx + f(1. - x))
+
+
+def Rect(x, a, b, smt):
+    return H(x - a, smt) - H(x - b, smt)
+
+
+def PI(x, t, a, b, c, d, smt_x, smt_t):
+    return Rect(x, a, b, smt_x)*Rect(t, c, d, smt_t)
+
+
+def psi_lam(x, t, u1, u2, m, eps, V):
+    return psi_FG_lam(x, t, u1, u2, m, eps, V, 0.)
+
+
+def psi_FG_lam(x, t, u1, u2, m, eps, V, smt):
+    theta = np.arctan(V)
+
+    eta = np.cos(theta)*np.asarray(x, dtype=float) - \
+        np.sin(theta)*np.asarray(t, dtype=float)
+    etaM = np.mod(eta, eps)
+
+    p1 = Rect(etaM, 0., m*eps, smt)
+    p2 = Rect(etaM, m*eps, eps, smt)
+    b1 = Rect(etaM, -(1. - m)*eps, 0., smt)
+    b2 = Rect(etaM, eps, (1. + m)*eps, smt)
+
+    return (u1*p1 + u2*p2) + (u2*b1 + u1*b2)
+
+
+def psi_FG_cbd(x, t, u1, u2, m, n, eps, tau, smt_x, smt_t):
+    xM = np.mod(np.asarray(x, dtype=float), eps)
+    tM = np.mod(np.asarray(t, dtype=float), tau)
+
+    # The x and t factors of PI are evaluated once per interval and reused,
+    # the Fortran version recomputes them for each of the 16 cells
+    x_lo = Rect(xM, -(1. - m)*eps, 0., smt_x)
+    x_1 = Rect(xM, 0., m*eps, smt_x)
+    x_2 = Rect(xM, m*eps, eps, smt_x)
+    x_hi = Rect(xM, eps, (1. + m)*eps, smt_x)
+
+    t_lo = Rect(tM, -(1. - n)*tau, 0., smt_t)
+    t_1 = Rect(tM, 0., n*tau, smt_t)
+    t_2 = Rect(tM, n*tau, tau, smt_t)
+    t_hi = Rect(tM, tau, (1. + n)*tau, smt_t)
+
+    p1 = x_1*t_1
+    p2 = x_2*t_1
+    p3 = x_2*t_2
+    p4 = x_1*t_2
+
+    b1 = x_1*t_lo
+    b2 = x_2*t_lo
+    b3 = x_hi*t_lo
+
+    b4 = x_hi*t_1
+    b5 = x_hi*t_2
+    b6 = x_hi*t_hi
+
+    b7 = x_2*t_hi
+    b8 = x_1*t_hi
+    b9 = x_lo*t_hi
+
+    b10 = x_lo*t_2
+    b11 = x_lo*t_1
+    b12 = x_lo*t_lo
+
+    return u1*(p1 + p3) + u2*(p2 + p4) + \
+        u2*(b1 + b3 + b5 + b7 + b9 + b11) + \
+        u1*(b2 + b4 + b6 + b8 + b10 + b12)
+
+
+def psi_cbd(x, t, u1, u2, m, n, eps, tau):
+    xM = np.mod(np.asarray(x, dtype=float), eps)
+    tM = np.mod(np.asarray(t, dtype=float), tau)
+
+    # u1 where both or neither of the coordinates are in the first part of the period
+    return np.where((xM < m*eps) == (tM < n*tau), float(u1), float(u2))
+
+
+def f_u(x, t, u1, u2, geo):
+    x = np.asarray(x, dtype=float)
+    t = np.asarray(t, dtype=float)
+
+    if geo == 1:  # Lamination
+        u = psi_lam(x, t, u1, u2, f_u_m1, f_u_eps, f_u_Vel)
+    elif geo == 2:  # Checkerboard
+        u = psi_cbd(x, t, u1, u2, f_u_m1, f_u_n1, f_u_eps, f_u_tau)
+    elif geo == 3:  # FG Lamination
+        u = psi_FG_lam(x, t, u1, u2, f_u_m1, f_u_eps, f_u_Vel, f_u_alp)
+    elif geo == 4:  # FG Checkerboard
+        u = psi_FG_cbd(x, t, u1, u2, f_u_m1, f_u_n1,
+                       f_u_eps, f_u_tau, f_u_alp, f_u_bet)
+    else:
+        raise ValueError("Unknown geometry: {}".format(geo))
+
+    return np.where((x >= f_u_x1) & (x <= f_u_x2), u, float(u1))
+
+
+# ------------------#
+
+# compares every function against the compiled Fortran module (Test) on a random set of points
+#    returns the largest absolute difference found for each function
+def compareWithFortran(n_points=2000, seed=0):
+    import Test
+    g = Test.testfunctions
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-3., 3., n_points)
+    t = rng.uniform(-3., 3., n_points)
+    u1, u2, m, n, eps, tau, V, smt_x, smt_t = 0., 255., .5, .5, .5, 1., .1, .1, .5
+
+    cases = {
+        "f": (lambda x, t: f(x), lambda x, t: g.f(x)),
+        "H": (lambda x, t: H(x, smt_x), lambda x, t: g.h(x, smt_x)),
+        "Rect": (lambda x, t: Rect(x, -.2, .3, smt_x),
+                 lambda x, t: g.rect(x, -.2, .3, smt_x)),
+        "PI": (lambda x, t: PI(x, t, -.2, .3, .1, .7, smt_x, smt_t),
+               lambda x, t: g.pi(x, t, -.2, .3, .1, .7, smt_x, smt_t)),
+        "psi_lam": (lambda x, t: psi_lam(x, t, u1, u2, m, eps, V),
+                    lambda x, t: g.psi_lam(x, t, u1, u2, m, eps, V)),
+        "psi_FG_lam": (lambda x, t: psi_FG_lam(x, t, u1, u2, m, eps, V, smt_x),
+                       lambda x, t: g.psi_fg_lam(x, t, u1, u2, m, eps, V, smt_x)),
+        "psi_cbd": (lambda x, t: psi_cbd(x, t, u1, u2, m, n, eps, tau),
+                    lambda x, t: g.psi_cbd(x, t, u1, u2, m, n, eps, tau)),
+        "psi_FG_cbd": (lambda x, t: psi_FG_cbd(x, t, u1, u2, m, n, eps, tau, smt_x, smt_t),
+                       lambda x, t: g.psi_fg_cbd(x, t, u1, u2, m, n, eps, tau, smt_x, smt_t)),
+    }
+    for geo in range(1, 5):
+        cases["f_u({})".format(geo)] = (lambda x, t, geo=geo: f_u(x, t, u1, u2, geo),
+                                        lambda x, t, geo=geo: g.f_u(x, t, u1, u2, geo))
+
+    maxError = {}
+    for name, (numpyFn, fortranFn) in cases.items():
+        z_np = numpyFn(x, t)
+        z_f = np.array(list(map(fortranFn, x, t)))
+        maxError[name] = float(np.nanmax(np.abs(z_np - z_f), initial=0.))
+        # the sharp functions are undefined exactly on an interface, both sides must agree on that
+        if not np.array_equal(np.isnan(z_np), np.isnan(z_f)):
+            maxError[name] = np.inf
+    return maxError
+
+
+if __name__ == "__main__":
+    for name, err in compareWithFortran().items():
+        print("{:12s} max |numpy - fortran| = {:.3e}".format(name, err))
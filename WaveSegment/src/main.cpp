@@ -54,6 +54,8 @@ void moveServo(int angleMQTT)
 //------------------------------------//---MISC function stubs
 
 void beginPairing(); // do not remove as the function is defined lower in the program, but needs to be called before it is defined
+bool handleActuationData();
+bool handleActuationChunk();
 void resetActuationVars();
 void actuate();
 
@@ -315,6 +317,12 @@ void setup()
   // subscribe to the data topic for this segment
   client.subscribe(getSegmentDataPath().c_str(), 1); // c_str() converts the String to a char array
 
+  // subscribe to the chunked data topic for this segment
+  client.subscribe(getSegmentChunkPath().c_str(), 1); // c_str() converts the String to a char array
+
+  // subscribe to the live stream frames, QoS 0 as a late frame is replaced by the next one anyway
+  client.subscribe(overseerStreamPath, 0);
+
   // synchronize time with NTP
   NTPSetup() == true ? currSegmentStatus = Connected : currSegmentStatus = Fault;
   if (currSegmentStatus == Fault) // early exit if the wifi connection fails
@@ -342,6 +350,68 @@ static uint16_t actuationTimestampNext = 0, actuationTimeStampLast = 0;
 static uint8_t actuationValueNext = 127, actuationValueLast = 127;
 static uint16_t nextActuationTriByteIndex = 0;
 
+// compact payloads start with the magic byte and version, and are never a multiple of 3 bytes long (more in readme.md)
+const byte compactPayloadMagic = 0xA5, compactPayloadVersion = 1;
+static bool isCompactPayload = false;
+static uint32_t compactByteIndex = 0, compactPointIndex = 0, compactPointCount = 0, compactRunRemaining = 0;
+static uint16_t compactTimestamp = 0, compactRunDt = 0;
+static int16_t compactRunDv = 0;
+static uint8_t compactValue = 127;
+
+// read an unsigned LEB128 varint from the compact payload
+uint32_t readCompactVarint()
+{
+  uint32_t value = 0;
+  uint8_t shift = 0;
+  while (compactByteIndex < receivedDataLength)
+  {
+    byte varintByte = receivedData[compactByteIndex++];
+    value |= (uint32_t)(varintByte & 0x7F) << shift;
+    if (varintByte < 0x80)
+      break;
+    shift += 7;
+  }
+  return value;
+}
+
+// go back to the first point of the compact payload
+void rewindCompactPayload()
+{
+  compactByteIndex = 2; // skip the magic byte and version
+  compactPointCount = readCompactVarint();
+  compactPointIndex = 0;
+  compactRunRemaining = 0;
+  compactTimestamp = 0;
+  compactValue = 127;
+}
+
+// decode the next point of the compact payload into compactTimestamp and compactValue
+void nextCompactPoint()
+{
+  if (compactRunRemaining == 0)
+  {
+    uint32_t header = readCompactVarint();
+    if (header & 1) // linear record: count points with the same time and value step
+    {
+      compactRunDt = header >> 1;
+      compactRunRemaining = readCompactVarint();
+      uint32_t zigzag = readCompactVarint();
+      compactRunDv = (int16_t)((zigzag >> 1) ^ -(int32_t)(zigzag & 1));
+    }
+    else // point record: time step followed by the value
+    {
+      compactTimestamp += header >> 1;
+      compactValue = receivedData[compactByteIndex++];
+      compactPointIndex++;
+      return;
+    }
+  }
+  compactTimestamp += compactRunDt;
+  compactValue += compactRunDv;
+  compactRunRemaining--;
+  compactPointIndex++;
+}
+
 bool handleMQTTmessage()
 {
   // check if the message is a command
@@ -399,11 +469,31 @@ bool handleMQTTmessage()
       sendSegmentStatus(getSegmentStatusString().c_str());
     }
 
-    if (commandStr == "ack") // overseer's acknowledgement of a message received
+    if (commandStr.startsWith("ack")) // overseer's acknowledgement of a message received {{ack::segment_number}}
     {
+      int colonIndex = commandStr.lastIndexOf(":");
+      if (colonIndex != -1)
+        segmentNumber = commandStr.substring(colonIndex + 1).toInt();
       mqttAck = true;
     }
 
+    if (commandStr.startsWith("ping")) // clock sync request {{ping::sequence}}, answered with the segment clock
+    {
+      int colonIndex = commandStr.lastIndexOf(":");
+      String message = "pong::" + commandStr.substring(colonIndex + 1) + "::" + String((long long)NTP.millis());
+      sendSegmentData(message.c_str());
+    }
+
+    if (commandStr.startsWith("start")) // a start time already corrected for this segment's clock {{start::epoch_ms}}
+    {
+      if (currSegmentStatus == Ready)
+      {
+        int colonIndex = commandStr.lastIndexOf(":");
+        actuationStartTime = atoll(commandStr.substring(colonIndex + 1).c_str());
+        currSegmentStatus = Running;
+      }
+    }
+
     if (commandStr == "restart") // restart the ESP32
     {
       ESP.restart();
@@ -440,14 +530,87 @@ bool handleMQTTmessage()
 
   if (receivedTopic == getSegmentDataPath())
   {
-    moveServo(receivedData[2]); // pre-move to the starting position
-    currSegmentStatus = Ready;
-    return true;
+    return handleActuationData();
+  }
+
+  if (receivedTopic == getSegmentChunkPath())
+  {
+    return handleActuationChunk();
   }
   // if the topic is not recognized, return false
   return false;
 }
 
+// the whole actuation data is in receivedData, check its format and get ready to run
+bool handleActuationData()
+{
+  isCompactPayload = receivedDataLength % 3 != 0 && receivedData[0] == compactPayloadMagic;
+  if (isCompactPayload)
+  {
+    if (receivedData[1] != compactPayloadVersion)
+    {
+      isCompactPayload = false;
+      sendSegmentStatus("Warning: unsupported payload version");
+      return true;
+    }
+    // pre-move to the starting position
+    rewindCompactPayload();
+    nextCompactPoint();
+    moveServo(compactValue);
+    rewindCompactPayload();
+  }
+  else if (receivedDataLength % 3 != 0)
+  {
+    sendSegmentStatus("Warning: unknown payload format");
+    return true;
+  }
+  else
+  {
+    moveServo(receivedData[2]); // pre-move to the starting position
+  }
+  currSegmentStatus = Ready;
+  return true;
+}
+
+// a chunk of the actuation data has been copied into receivedData, acknowledge it
+//    once all chunks of the transfer are in, the data is handled like a whole data message
+static uint16_t chunkTransferID = 0, chunksReceivedCount = 0;
+static byte chunksReceived[maxChunkCount / 8];
+static bool chunkTransferActive = false;
+
+bool handleActuationChunk()
+{
+  if (!receivedChunkValid) // a damaged chunk is not acknowledged, the overseer sends it again
+    return true;
+
+  if (!chunkTransferActive || receivedChunkTransferID != chunkTransferID)
+  {
+    // the first chunk of a new transfer
+    chunkTransferActive = true;
+    chunkTransferID = receivedChunkTransferID;
+    chunksReceivedCount = 0;
+    memset(chunksReceived, 0, sizeof(chunksReceived));
+    currSegmentStatus = Downloading;
+  }
+
+  if (!(chunksReceived[receivedChunkIndex / 8] & (1 << (receivedChunkIndex % 8))))
+  {
+    chunksReceived[receivedChunkIndex / 8] |= 1 << (receivedChunkIndex % 8);
+    chunksReceivedCount++;
+  }
+
+  String message = "chunk_ack::" + String(chunkTransferID) + "::" + String(receivedChunkIndex);
+  sendSegmentData(message.c_str());
+
+  if (chunksReceivedCount >= receivedChunkCount)
+  {
+    chunkTransferActive = false;
+    receivedDataLength = receivedChunkTotalLength;
+    return handleActuationData();
+  }
+  return true;
+}
+
 //------------------------------------//---state machine
 
 void beginPairing()
@@ -471,6 +634,8 @@ void resetActuationVars()
   actuationValueNext = 127;
   actuationValueLast = 127;
   nextActuationTriByteIndex = 0;
+  if (isCompactPayload)
+    rewindCompactPayload();
 
   if (!servo.attached())
   {
@@ -484,23 +649,39 @@ void nextActuationValue()
   actuationTimeStampLast = actuationTimestampNext;
   actuationValueLast = actuationValueNext;
 
-  // data format is always 3 bytes in little endian format:
-  //    2 bytes representing the timestamp as uint16_t
-  //    1 byte representing the material value as uint8_t
-  byte byteOne = receivedData[nextActuationTriByteIndex * 3 + 0];
-  byte byteTwo = receivedData[nextActuationTriByteIndex * 3 + 1];
-  byte byteThree = receivedData[nextActuationTriByteIndex * 3 + 2];
-
-  actuationTimestampNext = (byteTwo << 8) + byteOne;
-  actuationValueNext = byteThree;
-  nextActuationTriByteIndex++;
+  if (isCompactPayload)
+  {
+    nextCompactPoint();
+    actuationTimestampNext = compactTimestamp;
+    actuationValueNext = compactValue;
 
-  if (nextActuationTriByteIndex * 3 >= receivedDataLength) // we have reached the end of actuation data
+    if (compactPointIndex >= compactPointCount) // we have reached the end of actuation data
+    {
+      rewindCompactPayload();
+      timeOffset += actuationTimestampNext;
+      actuationTimestampNext = 0;
+    }
+  }
+  else
   {
-    nextActuationTriByteIndex = 0;
-    timeOffset += actuationTimestampNext;
-    actuationTimestampNext = 0;
-    // Serial.println(timeOffset);
+    // data format is always 3 bytes in little endian format:
+    //    2 bytes representing the timestamp as uint16_t
+    //    1 byte representing the material value as uint8_t
+    byte byteOne = receivedData[nextActuationTriByteIndex * 3 + 0];
+    byte byteTwo = receivedData[nextActuationTriByteIndex * 3 + 1];
+    byte byteThree = receivedData[nextActuationTriByteIndex * 3 + 2];
+
+    actuationTimestampNext = (byteTwo << 8) + byteOne;
+    actuationValueNext = byteThree;
+    nextActuationTriByteIndex++;
+
+    if (nextActuationTriByteIndex * 3 >= receivedDataLength) // we have reached the end of actuation data
+    {
+      nextActuationTriByteIndex = 0;
+      timeOffset += actuationTimestampNext;
+      actuationTimestampNext = 0;
+      // Serial.println(timeOffset);
+    }
   }
   nextActuationTime = actuationStartTime + timeOffset + actuationTimestampNext; // lookahead timestamp
   // Serial.println(timeOffset + actuationTimestampNext);
@@ -542,6 +723,21 @@ void loop()
     handleMQTTmessage();
   }
 
+  //---- a move_all message moves the servo like a move command, with this segment's own position
+  if (moveAllReceived)
+  {
+    moveAllReceived = false;
+    moveServo(receivedMoveAllPosition);
+  }
+
+  //---- live stream frames move the servo while no uploaded experiment is running
+  if (streamFrameReceived)
+  {
+    streamFrameReceived = false;
+    if (currSegmentStatus == Paired || currSegmentStatus == Ready)
+      moveServo(receivedStreamPosition);
+  }
+
   //----state machine
 
   switch (currSegmentStatus)
@@ -12,6 +12,7 @@ PubSubClient client(wifiClient);
 const uint16_t maxDataLength = 65535, maxMessageLength = 128;
 const char *overseerCommandPath = "ShiveWorks/overseer/command";
 const char *overseerReturnPath = "ShiveWorks/overseer/return";
+const char *overseerStreamPath = "ShiveWorks/overseer/stream";
 // auto-assigned is the unique MAC address of the ESP32 backwards in HEX
 // this ID gets called once more when subscribing to the MQTT broker
 const char *segmentPathMain = "ShiveWorks/segment/";
@@ -41,6 +42,11 @@ String getSegmentDataPath()
     return segmentPathMain + String(ESP.getEfuseMac(), HEX) + "/data";
 }
 
+String getSegmentChunkPath()
+{
+    return segmentPathMain + String(ESP.getEfuseMac(), HEX) + "/chunk";
+}
+
 //------------------------------------//---wifi
 
 const uint32_t KEEP_ALIVE_INTERVAL = 30; // seconds to keep the connection alive, do not set to less than 15
@@ -157,6 +163,7 @@ bool mqtt_reconnect()
             if (client.connect(clientId.c_str(), MQTT_USER, MQTT_PASSWORD))
             {
                 client.setCallback(callbackMSG); // set the callback function that will handle incoming messages               )
+                wifiClient.setNoDelay(true);     // send small messages (pongs, acks) at once instead of batching them
 #ifdef DEBUG
                 Serial.println("Connected to broker");
 #endif
@@ -192,6 +199,101 @@ uint16_t receivedMessageLength = 0; // length of received message
 byte *receivedData = new byte[maxDataLength]; // shared buffer pointer for received data
 uint16_t receivedDataLength = 0;              // length of received data
 
+// chunk header: uint16 transfer ID, uint16 chunk index, uint16 chunk count, uint32 offset, uint32 total length, uint32 CRC-32
+const uint8_t chunkHeaderSize = 18;
+bool receivedChunkValid = false;
+uint16_t receivedChunkTransferID = 0, receivedChunkIndex = 0, receivedChunkCount = 0;
+uint32_t receivedChunkTotalLength = 0;
+
+// standard CRC-32 (same as zlib.crc32 in Python)
+uint32_t crc32(const byte *data, uint32_t length)
+{
+    uint32_t crc = 0xFFFFFFFF;
+    for (uint32_t i = 0; i < length; i++)
+    {
+        crc ^= data[i];
+        for (uint8_t bit = 0; bit < 8; bit++)
+            crc = (crc >> 1) ^ (0xEDB88320 & (0 - (crc & 1)));
+    }
+    return ~crc;
+}
+
+// little-endian integers from the chunk header
+uint16_t readUint16(const byte *data) { return data[0] | (data[1] << 8); }
+uint32_t readUint32(const byte *data) { return data[0] | (data[1] << 8) | (data[2] << 16) | ((uint32_t)data[3] << 24); }
+
+// check a received chunk and copy its data into the data buffer at its offset
+void receiveChunk(byte *payload, unsigned int length)
+{
+    receivedChunkValid = false;
+    if (length < chunkHeaderSize)
+        return;
+
+    receivedChunkTransferID = readUint16(payload);
+    receivedChunkIndex = readUint16(payload + 2);
+    receivedChunkCount = readUint16(payload + 4);
+    uint32_t offset = readUint32(payload + 6);
+    receivedChunkTotalLength = readUint32(payload + 10);
+    uint32_t crc = readUint32(payload + 14);
+
+    uint32_t dataLength = length - chunkHeaderSize;
+    if (receivedChunkCount > maxChunkCount || receivedChunkIndex >= receivedChunkCount ||
+        receivedChunkTotalLength > maxDataLength || offset + dataLength > receivedChunkTotalLength)
+        return;
+    if (crc32(payload + chunkHeaderSize, dataLength) != crc)
+        return;
+
+    for (uint32_t i = 0; i < dataLength; i++)
+    {
+        receivedData[offset + i] = payload[chunkHeaderSize + i];
+    }
+    receivedChunkValid = true;
+}
+
+// stream frame: uint16 sequence, uint32 frame time in microseconds, then one uint8 position per segment
+const uint8_t streamHeaderSize = 6;
+uint8_t segmentNumber = 0; // set by the overseer's "ack::<segment number>", 0 until the segment is paired
+bool streamFrameReceived = false;
+uint8_t receivedStreamPosition = 127;
+static uint16_t lastStreamSequence = 0;
+static bool hasStreamSequence = false;
+
+// take this segment's position out of a stream frame, frames older than the last one are dropped
+void receiveStreamFrame(byte *payload, unsigned int length)
+{
+    if (segmentNumber == 0 || length < streamHeaderSize + segmentNumber)
+        return;
+
+    uint16_t sequence = readUint16(payload);
+    if (hasStreamSequence && (int16_t)(sequence - lastStreamSequence) <= 0 && sequence != 0)
+        return; // a new stream starts again from sequence 0
+    lastStreamSequence = sequence;
+    hasStreamSequence = true;
+
+    receivedStreamPosition = payload[streamHeaderSize + segmentNumber - 1];
+    streamFrameReceived = true;
+}
+
+// move_all message: "move_all::" followed by one uint8 position per segment
+const char *moveAllPrefix = "move_all::";
+const uint8_t moveAllPrefixLength = 10;
+bool moveAllReceived = false;
+uint8_t receivedMoveAllPosition = 127;
+
+bool isMoveAllMessage(byte *payload, unsigned int length)
+{
+    return length >= moveAllPrefixLength && memcmp(payload, moveAllPrefix, moveAllPrefixLength) == 0;
+}
+
+// take this segment's position out of a move_all message
+void receiveMoveAll(byte *payload, unsigned int length)
+{
+    if (segmentNumber == 0 || length < moveAllPrefixLength + segmentNumber)
+        return;
+    receivedMoveAllPosition = payload[moveAllPrefixLength + segmentNumber - 1];
+    moveAllReceived = true;
+}
+
 void callbackMSG(char *topic, byte *payload, unsigned int length)
 {
 #ifdef DEBUG
@@ -211,6 +313,20 @@ void callbackMSG(char *topic, byte *payload, unsigned int length)
     Serial.println();
 #endif
 
+    // stream frames bypass the message buffer, so they never overwrite a command waiting to be handled
+    if (strcmp(topic, overseerStreamPath) == 0)
+    {
+        receiveStreamFrame(payload, length);
+        return;
+    }
+
+    // the binary move_all message would not fit the command buffer with many segments, only this segment's byte is kept
+    if (strcmp(topic, overseerCommandPath) == 0 && isMoveAllMessage(payload, length))
+    {
+        receiveMoveAll(payload, length);
+        return;
+    }
+
     // send a warning status if the message is over maxDataLength so as to not overflow the buffer
     if (length > maxDataLength - 1)
     {
@@ -234,6 +350,12 @@ void callbackMSG(char *topic, byte *payload, unsigned int length)
             receivedDataLength = length;
         }
 
+        else if (receivedTopic == getSegmentChunkPath())
+        {
+            // chunk payload is a header followed by a part of the data
+            receiveChunk(payload, length);
+        }
+
         else
         {
             // command payload will always be a string
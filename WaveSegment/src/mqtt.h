@@ -16,9 +16,11 @@ extern PubSubClient client;
 //-------------------- MQTT messages --------------------
 extern const char* overseerCommandPath;
 extern const char* overseerReturnPath;
+extern const char* overseerStreamPath;
 extern const char* segmentPathMain;
 extern String getSegmentCommandPath();
 extern String getSegmentDataPath();
+extern String getSegmentChunkPath();
 
 bool sendOverseerMessage(const char* message);
 bool sendSegmentStatus(const char* message);
@@ -31,3 +33,18 @@ extern byte* receivedData; //shared buffer for received
 extern uint16_t receivedMessageLength; //length of received message
 extern uint16_t receivedDataLength; //length of received message
 extern bool messageReceived;        //flag for received message
+
+//-------------------- chunked data upload --------------------
+const uint16_t maxChunkCount = 1024;      //largest number of chunks in one transfer, chunkMaxCount in overseer.py must match
+extern bool receivedChunkValid;           //the last chunk passed the header and CRC checks and was copied into receivedData
+extern uint16_t receivedChunkTransferID;  //transfer the last chunk belongs to
+extern uint16_t receivedChunkIndex;       //index of the last chunk
+extern uint16_t receivedChunkCount;       //number of chunks in the transfer
+extern uint32_t receivedChunkTotalLength; //length of the whole payload
+
+//-------------------- streaming --------------------
+extern uint8_t segmentNumber;           //number of this segment in the fleet, given by the overseer when paired
+extern bool streamFrameReceived;        //flag for a new stream frame
+extern uint8_t receivedStreamPosition;  //this segment's position from the latest stream frame
+extern bool moveAllReceived;            //flag for a new move_all message
+extern uint8_t receivedMoveAllPosition; //this segment's position from the latest move_all message
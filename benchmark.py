@@ -0,0 +1,296 @@
+# © Jakub Jandus 2023
+# Benchmark suite for the ShiveWorks generation, packing and upload path
+#
+#     python benchmark.py                         runs everything and saves benchmark_results/<date>.json
+#     python benchmark.py compare old.json new.json   prints the change of every entry between two runs
+#
+# the upload benchmarks need a broker on 127.0.0.1:1884, mosquitto is started with the repo's mosquitto.conf
+#    when it is installed and nothing listens on the port yet, otherwise they are skipped
+
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+repoPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(repoPath, "PropertyControlFunctions"))
+
+import GEN  # noqa: E402
+import overseer  # noqa: E402
+
+
+# ---------------------- Settings ----------------------#
+
+experimentLengths_ms = [1000, 10000, 65535]  # every entry runs for each of these lengths
+segmentCounts = [40, 400, 4000]  # fleet sizes of the upload benchmarks
+repeats = 3  # runs per entry, the slow ones (over slowEntry_s) run once
+slowEntry_s = 5.0
+uploadMaxBytes = 64 * 1024 * 1024  # upload entries sending more than this in total are skipped
+uploadTimeout_s = 120  # seconds to wait for all uploaded messages to arrive at the receiver
+resultsFolder = os.path.join(repoPath, "benchmark_results")
+
+
+# ---------------------- Timing ----------------------#
+
+# run fn repeatedly and return the timing statistics, setup runs before every run and is not timed
+def timeRuns(fn, setup=None, runs=None):
+    times = []
+    for run in range(runs or repeats):
+        if setup is not None:
+            setup()
+        startTime = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - startTime)
+        if run == 0 and times[0] > slowEntry_s:
+            break
+    return {"runs": len(times), "mean_s": float(np.mean(times)), "min_s": float(np.min(times)),
+            "max_s": float(np.max(times))}
+
+
+def printEntry(entry):
+    if "skipped" in entry:
+        print("{:42s} {:>6} ms {:>5} segments  skipped: {}".format(
+            entry["benchmark"], entry["length_ms"], entry.get("segments", "-"), entry["skipped"]))
+        return
+    print("{:42s} {:>6} ms {:>5} segments  {:9.4f} s (min {:.4f} s, {} runs)".format(
+        entry["benchmark"], entry["length_ms"], entry.get("segments", "-"), entry["mean_s"], entry["min_s"],
+        entry["runs"]))
+
+
+# ---------------------- Generation and packing ----------------------#
+
+def benchmarkGeneration(length_ms, folder):
+    params = GEN.defaultParameters({"Tf": length_ms / 1000})
+    entries = []
+
+    entries.append({"benchmark": "GEN.makeZ_g (mesh evaluation)",
+                    **timeRuns(lambda: GEN.makeZ_g(params))})
+    K_g = GEN.generate(params)
+    entries.append({"benchmark": "GEN.makeCVSfiles",
+                    **timeRuns(lambda: GEN.makeCVSfiles(K_g, params, folder))})
+    entries.append({"benchmark": "GEN.makeExperimentFile",
+                    **timeRuns(lambda: GEN.makeExperimentFile(K_g, params, folder, "bench.shive"))})
+    entries.append({"benchmark": "GEN.makeExperimentFileStreamed",
+                    **timeRuns(lambda: GEN.makeExperimentFileStreamed(params, folder, "streamed.shive"))})
+
+    # the overseer side, reading segment 1 back from the files written above
+    segmentDataPath = folder + "/1.csv"
+    entries.append({"benchmark": "overseer.loadSegmentData",
+                    **timeRuns(lambda: overseer.loadSegmentData(segmentDataPath))})
+    with open(segmentDataPath) as file:
+        rows = [line.strip().split(',') for line in file]
+    entries.append({"benchmark": "overseer.convertSegmentData", "rows": len(rows),
+                    **timeRuns(lambda: [overseer.convertSegmentData(row) for row in rows])})
+
+    # cold packing of all segments, once from the .csv files and once from the experiment file
+    rig = overseer.Overseer(segment_count=K_g.shape[1], actuationDataPath=folder)
+    for source, experimentFileName in ((".csv", "missing.shive"), ("experiment", "bench.shive")):
+        rig.experimentFileName = experimentFileName
+
+        def packAll():
+            for segment_no in rig.allSegments():
+                rig.packageSegmentData(segment_no)
+
+        def coldCache():
+            rig.clearPayloadCache()
+            rig.experiment = None
+        entries.append({"benchmark": "overseer.packageSegmentData ({})".format(source),
+                        "segments": rig.segment_count, **timeRuns(packAll, coldCache)})
+
+    for entry in entries:
+        entry["length_ms"] = length_ms
+        printEntry(entry)
+    return entries
+
+
+# ---------------------- Upload ----------------------#
+
+def brokerAvailable():
+    try:
+        with socket.create_connection((overseer.broker, overseer.port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+# start mosquitto with the repo's configuration if no broker runs yet, returns the process or None
+def startBroker():
+    if brokerAvailable() or shutil.which("mosquitto") is None:
+        return None
+    process = subprocess.Popen(["mosquitto", "-c", os.path.join(repoPath, "mosquitto.conf")],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(50):
+        if brokerAvailable():
+            break
+        time.sleep(0.1)
+    return process
+
+
+# counts the data messages that made it through the broker
+class UploadReceiver:
+
+    def __init__(self):
+        self.count = 0
+        self.expected = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.client = mqtt.Client("Benchmark Receiver")
+        self.client.on_socket_open = overseer.setNoDelay
+        self.client.on_message = self.on_message
+        self.client.connect(overseer.broker, overseer.port)
+        self.client.subscribe(overseer.segmentPath + "/+/data", 1)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, message):
+        with self.lock:
+            self.count += 1
+            if self.count >= self.expected:
+                self.done.set()
+
+    def expect(self, expected):
+        with self.lock:
+            self.count = 0
+            self.expected = expected
+            self.done.clear()
+
+    def wait(self):
+        if not self.done.wait(uploadTimeout_s):
+            raise TimeoutError("{} of {} uploads arrived".format(self.count, self.expected))
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# time the upload of every segment's payload, from the first publish until the receiver has all of them
+#    the payloads are packed beforehand, so only the upload path is measured
+def benchmarkUpload(length_ms, segment_count, folder, receiver):
+    params = GEN.defaultParameters({"Tf": length_ms / 1000})
+    K_g = GEN.generate(params)
+    timestamps = np.rint(GEN.sampleGrid(params)[1] * 1000).astype(np.int64)
+    columnBytes = [len(GEN.packActuationData(timestamps, np.rint(K_g[:, column]).astype(np.int64)))
+                   for column in range(K_g.shape[1])]
+    # the columns of the experiment are repeated for larger fleets
+    payloadBytes = sum(columnBytes[index % len(columnBytes)] for index in range(segment_count))
+    entryBase = {"length_ms": length_ms, "segments": segment_count, "bytes": int(payloadBytes)}
+    if payloadBytes > uploadMaxBytes:
+        entries = [{"benchmark": name, **entryBase, "skipped": "{:.0f} MB over uploadMaxBytes".format(
+            payloadBytes / 1e6)} for name in ("overseer.segmentSendData", "overseer.uploadSegments")]
+        for entry in entries:
+            printEntry(entry)
+        return entries
+
+    K_g = np.tile(K_g, (1, -(-segment_count // K_g.shape[1])))[:, :segment_count]
+    GEN.makeExperimentFile(K_g, params, folder)
+    IDsPath = folder + "/segmentsID.csv"
+    with open(IDsPath, 'w') as file:
+        file.write("\n".join("bench{}".format(segment_no) for segment_no in range(1, segment_count + 1)) + "\n")
+
+    rig = overseer.Overseer(segment_count=segment_count, actuationDataPath=folder, filePath=IDsPath,
+                            clientName="Benchmark Overseer")
+    rig.connect()
+    try:
+        for segment_no in rig.allSegments():  # warm the payload cache
+            rig.packageSegmentData(segment_no)
+
+        def sendEach():
+            for segment_no in rig.allSegments():
+                rig.segmentSendData(segment_no)
+            receiver.wait()
+
+        def sendBulk():
+            rig.uploadSegments(rig.allSegments())
+            receiver.wait()
+
+        entries = []
+        for name, fn in (("overseer.segmentSendData", sendEach), ("overseer.uploadSegments", sendBulk)):
+            entry = {"benchmark": name, **entryBase,
+                     **timeRuns(fn, lambda: receiver.expect(segment_count))}
+            entry["throughput_MBps"] = payloadBytes / entry["mean_s"] / 1e6
+            printEntry(entry)
+            entries.append(entry)
+        return entries
+    finally:
+        rig.close()
+
+
+# ---------------------- Running ----------------------#
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repoPath, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "commit": commit}
+
+
+def runBenchmarks():
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for length_ms in experimentLengths_ms:
+            results += benchmarkGeneration(length_ms, folder)
+
+        broker = startBroker()
+        try:
+            if not brokerAvailable():
+                print("No broker on {}:{}, skipping the upload benchmarks".format(overseer.broker, overseer.port))
+                results += [{"benchmark": name, "length_ms": length_ms, "segments": segment_count,
+                             "skipped": "no broker"}
+                            for name in ("overseer.segmentSendData", "overseer.uploadSegments")
+                            for segment_count in segmentCounts for length_ms in experimentLengths_ms]
+            else:
+                receiver = UploadReceiver()
+                try:
+                    for segment_count in segmentCounts:
+                        for length_ms in experimentLengths_ms:
+                            results += benchmarkUpload(length_ms, segment_count, folder, receiver)
+                finally:
+                    receiver.close()
+        finally:
+            if broker is not None:
+                broker.terminate()
+                broker.wait()
+
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "results": results}
+
+
+# key of an entry, to find the same entry in another run
+def entryKey(entry):
+    return (entry["benchmark"], entry["length_ms"], entry.get("segments"))
+
+
+def compareResults(oldPath, newPath):
+    with open(oldPath) as file:
+        old = {entryKey(entry): entry for entry in json.load(file)["results"]}
+    with open(newPath) as file:
+        new = json.load(file)["results"]
+    for entry in new:
+        before = old.get(entryKey(entry))
+        if before is None or "mean_s" not in before or "mean_s" not in entry:
+            continue
+        change = entry["mean_s"] / before["mean_s"] - 1
+        print("{:42s} {:>6} ms {:>5} segments  {:9.4f} s -> {:9.4f} s  {:+7.1%}".format(
+            entry["benchmark"], entry["length_ms"], entry.get("segments", "-"), before["mean_s"],
+            entry["mean_s"], change))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        compareResults(sys.argv[2], sys.argv[3])
+    else:
+        report = runBenchmarks()
+        os.makedirs(resultsFolder, exist_ok=True)
+        resultsPath = os.path.join(resultsFolder, time.strftime("%Y%m%d-%H%M%S") + ".json")
+        with open(resultsPath, 'w') as file:
+            json.dump(report, file, indent=1)
+        print("Results written to {}".format(resultsPath))
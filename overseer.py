@@ -1,19 +1,40 @@
 # © Jakub Jandus 2023
 # Overseer class for the ShiveWorks project
 # This class is responsible for the communication with the segments and the movement of the segments
+#
+# it can be imported and driven from a script, one Overseer per rig (broker):
+#     from overseer import Overseer
+#     rig = Overseer(broker="127.0.0.1", port=1884)
+#     rig.connect()
+#     rig.upload()
+#     rig.timesync()
+#     rig.start()
+#     ...
+#     rig.close()
+# running the file itself opens the interactive console on top of the same class
 
 import paho.mqtt.client as mqtt
+import asyncio
+import contextlib
 import csv
+import json
+import os
+import socket
+import threading
 import time
-from datetime import datetime, timezone
+import zlib
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from struct import pack, unpack
+
+from shiveFormat import mapExperimentFile, packActuationData, payloadDtype
 # from sys import getsizeof
 
 # ---TODO--- #
 
 
 # ---------------------- MQTT Setup----------------------#
-# callback function for when a message is received and filter according to topic
+# default settings, every one of them can be given to the Overseer separately
 
 segment_count = 40  # number of segments
 overseerCommandPath = "ShiveWorks/overseer/command"
@@ -22,215 +43,251 @@ overseerReturnPath = "ShiveWorks/overseer/return"
 # expanded into ShiveWorks/segment/segmentID/command further below
 segmentPath = "ShiveWorks/segment"
 
-# local path to the folder containing the actuation data in .csv format
+# local path to the folder containing the actuation data in .bin or .csv format
 actuationDataPath = "./PropertyControlFunctions/Actuation_data"
+# single experiment file for all segments written by GEN.py, used instead of the per-segment files when present
+experimentFileName = "experiment.shive"
+# file the segment IDs are saved to, one line per segment number
+filePath = "segmentsID.csv"
 
 # milliseconds of countdown time after a "start" command is issued; do not set to less than 3000
+#    used when some segments have no clock offset from "timesync", they then rely on their own NTP clocks
 countdown_ms = 5000
+# milliseconds of countdown time when every paired segment has a fresh clock offset
+syncedCountdown_ms = 500
 
 # local broker address, if the server runs on the same PC as the client never change it
 broker = "127.0.0.1"
 port = 1884
-client = mqtt.Client("Master PC")
-
-
-def main():  # main method where the MQTT client is connected
-    # try to connect to the broker, if not successful wait 5 seconds and try again
-    while True:
-        try:
-            client.connect(broker, port)
-            break
-        except:
-            print("Connection to broker failed, retrying in 5 seconds...")
-            time.sleep(5)
-
-    client.subscribe(overseerReturnPath, 1)
-    client.loop_start()
-    client.on_message = on_message
-    loadSegmentsID()
-
-
-# --- MQTT Received Message Callback functions ---#
-
-latestOverseerReturnMessage = ""  # global storage of the latest message received
-# list of the status of all segments ordered by segment number
-statusList = [None]*segment_count
-
-
-def on_message(client, userdata, message):
-    global latestOverseerReturnMessage  # use the global variable
-    print("Message received: " + str(message.payload.decode("utf-8")))
-    topic = message.topic
-    msgPayload = message.payload.decode("utf-8")
-
-    # filter only the return messages
-    if (topic == overseerReturnPath):
-        latestOverseerReturnMessage = str(msgPayload)
-
-    # filter only the status messages
-    elif (topic.startswith(segmentPath) and topic.endswith("status")):
-        # get the segment ID from the topic -> convert it to the segment number
-        segment_no = getSegmentNumber(topic.split("/")[2])
-        # get the status from the message
-        status = str(msgPayload)
-        # store the status in the list
-        statusList[segment_no - 1] = status
-
-        # special case to confirm pairing
-        #   if a segment ID is assigned and a message "Connected" is received, send back an "ack"
-        if status == "Connected" and getSegmentID(segment_no) != "Null":
-            segmentAck(segment_no)
-
-    # filter only the data return messages
-    elif (topic.startswith(segmentPath) and topic.endswith("data")):
-        # get the segment ID from the topic -> convert it to the segment number
-        segment_no = getSegmentNumber(topic.split("/")[2])
-        # get the status from the message
-        data = msgPayload
-        # store the data in the return list
-        # statusList[segment_no - 1] = status
+clientName = "Master PC"  # has to be different for every overseer connected to the same broker
+
+# print every received message to the console, with many segments this keeps the network thread busy
+printMessages = False
+# subscribe once to the status and return topics of all segments using wildcards,
+#    otherwise every paired segment is subscribed to individually
+useWildcardSubscriptions = True
+
+
+def setNoDelay(client, userdata, sock):  # ping/pong and acknowledgements are tiny, send them without Nagle's delay
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+# ---------------------- Telemetry ----------------------#
+# per-segment counters and fixed-size ring buffers, memory stays bounded however long the overseer runs
+#    arrival: time of every message received from the segment
+#    latency: publish-to-acknowledgement time of uploads and status requests
+#    status:  status transitions as (time, status code), codes follow the SegmentStatus enum of the firmware
+
+telemetryHistory = 256  # entries kept per segment in each ring buffer
+statusCodes = {"Initializing": 0, "Connected": 1, "Pairing": 2, "Paired": 3, "Downloading": 4,
+               "Ready": 5, "Running": 6, "Estop": 7, "Fault": 8}
+statusNames = {code: name for name, code in statusCodes.items()}
+
+
+class FleetTelemetry:
+    transitionDtype = np.dtype([('time', 'f8'), ('status', 'i2')])
+
+    def __init__(self, count, history):
+        self.count = count
+        self.history = history
+        self._lock = threading.Lock()
+        self.startTime = time.time()
+        self.arrivals = np.zeros((count, history))
+        self.arrivalCount = np.zeros(count, dtype=np.int64)
+        self.latencies = np.zeros((count, history))
+        self.latencyCount = np.zeros(count, dtype=np.int64)
+        self.brokerAcks = np.zeros((count, history))
+        self.brokerAckCount = np.zeros(count, dtype=np.int64)
+        self.transitions = np.zeros((count, history), dtype=self.transitionDtype)
+        self.transitionCount = np.zeros(count, dtype=np.int64)
+        self.lastStatus = np.full(count, -1, dtype=np.int16)
+        self.bytesReceived = np.zeros(count, dtype=np.int64)
+        self.bytesUploaded = np.zeros(count, dtype=np.int64)
+        self.uploadCount = np.zeros(count, dtype=np.int64)
+        self.errorCount = np.zeros(count, dtype=np.int64)
+
+    def _append(self, ring, counts, index, value):  # called with the lock held
+        ring[index, counts[index] % self.history] = value
+        counts[index] += 1
+
+    def _ordered(self, ring, counts, index):  # the entries of one segment, oldest first
+        n = counts[index]
+        if n <= self.history:
+            return ring[index, :n].copy()
+        return np.roll(ring[index], -(n % self.history))
+
+    def recordMessage(self, segment_no, size):
+        with self._lock:
+            self._append(self.arrivals, self.arrivalCount,
+                         segment_no - 1, time.time())
+            self.bytesReceived[segment_no - 1] += size
+
+    def recordStatus(self, segment_no, status):
+        code = statusCodes.get(status, -1)
+        with self._lock:
+            if status.startswith("Warning"):
+                self.errorCount[segment_no - 1] += 1
+            if code != -1 and code != self.lastStatus[segment_no - 1]:
+                self.lastStatus[segment_no - 1] = code
+                self._append(self.transitions, self.transitionCount,
+                             segment_no - 1, (time.time(), code))
+
+    def recordLatency(self, segment_no, seconds):
+        with self._lock:
+            self._append(self.latencies, self.latencyCount,
+                         segment_no - 1, seconds)
+
+    # seconds is the time until the segment acknowledged the upload (chunked uploads),
+    #    brokerSeconds the time until the broker's PUBACK (plain uploads, the segment does not acknowledge them)
+    #    only the segment acknowledgements count as segment latency
+    def recordUpload(self, segment_no, size, success, seconds=None, brokerSeconds=None):
+        with self._lock:
+            if success:
+                self.bytesUploaded[segment_no - 1] += size
+                self.uploadCount[segment_no - 1] += 1
+                if brokerSeconds is not None:
+                    self._append(self.brokerAcks, self.brokerAckCount,
+                                 segment_no - 1, brokerSeconds)
+            else:
+                self.errorCount[segment_no - 1] += 1
+        if success and seconds is not None:
+            self.recordLatency(segment_no, seconds)
+
+    def recordError(self, segment_no):
+        with self._lock:
+            self.errorCount[segment_no - 1] += 1
+
+    def summary(self, segment_no):  # machine-readable statistics of one segment
+        index = segment_no - 1
+        with self._lock:
+            arrivals = self._ordered(self.arrivals, self.arrivalCount, index)
+            latencies = self._ordered(
+                self.latencies, self.latencyCount, index)
+            brokerAcks = self._ordered(
+                self.brokerAcks, self.brokerAckCount, index)
+            transitions = self._ordered(
+                self.transitions, self.transitionCount, index)
+            stats = {
+                "segment": segment_no,
+                "status": statusNames.get(int(self.lastStatus[index])),
+                "status_transitions": int(self.transitionCount[index]),
+                "messages": int(self.arrivalCount[index]),
+                "bytes_received": int(self.bytesReceived[index]),
+                "uploads": int(self.uploadCount[index]),
+                "bytes_uploaded": int(self.bytesUploaded[index]),
+                "errors": int(self.errorCount[index]),
+            }
+        # message rate over the messages still in the ring buffer
+        span = arrivals[-1] - arrivals[0] if len(arrivals) > 1 else 0.
+        stats["message_rate_hz"] = (len(arrivals) - 1) / span if span > 0 else None
+        stats["last_message_age_s"] = time.time() - arrivals[-1] if len(arrivals) else None
+        stats["latency_mean_ms"] = float(latencies.mean() * 1000) if len(latencies) else None
+        stats["latency_p95_ms"] = float(np.percentile(latencies, 95) * 1000) if len(latencies) else None
+        stats["latency_max_ms"] = float(latencies.max() * 1000) if len(latencies) else None
+        stats["broker_ack_mean_ms"] = float(brokerAcks.mean() * 1000) if len(brokerAcks) else None
+        stats["broker_ack_max_ms"] = float(brokerAcks.max() * 1000) if len(brokerAcks) else None
+        stats["recent_transitions"] = [(float(t), statusNames[int(code)])
+                                       for t, code in transitions[-8:]]
+        return stats
+
+    def dump(self, path):  # write the statistics of all segments as JSON
+        with open(path, 'w') as file:
+            json.dump({"start_time": self.startTime, "time": time.time(),
+                       "segments": [self.summary(segment_no) for segment_no in range(1, self.count + 1)]},
+                      file, indent=1)
+
+
+# print a table of the segments that have any telemetry
+def formatStat(value, spec):  # a statistic that may be missing
+    return format(value, spec) if value is not None else "-"
+
+
+# segment latency: replies and chunk acknowledgements of the segment,
+#    PUBACK: plain uploads, which only the broker acknowledges
+def printTelemetry(telemetry):
+    print("  #  status        msgs   rate/s  segment lat ms (mean/p95/max)  PUBACK ms (mean/max)"
+          "  uploads  kB up  errors  transitions")
+    for segment_no in range(1, telemetry.count + 1):
+        stats = telemetry.summary(segment_no)
+        if not (stats["messages"] or stats["uploads"] or stats["errors"]):
+            continue
+        print("{:3d}  {:12s} {:5d}  {:>7s}  {:>9s}/{:>9s}/{:>9s}  {:>9s}/{:>9s}  {:7d}  {:5.1f}  {:6d}  {:11d}".format(
+            segment_no, stats["status"] or "-", stats["messages"], formatStat(stats["message_rate_hz"], ".2f"),
+            formatStat(stats["latency_mean_ms"], ".1f"), formatStat(stats["latency_p95_ms"], ".1f"),
+            formatStat(stats["latency_max_ms"], ".1f"),
+            formatStat(stats["broker_ack_mean_ms"], ".1f"), formatStat(stats["broker_ack_max_ms"], ".1f"),
+            stats["uploads"], stats["bytes_uploaded"] / 1000, stats["errors"], stats["status_transitions"]))
 
 
 # ---------------------- Dealing with segment identification ----------------------#
 
-segments_ID = []  # an ordered list of all the segments' ID's
-# this list is 100 elements long, with each element being a string
-filePath = "segmentsID.csv"
-
-
-# get the ID of a segment from the list and return it as a string (Null if not found or empty)
-def getSegmentID(segment_no):
-    try:
-        if int(segment_no) > segment_count or int(segment_no) < 1:
-            raise IndexError
-        else:
-            return segments_ID[int(segment_no) - 1]
-
-    except IndexError:
-        print("Segment number out of range")
-        return "Null"
-
-
-# get the segment number from the ID and return it as an integer (-1 if not found)
-def getSegmentNumber(segmentID):
-    for i in range(len(segments_ID)):
-        if segments_ID[i] == segmentID:
-            return int(i + 1)
-    return int(-1)
-
-
-def addSegmentID(segment_no):  # add a segment ID to the list and save it to a .csv file
-    # check if there is a segment available for assignment
-    if latestOverseerReturnMessage.startswith('pairing'):
-
-        # check if the segment number is valid (between 0 and maxSegmentNumber)
-        if int(segment_no) < 0 and int(segment_no) > segment_count:
-            print("Invalid segment number")
-            return False
-        else:
-            ID_str = latestOverseerReturnMessage.split("::")[1]
-            segments_ID[int(segment_no) - 1] = ID_str
-            saveSegmentsID()
-
-            # subscribe to the status and data return of the new segment
-            segmentSub(segment_no)
-
-            # acknowledge to the segment that pairing was successful
-            segmentAck(segment_no)
-
-            # print segment number and id that has been added to the list
-            print("Segment #{} has been added to the list with ID: {}".format(
-                segment_no, ID_str))
-            return True
-    else:
-        print("No segment available for assignment")
-        return False
-
-
-# remove a segment ID from the list and save it to a .csv file
-def removeSegmentID(segment_no):
-    # check if the segment number is valid
-    if getSegmentID(segment_no) == "Null":
-        print("Invalid segment number")
-        return False
-    else:
-        segments_ID[int(segment_no) - 1] = "Null"
-        saveSegmentsID()
-
-        # unsubscribe from the status and data return of the segment
-        segmentUnSub(segment_no)
-
-        # print segment number and id that has been removed from the list
-        print("Segment #{} has been removed from the list".format(segment_no))
-        return True
-
-
-def loadSegmentsID():   # load the segments ID from a .csv file
-    try:
-        segments_ID.clear()  # clear the list before loading
-        with open(filePath, 'r') as file:
-            reader = csv.reader(file, delimiter=' ')
-            for row in reader:
-                segments_ID.append(row[0])
-
-        # subscribe to the status of all segments if they exist
-        for i in range(1, len(segments_ID) + 1):
-            if getSegmentID(i) != "Null":
-                # subscribe to the status and data return of the new segment
-                segmentSub(i)
-        return True
-    except Exception as e:
-        print("Failed to load segments ID list: {}".format(e))
-        return False
-
-
-def saveSegmentsID():   # save the segments ID to a .csv file
-    try:
-        with open(filePath, 'w', newline='') as file:
-            writer = csv.writer(file, delimiter=' ')
-            for ID in segments_ID:
-                writer.writerow([ID])
-        return True
-    except Exception as e:
-        print("Failed to save segments ID list: {}".format(e))
-        return False
-
-
-def clearSegmentID(segment_no):  # clear a segment ID from the list
-    return segmentCommand(segment_no, "restart") and removeSegmentID(segment_no)
-
+# registry of the paired segments: the ID of every segment number ("Null" if not paired),
+#    the reverse ID -> number index and the precomputed topics of every paired segment
+#    updates build a new state and swap it in at once, lookups from the paho network thread never scan or lock
+class SegmentRegistry:
+    topicNames = ("command", "return", "status", "data", "chunk")
+
+    def __init__(self, count):
+        self.count = count
+        self._lock = threading.Lock()
+        self._state = self._buildState(["Null"] * count)
+
+    def _buildState(self, IDs):
+        IDs = tuple(IDs)
+        numbers = {}
+        topics = {}
+        for index, ID in enumerate(IDs):
+            if ID != "Null":
+                numbers.setdefault(ID, index + 1)
+                topics[index + 1] = {whatToDo: segmentPath + "/" + ID + "/" + whatToDo
+                                     for whatToDo in self.topicNames}
+        return IDs, numbers, topics
+
+    def IDs(self):  # ordered tuple of the IDs of all segment numbers
+        return self._state[0]
+
+    def getID(self, segment_no):  # ID of a segment number, "Null" if it is not paired
+        return self._state[0][segment_no - 1]
+
+    def getNumber(self, segmentID):  # segment number of an ID, -1 if it is not paired
+        return self._state[1].get(segmentID, -1)
+
+    def getTopic(self, segment_no, whatToDo):  # topic of a paired segment, None otherwise
+        topics = self._state[2].get(segment_no)
+        return topics.get(whatToDo) if topics is not None else None
+
+    def assign(self, segment_no, segmentID):
+        with self._lock:
+            IDs = list(self._state[0])
+            IDs[segment_no - 1] = segmentID
+            self._state = self._buildState(IDs)
+
+    def remove(self, segment_no):
+        self.assign(segment_no, "Null")
+
+    def load(self, IDs):  # replace all IDs at once, padded or cut to the segment count
+        IDs = list(IDs)[:self.count]
+        with self._lock:
+            self._state = self._buildState(
+                IDs + ["Null"] * (self.count - len(IDs)))
 
-def clearSegmentsID():  # clear the segments ID list
-    segmentMasterCommand("stop")
-    segments_ID.clear()
-    for i in range(segment_count):
-        segments_ID.append("Null")
-    saveSegmentsID()
-    print("Segments ID list has been cleared, resetting program...")
-    client.loop_stop()
-    quit()
 
 # ---------------------- Actuation Data Conversion ----------------------#
 
-
-# a 2D array to hold the actuation time and value [[1000, 255], [1001, 254]]
+# the actuation data is a 2D array of the actuation time and value [[1000, 255], [1001, 254]]
 # timestamps are stored as 16-bit unsigned integers, so the number shall be between 0 and 65535 only
 # actuation value is an 8-bit unsigned integer, so the number shall be between 0 and 255 only
 #   with the exception that a .csv value of -100 means skip this actuation line
-actuationDataArray = []
 
 
-# function to first load all the .csv file from the folder (if it exists) into an array while type-checking
+# function to first load a .csv file (if it exists) into an array while type-checking, None if it fails
 #    writes the first and last value regardless of if it should be dropped
 #    if no value is present at start (= start material value is -100), assume center position of 127
-def loadSegmentData(segment_no):
-    global actuationDataArray
+def loadSegmentData(segmentDataPath):
+    actuationDataArray = []
     firstRow = [0, 0]
     lastRow = [0, 0]
 
-    segmentDataPath = actuationDataPath + '/' + segment_no + ".csv"
-    actuationDataArray.clear()
-
     try:
         with open(segmentDataPath, 'r') as file:
             reader = csv.reader(file, delimiter=',')
@@ -250,7 +307,7 @@ def loadSegmentData(segment_no):
 
     except Exception as e:
         print("Failed to load segments data: {}".format(e))
-        return False
+        return None
 
     # convert the values to integers
     firstRow[0] = int(firstRow[0])
@@ -258,10 +315,6 @@ def loadSegmentData(segment_no):
     lastRow[0] = int(lastRow[0])
     lastRow[1] = int(lastRow[1])
 
-    # print(firstRow)
-    # print(lastRow)
-    # print(actuationDataArray)
-
     # if the first row is value-empty, then write the default middle value
     if firstRow[1] == -100:
         firstRow[1] = 127
@@ -274,17 +327,11 @@ def loadSegmentData(segment_no):
         lastActuationData = actuationDataArray[-1][1]
         actuationDataArray.append([lastTimestamp, lastActuationData])
 
-    # print("----")
-    # print(firstRow)
-    # print(lastRow)
-    # print(actuationDataArray)
-
-    return True
+    return actuationDataArray
 
 
 # function that checks the timestamp and value validity
 def convertSegmentData(CSV_row):
-    global actuationDataArray, firstRow, lastRow
     CSV_row_clean = []
 
     timestamp = int(CSV_row[0])
@@ -304,192 +351,1548 @@ def convertSegmentData(CSV_row):
     return CSV_row_clean
 
 
-# function that takes the processed data and returns a struct formatted as binary uint16_t, uint8_t, ...
-def packageSegmentData(segment_no):
-    global actuationDataArray
-    # https://docs.python.org/3.7/library/struct.html#struct.pack_into
-    if loadSegmentData(segment_no):
-        # formatting for the ESP32 shall be little-endian, 2-byte unsigned short, 1-byte unsigned char
-        packed_binary = bytes()
-        # packed_binary = pack('<' + 'HB' * len(actuationDataArray), *actuationDataArray[:][0], *actuationDataArray[:][1])
+# function that packs the rows of a .csv file loaded by loadSegmentData
+#    formatting for the ESP32 shall be little-endian, 2-byte unsigned short, 1-byte unsigned char
+#    all rows are packed at once through the structured payloadDtype instead of one pack() per row
+def packSegmentData(actuationDataArray):
+    rows = np.array(actuationDataArray, dtype=np.int64).reshape(-1, 2)
+    records = np.empty(len(rows), dtype=payloadDtype)
+    records['timestamp'] = rows[:, 0]
+    records['value'] = rows[:, 1]
+    return records.tobytes()
 
-        for i in range(len(actuationDataArray)):
-            packed_binary += pack('<' + 'HB',
-                                  actuationDataArray[i][0], actuationDataArray[i][1])
 
-        # print(packed_binary)
-        # print(unpack('<' + 'HB' * len(actuationDataArray), packed_binary))
-        # check that the packed binary is smaller than 64kB
-        # print("Payload size: " + str(getsizeof(packed_binary)))
-        return packed_binary
-    # return packed byte struct
-    return None
+# function that loads the binary payload written by GEN.py (makeBINfiles) for a segment
+#    the file is already in the ESP32 format and filtered, so it is only checked and passed on
+def loadSegmentBinary(segmentDataPath):
+    try:
+        with open(segmentDataPath, 'rb') as file:
+            packed_binary = file.read()
+    except Exception as e:
+        print("Failed to load segments data: {}".format(e))
+        return None
+
+    # every record is 3 bytes long: uint16_t timestamp, uint8_t value
+    if len(packed_binary) == 0 or len(packed_binary) % 3 != 0:
+        print("Invalid binary actuation data in {}".format(segmentDataPath))
+        return None
+    return packed_binary
+
+
+# ---------------------- Compact Payload Format ----------------------#
+# an optional smaller payload format, selected with payloadFormat = "compact"
+#    header: magic byte 0xA5, version byte 0x01, varint number of points
+#    point record:  varint (dt << 1), uint8 value
+#                   -> one point dt milliseconds after the previous one
+#    linear record: varint (dt << 1 | 1), varint count, zigzag varint dv
+#                   -> count points, each dt milliseconds and dv value after the previous one (ramps and holds)
+#    dt of the first record is the absolute first timestamp
+#    a zero byte is appended when the length is a multiple of 3, legacy <HB payloads always are,
+#    so the segment can tell the formats apart by the header together with the length
+
+payloadFormat = "legacy"  # "legacy" (3-byte <HB records) or "compact"
+compactPayloadMagic = 0xA5
+compactPayloadVersion = 1  # the first version of the format, raise it (here and in main.cpp) when the layout changes
+compactMinRun = 3  # shortest run of equal steps that is sent as a linear record
+
+
+def encodeVarint(value, out):  # append an unsigned LEB128 varint to a bytearray
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decodeVarint(data, index):  # read an unsigned LEB128 varint, returns (value, next index)
+    value = 0
+    shift = 0
+    while True:
+        byte = data[index]
+        index += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, index
+        shift += 7
+
+
+# convert a legacy <HB payload into the compact format
+def encodeCompactPayload(packed_binary):
+    records = np.frombuffer(packed_binary, dtype=payloadDtype)
+    timestamps = records['timestamp'].astype(np.int64)
+    values = records['value'].astype(np.int64)
+
+    dt = np.diff(timestamps)
+    dv = np.diff(values)
+    if np.any(dt < 0):
+        raise ValueError("Timestamps must not decrease")
+
+    out = bytearray([compactPayloadMagic, compactPayloadVersion])
+    encodeVarint(len(records), out)
+    encodeVarint(int(timestamps[0]) << 1, out)
+    out.append(int(values[0]))
+
+    # group the steps between neighbouring points into runs of equal (dt, dv)
+    stepChanges = np.flatnonzero((dt[1:] != dt[:-1]) | (dv[1:] != dv[:-1])) + 1
+    runStarts = np.concatenate(([0], stepChanges)).astype(np.int64)
+    runEnds = np.concatenate((stepChanges, [len(dt)])).astype(np.int64)
+
+    for start, end in zip(runStarts.tolist(), runEnds.tolist()):
+        if start >= end:  # a single point payload has no steps
+            continue
+        stepDt = int(dt[start])
+        stepDv = int(dv[start])
+        if end - start >= compactMinRun:
+            encodeVarint((stepDt << 1) | 1, out)
+            encodeVarint(end - start, out)
+            encodeVarint((stepDv << 1) ^ (stepDv >> 63), out)  # zigzag
+        else:
+            for i in range(start, end):
+                encodeVarint(int(dt[i]) << 1, out)
+                out.append(int(values[i + 1]))
+
+    if len(out) % 3 == 0:
+        out.append(0)
+    return bytes(out)
+
+
+# convert a compact payload back into the legacy <HB payload
+def decodeCompactPayload(payload):
+    if len(payload) < 3 or payload[0] != compactPayloadMagic or len(payload) % 3 == 0:
+        raise ValueError("Not a compact payload")
+    if payload[1] != compactPayloadVersion:
+        raise ValueError(
+            "Unsupported payload version: {}".format(payload[1]))
+
+    pointCount, index = decodeVarint(payload, 2)
+    records = np.empty(pointCount, dtype=payloadDtype)
+    timestamp = 0
+    value = 0
+    point = 0
+    while point < pointCount:
+        header, index = decodeVarint(payload, index)
+        stepDt = header >> 1
+        if header & 1:  # linear record
+            count, index = decodeVarint(payload, index)
+            zigzag, index = decodeVarint(payload, index)
+            stepDv = (zigzag >> 1) ^ -(zigzag & 1)
+            for _ in range(count):
+                timestamp += stepDt
+                value += stepDv
+                records[point] = (timestamp, value)
+                point += 1
+        else:  # point record
+            timestamp += stepDt
+            value = payload[index]
+            index += 1
+            records[point] = (timestamp, value)
+            point += 1
+    return records.tobytes()
+
+
+# ---------------------- Bulk Segment Functions ----------------------#
+# publishes to many segments at once, keeping up to publishWindow QoS 1 messages in flight
+#    each message is tracked until the broker acknowledges it or publishTimeout_s runs out
+
+publishWindow = 8  # number of unacknowledged messages in flight during bulk uploads and restarts
+publishTimeout_s = 5.0  # seconds to wait for the broker's acknowledgement of each message
+
+
+# print the outcome and timing of a bulk operation per segment
+def printBulkReport(results, action):
+    for segment_no in sorted(results):
+        success, seconds = results[segment_no]
+        print("{} {} {} on segment # {} ({:.1f} ms)".format("✓" if success else "✕",
+              action, "success" if success else "failed", segment_no, seconds * 1000))
+    succeeded = sum(1 for success, _ in results.values() if success)
+    print("{} finished: {} of {} segments succeeded".format(
+        action, succeeded, len(results)))
+
+
+# ---------------------- Chunked Upload ----------------------#
+# large payloads can be sent as numbered chunks on the segment's "chunk" topic
+#    every chunk starts with a little-endian header followed by the chunk data:
+#        uint16 transfer ID, uint16 chunk index, uint16 chunk count, uint32 offset, uint32 total length, uint32 CRC-32
+#    the segment answers each intact chunk with "chunk_ack::<transfer ID>::<chunk index>" on its return topic
+#    chunks that are not acknowledged within chunkAckTimeout_s are sent again, up to chunkMaxRounds times
+
+chunkSize = 4096  # bytes of payload data per chunk
+chunkAckTimeout_s = 2.0  # seconds to wait for the acknowledgements of a round of chunks
+chunkMaxRounds = 5  # number of times the missing chunks are sent before the upload fails
+chunkHeaderFormat = "<HHHIII"
+chunkHeaderSize = 18
+# the segment drops every chunk of a transfer with more chunks than this,
+#    the same value as maxChunkCount in WaveSegment/src/mqtt.h (tests/test_chunks.py checks that they match)
+chunkMaxCount = 1024
+
+
+# the (start, end) byte ranges of the chunks a payload of the given length is split into
+#    ranges limits the chunks to the given (start, end) byte ranges of the payload, an empty range
+#    still gives one chunk without data, so the segment learns the new payload length
+def chunkPieces(length, size=chunkSize, ranges=None):
+    ranges = [(0, length)] if ranges is None else ranges
+    return [(offset, min(offset + size, end)) for start, end in ranges
+            for offset in (range(start, end, size) or [start])]
+
+
+# split a payload into chunk messages (header + data), one per chunk index
+def makeChunks(payload, transferID, size=chunkSize, ranges=None):
+    pieces = chunkPieces(len(payload), size, ranges)
+    if len(pieces) > chunkMaxCount:
+        raise ValueError("Payload needs more than {} chunks".format(chunkMaxCount))
+    chunks = []
+    for index, (offset, end) in enumerate(pieces):
+        data = payload[offset:end]
+        chunks.append(pack(chunkHeaderFormat, transferID, index, len(pieces), offset,
+                           len(payload), zlib.crc32(data)) + data)
+    return chunks
+
+
+# ---------------------- Patch Upload ----------------------#
+# the overseer keeps the last payload every segment acknowledged chunk by chunk,
+#    a new payload is compared with it and only the changed byte ranges are sent as chunks
+#    the rest of the segment's data buffer still holds the previous payload, so the result is the new payload
+#    the kept payload is dropped whenever the segment's buffer may have changed (reset, restart, reboot, plain upload)
+
+patchMergeGap = 32  # changed ranges closer than this are sent as one, a chunk header and MQTT overhead cost about as much
+patchMaxFraction = 0.5  # above this fraction of changed bytes the whole payload is sent
+# a segment reporting one of these has an empty data buffer (rebooted or reset)
+payloadClearingStatuses = {"Initializing", "Connected", "Pairing", "Paired"}
+
+
+# byte ranges [(start, end)] of the new payload that differ from the old one
+#    a payload of a different length always gives at least one range, possibly empty, at the new end
+#    the bytes are compared at the same offsets, the segment can only overwrite its buffer and not shift it:
+#    a keyframe added or dropped moves every later record, so from there on the whole payload is sent again
+#    (with keyframes a change of e.g. smt_t moves nearly every record anyway, only the unchanged start is saved)
+def diffPayloads(old, new, gap=patchMergeGap):
+    common = min(len(old), len(new))
+    changed = np.flatnonzero(np.frombuffer(old, dtype=np.uint8, count=common) !=
+                             np.frombuffer(new, dtype=np.uint8, count=common))
+    breaks = np.flatnonzero(np.diff(changed) > gap)
+    ranges = [(int(changed[start]), int(changed[end]) + 1) for start, end in
+              zip(np.concatenate(([0], breaks + 1)), np.concatenate((breaks, [len(changed) - 1])))] if len(changed) else []
+
+    if len(old) != len(new):
+        if ranges and common - ranges[-1][1] <= gap:
+            ranges[-1] = (ranges[-1][0], len(new))
+        else:
+            ranges.append((common, len(new)))
+    return ranges
+
+
+# merge the ranges separated by the smallest gaps until they are sent as no more than maxCount chunks
+#    each range is at least one chunk, so thousands of scattered small changes would be rejected by the segment
+def mergeRanges(ranges, length, size=chunkSize, maxCount=chunkMaxCount):
+    excess = len(chunkPieces(length, size, ranges)) - maxCount
+    while excess > 0 and len(ranges) > 1:
+        gaps = np.array([following[0] - previous[1] for previous, following in zip(ranges, ranges[1:])])
+        merge = set(np.argsort(gaps, kind='stable')[:excess].tolist())  # gap i lies between range i and i + 1
+        merged = [ranges[0]]
+        for index in range(1, len(ranges)):
+            if index - 1 in merge:
+                merged[-1] = (merged[-1][0], ranges[index][1])
+            else:
+                merged.append(ranges[index])
+        ranges = merged
+        excess = len(chunkPieces(length, size, ranges)) - maxCount
+    return ranges
+
+
+# ---------------------- Status Polling ----------------------#
+# a status request registers a future per segment, the next status message of that segment completes it
+#    so a whole fleet is polled at once and the result is back as soon as the last segment replies
+
+statusTimeout_s = 1.0  # seconds to wait for the status replies
+
+
+# ---------------------- Clock Synchronization ----------------------#
+# NTP-style ping/pong over MQTT, the overseer clock is the reference
+#    the overseer sends "ping::<sequence>" at t1, the segment replies "pong::<sequence>::<segment ms>" (t2)
+#    and the pong arrives at t4: round trip = t4 - t1, offset = t2 - (t1 + t4) / 2
+#    of several samples the one with the shortest round trip is kept, it has the least queuing in it
+# "start" then sends every segment a start time in its own clock, so the segments start together
+#    even when their NTP clocks disagree
+
+timesyncSamples = 8  # pings per segment
+timesyncWindow = 2  # segments pinged at once
+timesyncTimeout_s = 0.5  # seconds to wait for the pongs of one round
+timesyncMaxAge_s = 600  # offsets older than this are not used for starting, the clocks drift
+# a segment reporting one of these has rebooted and synced its NTP clock again, its measured offset is void
+#    the offset is also dropped when the overseer restarts the segment or pairs another one under its number
+clockClearingStatuses = {"Initializing", "Connected"}
+
+
+def printClockOffsets(offsets):
+    for segment_no, (offset, roundTrip) in sorted(offsets.items()):
+        print("Segment # {}: clock offset {:+.1f} ms, round trip {:.1f} ms".format(
+            segment_no, offset, roundTrip))
+    if offsets:
+        spread = [offset for offset, roundTrip in offsets.values()]
+        print("{} segments synced, offsets span {:.1f} ms".format(
+            len(offsets), max(spread) - min(spread)))
+    else:
+        print("No segment replied")
 
 
-# ---------------------- Individual Segment Functions ----------------------#
-# functions to simplify ESP32 messages
+# ---------------------- Streaming ----------------------#
+# live control without an upload: fleet-wide frames published at a fixed rate on overseerStreamPath
+#    every frame is a little-endian header followed by one position per segment:
+#        uint16 sequence, uint32 frame time in microseconds since the stream started (both wrap around)
+#        uint8 position of segment 1, segment 2, ... segment_count
+#    a segment picks its own byte by the number it got with "ack::<segment number>" when it was paired
+#    frames go out with QoS 0, a late frame is worth less than the next one
 
-def segmentSub(segment_no):
-    if getSegmentID(segment_no) != "Null":
-        client.subscribe(segmentPathFn(segment_no, "status"), 1)
-        client.subscribe(segmentPathFn(segment_no, "return"), 1)
-        return True
-    else:
-        return False
+overseerStreamPath = "ShiveWorks/overseer/stream"
+streamRate_hz = 100  # frames per second
+streamBlock = 20  # frames computed at once, ahead of the time they are sent
+streamHeaderFormat = "<HI"
+streamHeaderSize = 6
 
 
-def segmentUnSub(segment_no):
-    if getSegmentID(segment_no) != "Null":
-        client.unsubscribe(segmentPathFn(segment_no, "status"), 1)
-        client.unsubscribe(segmentPathFn(segment_no, "return"), 1)
-        return True
-    else:
-        return False
+def packStreamFrame(sequence, frameTime_us, positions):  # positions are rounded and clipped, NaN goes to 127
+    positions = np.nan_to_num(np.asarray(positions, dtype=float), nan=127.)
+    positions = np.clip(np.rint(positions), 0, 255).astype(np.uint8)
+    return pack(streamHeaderFormat, sequence & 0xFFFF, frameTime_us & 0xFFFFFFFF) + positions.tobytes()
 
 
-# sends a predefined command to an individual segment
-def segmentCommand(segment_no, command):
-    if getSegmentID(segment_no) != "Null":
-        client.publish(segmentPathFn(segment_no, "command"), command, 1)
-        return True
-    else:
-        return False
+def unpackStreamFrame(payload):  # returns (sequence, frame time us, positions array)
+    sequence, frameTime_us = unpack(streamHeaderFormat, payload[:streamHeaderSize])
+    return sequence, frameTime_us, np.frombuffer(payload, dtype=np.uint8, offset=streamHeaderSize)
+
+
+# frames from a function of position and time, e.g. one of the psi_* functions of TestFunctions.py
+#    function(x, t) is evaluated on a whole block of frame times at once: x has shape (1, segments), t (block, 1)
+def functionFrames(function, x, rate_hz=streamRate_hz, block=streamBlock):
+    x = np.asarray(x, dtype=float)[np.newaxis, :]
+    blockStart = 0
+    while True:
+        t = (blockStart + np.arange(block))[:, np.newaxis] / rate_hz
+        yield from np.broadcast_to(function(x, t), (block, x.shape[1]))
+        blockStart += block
+
+
+# one position per segment in a single message on overseerCommandPath: b"move_all::" + uint8 position of segment 1, 2, ...
+#    each segment picks its byte by its number, the same way as in the stream frames
+moveAllPrefix = b"move_all::"
 
 
-def segmentAck(segment_no):
-    return segmentCommand(segment_no, "ack")
+def printStreamReport(report):
+    print("Streamed {} frames in {:.2f} s ({:.1f} Hz), {} sent late, latest {:.2f} ms behind schedule".format(
+        report["frames"], report["duration_s"], report["rate_hz"], report["late"], report["max_delay_ms"]))
 
 
-def segmentSendData(segment_no):
-    # send data to specific segment
-    data = packageSegmentData(segment_no)
-    if getSegmentID(segment_no) != "Null" and data != None:
-        # loads, processes, and converts actuation data
-        client.publish(segmentPathFn(segment_no, "data"), data, 1)
+# ---------------------- Capture ----------------------#
+# every message the overseer publishes or receives can be appended to a binary capture file
+#    the file starts with captureMagic, followed by records of a little-endian header and the raw payload:
+#        uint64 time in microseconds since the epoch, uint8 kind, uint8 QoS, uint16 topic ID, uint32 payload length
+#    kind is captureSent, captureReceived or captureTopic; a topic record defines a topic ID the first time it is used,
+#    its payload is the topic name, so the messages themselves only carry the 2-byte ID
+# replay.py plays a capture back against a broker
+
+capturePath = None  # capture from the start to this file when set, "capture -o file" starts it from the console
+captureBufferSize = 1024 * 1024  # bytes buffered before they are written to the file
+# a background thread writes the buffer out at least this often, also when no message arrives,
+#    so a crash of the overseer loses no more than that
+captureFlushInterval_s = 1.0
+captureMagic = b"SHIVCAP1"
+captureHeaderFormat = "<QBBHI"
+captureHeaderSize = 16
+captureSent, captureReceived, captureTopic = 0, 1, 2
+
+
+# raw records of a capture file as (time us, kind, QoS, topic ID, payload), a record cut off at the end is left out
+def readCaptureRecords(file):
+    if file.read(len(captureMagic)) != captureMagic:
+        raise ValueError("Not a ShiveWorks capture file")
+    while True:
+        header = file.read(captureHeaderSize)
+        if len(header) < captureHeaderSize:
+            return
+        time_us, kind, qos, topicID, length = unpack(captureHeaderFormat, header)
+        payload = file.read(length)
+        if len(payload) < length:
+            return
+        yield time_us, kind, qos, topicID, payload
+
+
+# the messages of a capture file as (time s, "sent" or "received", topic, QoS, payload)
+def readCapture(path):
+    topics = {}
+    with open(path, 'rb') as file:
+        for time_us, kind, qos, topicID, payload in readCaptureRecords(file):
+            if kind == captureTopic:
+                topics[topicID] = payload.decode("utf-8")
+            else:
+                yield (time_us / 1e6, "sent" if kind == captureSent else "received", topics[topicID], qos, payload)
+
+
+# appends messages to a capture file through a buffered writer, safe to call from several threads
+#    an existing capture is continued: its topic IDs are read back and a cut-off last record is dropped
+#    a flushing thread writes the buffer out every captureFlushInterval_s until the writer is closed
+class CaptureWriter:
+
+    def __init__(self, path, bufferSize=captureBufferSize):
+        self.path = path
+        self.topics = {}  # topic -> topic ID
+        self.lock = threading.Lock()
+        end = 0  # end of the last complete record
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                end = len(captureMagic)
+                for time_us, kind, qos, topicID, payload in readCaptureRecords(file):
+                    if kind == captureTopic:
+                        self.topics[payload.decode("utf-8")] = topicID
+                    end = file.tell()
+        self.file = open(path, 'ab', buffering=bufferSize)
+        if end == 0:
+            self.file.truncate(0)
+            self.file.write(captureMagic)
+        else:
+            self.file.truncate(end)
+        self.closed = threading.Event()
+        self.flushThread = threading.Thread(target=self.flushLoop, name="Capture flush", daemon=True)
+        self.flushThread.start()
+
+    def write(self, kind, topic, qos, payload):
+        time_us = int(time.time() * 1e6)
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif payload is None:
+            payload = b""
+        with self.lock:
+            if self.file is None:
+                return
+            topicID = self.topics.get(topic)
+            if topicID is None:
+                topicID = self.topics[topic] = len(self.topics)
+                name = topic.encode("utf-8")
+                self.file.write(pack(captureHeaderFormat, time_us, captureTopic, 0, topicID, len(name)) + name)
+            self.file.write(pack(captureHeaderFormat, time_us, kind, qos, topicID, len(payload)))
+            self.file.write(payload)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def flushLoop(self):
+        while not self.closed.wait(captureFlushInterval_s):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flushThread.join()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# ---------------------- Overseer ----------------------#
+# one rig: its MQTT client, the segment registry, payload cache, telemetry and clock offsets
+#    several Overseers can run in one process as long as each one talks to its own broker
+#    (the segment firmware uses fixed topic names) with its own clientName
+
+class Overseer:
+
+    def __init__(self, broker=broker, port=port, segment_count=segment_count,
+                 actuationDataPath=actuationDataPath, filePath=filePath, clientName=clientName):
+        self.broker = broker
+        self.port = port
+        self.segment_count = segment_count
+        self.actuationDataPath = actuationDataPath
+        self.filePath = filePath
+
+        # settings that can be changed on the instance at any time
+        self.experimentFileName = experimentFileName
+        self.payloadFormat = payloadFormat
+        self.publishWindow = publishWindow
+        self.countdown_ms = countdown_ms
+        self.syncedCountdown_ms = syncedCountdown_ms
+        self.printMessages = printMessages
+        self.useWildcardSubscriptions = useWildcardSubscriptions
+
+        self.client = mqtt.Client(clientName)
+        self.registry = SegmentRegistry(segment_count)
+        self.telemetry = FleetTelemetry(segment_count, telemetryHistory)
+
+        self.latestOverseerReturnMessage = ""  # storage of the latest message received
+        # list of the status of all segments ordered by segment number
+        self.statusList = [None]*segment_count
+        # the two above are written by paho's network thread and read by the commands
+        self.stateLock = threading.Lock()
+
+        # packed payloads are cached per segment number as {segment_no: ((path, mtime, size, format), payload)}
+        #    the cache entry is only used while the source file is unchanged on disk
+        self.payloadCache = {}
+        # {"stat": ..., "header": {...}, "timestamps": memmap, "values": memmap}
+        self.experiment = None
+
+        self.chunkTransfers = {}  # segment number -> state of the transfer in progress
+        self.chunkTransferLock = threading.Lock()
+        self.lastChunkTransferID = 0
+        # segment number -> last payload the segment acknowledged chunk by chunk, the base of patch uploads
+        self.uploadedPayloads = {}
+
+        self.statusRequests = {}  # segment number -> [(future, request time)] waiting for the next status
+        self.statusRequestsLock = threading.Lock()
+
+        self.clockOffsets = {}  # segment number -> (offset ms, round trip ms, time of the sync)
+        self.pingRequests = {}  # (segment number, sequence) -> (future, send time)
+        self.pingRequestsLock = threading.Lock()
+        self.lastPingSequence = 0
+
+        self.streamStopEvent = threading.Event()  # set by stop() to end a running stream
+
+        self.capture = None  # CaptureWriter while the traffic is captured
+
+        # topic filter -> handler, used with client.message_callback_add when subscribing with wildcards
+        self.messageHandlers = {
+            overseerReturnPath: self.on_overseer_return,
+            segmentPath + "/+/status": self.on_segment_status,
+            segmentPath + "/+/return": self.on_segment_return,
+        }
+
+    def allSegments(self):  # every segment number of the rig
+        return range(1, self.segment_count + 1)
+
+    # ---------------------- Connection ----------------------#
+
+    def connect(self):  # connect to the broker, subscribe and load the paired segments
+        self.client.on_socket_open = setNoDelay
+        # try to connect to the broker, if not successful wait 5 seconds and try again
+        while True:
+            try:
+                self.client.connect(self.broker, self.port)
+                break
+            except:
+                print("Connection to broker failed, retrying in 5 seconds...")
+                time.sleep(5)
+
+        # let paho keep at least a full bulk upload window in flight
+        self.client.max_inflight_messages_set(max(20, self.publishWindow))
+        self.client.on_message = self.on_message
+        if self.useWildcardSubscriptions:
+            # one subscription round trip for all segments, messages go straight to their handler
+            for topic, handler in self.messageHandlers.items():
+                self.client.message_callback_add(topic, self.capturedHandler(handler))
+            self.client.subscribe([(topic, 1) for topic in self.messageHandlers])
+        else:
+            self.client.subscribe(overseerReturnPath, 1)
+        self.client.loop_start()
+        self.loadSegmentsID()
+
+    def close(self):  # stop the network thread and disconnect, the segments keep their state
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.stopCapture()
+
+    # ---------------------- Capture ----------------------#
+
+    def startCapture(self, path=capturePath):  # append every message from now on to a capture file
+        try:
+            capture = CaptureWriter(path)
+        except (OSError, ValueError) as e:
+            print("Failed to open the capture file: {}".format(e))
+            return False
+        self.stopCapture()
+        self.capture = capture
         return True
-    else:
-        return False
 
+    def stopCapture(self):
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+
+    # every publish of the overseer goes through here, so it can be captured
+    def publish(self, topic, payload, qos):
+        capture = self.capture
+        if capture is not None:
+            capture.write(captureSent, topic, qos, payload)
+        return self.client.publish(topic, payload, qos)
+
+    def captureMessage(self, message):
+        capture = self.capture
+        if capture is not None:
+            capture.write(captureReceived, message.topic, message.qos, message.payload)
+
+    def capturedHandler(self, handler):  # a message handler that captures the message first
+        def capturedHandler(client, userdata, message):
+            self.captureMessage(message)
+            handler(client, userdata, message)
+        return capturedHandler
+
+    # --- MQTT Received Message Callback functions ---#
+
+    def on_message(self, client, userdata, message):
+        # fallback for the messages that are not routed to a handler by their topic
+        self.captureMessage(message)
+        topic = message.topic
+
+        # filter only the return messages
+        if (topic == overseerReturnPath):
+            self.on_overseer_return(client, userdata, message)
+
+        # filter only the status messages
+        elif (topic.startswith(segmentPath) and topic.endswith("status")):
+            self.on_segment_status(client, userdata, message)
+
+        # filter the segment return messages
+        elif (topic.startswith(segmentPath) and topic.endswith("return")):
+            self.on_segment_return(client, userdata, message)
+
+        elif self.printMessages:
+            print("Message received: " + message.payload.decode("utf-8", "replace"))
+
+    # get the segment number from a ShiveWorks/segment/segmentID/... topic (-1 if not paired)
+    def getTopicSegmentNumber(self, topic):
+        return self.getSegmentNumber(topic[len(segmentPath) + 1:topic.rfind("/")])
+
+    def on_overseer_return(self, client, userdata, message):
+        returnMessage = message.payload.decode("utf-8")
+        with self.stateLock:
+            self.latestOverseerReturnMessage = returnMessage
+        # always shown, the pairing requests of new segments arrive here
+        print("Message received: " + returnMessage)
+
+    def latestReturnMessage(self):
+        with self.stateLock:
+            return self.latestOverseerReturnMessage
+
+    def on_segment_status(self, client, userdata, message):
+        # get the segment ID from the topic -> convert it to the segment number
+        segment_no = self.getTopicSegmentNumber(message.topic)
+        if segment_no == -1:  # not one of the paired segments
+            return
+        # get the status from the message
+        status = message.payload.decode("utf-8")
+        self.telemetry.recordMessage(segment_no, len(message.payload))
+        self.telemetry.recordStatus(segment_no, status)
+        # store the status in the list
+        with self.stateLock:
+            self.statusList[segment_no - 1] = status
+        if status in payloadClearingStatuses:  # the segment's data buffer is empty again
+            self.forgetUploadedPayload(segment_no)
+        if status in clockClearingStatuses:  # the segment rebooted, start waits for a new timesync
+            self.forgetClockOffset(segment_no)
+        self.completeStatusRequests(segment_no, status)
+        if self.printMessages:
+            print("Segment # {} status: {}".format(segment_no, status))
+
+        # special case to confirm pairing
+        #   if a segment ID is assigned and a message "Connected" is received, send back an "ack"
+        if status == "Connected":
+            self.segmentAck(segment_no)
+
+    def on_segment_return(self, client, userdata, message):
+        receiveTime = time.time()  # taken first, the clock sync uses it as the pong arrival time
+        segment_no = self.getTopicSegmentNumber(message.topic)
+        if segment_no != -1:
+            self.telemetry.recordMessage(segment_no, len(message.payload))
+
+        # only the chunk acknowledgements are handled, the payload is decoded only for them
+        if message.payload.startswith(b"chunk_ack::"):
+            if segment_no != -1:
+                self.chunkAcknowledged(segment_no, message.payload.decode("utf-8"))
+        elif message.payload.startswith(b"pong::"):
+            if segment_no != -1:
+                self.pongReceived(segment_no, message.payload.decode("utf-8"), receiveTime)
+        elif self.printMessages:
+            print("Message received: " + message.payload.decode("utf-8", "replace"))
+
+    # ---------------------- Dealing with segment identification ----------------------#
+
+    # get the ID of a segment from the list and return it as a string (Null if not found or empty)
+    def getSegmentID(self, segment_no):
+        if int(segment_no) > self.segment_count or int(segment_no) < 1:
+            print("Segment number out of range")
+            return "Null"
+        return self.registry.getID(int(segment_no))
+
+    # get the segment number from the ID and return it as an integer (-1 if not found)
+    def getSegmentNumber(self, segmentID):
+        return self.registry.getNumber(segmentID)
+
+    def pairedSegments(self):  # numbers of all paired segments
+        return [segment_no for segment_no in self.allSegments() if self.registry.getID(segment_no) != "Null"]
+
+    def addSegmentID(self, segment_no):  # add a segment ID to the list and save it to a .csv file
+        # one read, a pairing request arriving meanwhile must not swap the ID being assigned
+        returnMessage = self.latestReturnMessage()
+        # check if there is a segment available for assignment
+        if returnMessage.startswith('pairing'):
+
+            # check if the segment number is valid (between 1 and segment_count)
+            if int(segment_no) < 1 or int(segment_no) > self.segment_count:
+                print("Invalid segment number")
+                return False
+            else:
+                ID_str = returnMessage.split("::")[1]
+                self.registry.assign(int(segment_no), ID_str)
+                self.forgetClockOffset(segment_no)  # an offset under this number belongs to another segment
+                self.saveSegmentsID()
+
+                # subscribe to the status and data return of the new segment
+                self.segmentSub(segment_no)
 
-def segmentMasterCommand(command):
-    # command to the overseer master topic that goes to all segments
-    client.publish(overseerCommandPath, command, 1)
+                # acknowledge to the segment that pairing was successful
+                self.segmentAck(segment_no)
 
+                # print segment number and id that has been added to the list
+                print("Segment #{} has been added to the list with ID: {}".format(
+                    segment_no, ID_str))
+                return True
+        else:
+            print("No segment available for assignment")
+            return False
 
-# ---------------------#
+    # remove a segment ID from the list and save it to a .csv file
+    def removeSegmentID(self, segment_no):
+        # check if the segment number is valid
+        if self.getSegmentID(segment_no) == "Null":
+            print("Invalid segment number")
+            return False
+        else:
+            # unsubscribe from the status and data return of the segment while its topics are known
+            self.segmentUnSub(segment_no)
 
+            self.registry.remove(int(segment_no))
+            self.forgetUploadedPayload(segment_no)
+            self.forgetClockOffset(segment_no)
+            self.saveSegmentsID()
 
-def segmentPathFn(segment_no, whatToDo):
-    # there are four topics for each segment: command, return, data, and status
-    if whatToDo == "command" or whatToDo == "return" or whatToDo == "status" or whatToDo == "data":
-        if getSegmentID(segment_no) != "Null":
-            return segmentPath + "/" + getSegmentID(int(segment_no)) + "/" + whatToDo
+            # print segment number and id that has been removed from the list
+            print("Segment #{} has been removed from the list".format(segment_no))
+            return True
 
+    def loadSegmentsID(self):   # load the segments ID from a .csv file
+        try:
+            with open(self.filePath, 'r') as file:
+                reader = csv.reader(file, delimiter=' ')
+                self.registry.load(row[0] for row in reader)
 
-def segment_reset(segment_no):  # reset a specific segment
-    return segmentCommand(segment_no, "reset")
+            # subscribe to the status of all segments if they exist
+            for i in self.pairedSegments():
+                # subscribe to the status and data return of the new segment
+                self.segmentSub(i)
+            return True
+        except Exception as e:
+            print("Failed to load segments ID list: {}".format(e))
+            return False
 
+    def saveSegmentsID(self):   # save the segments ID to a .csv file
+        try:
+            with open(self.filePath, 'w', newline='') as file:
+                writer = csv.writer(file, delimiter=' ')
+                for ID in self.registry.IDs():
+                    writer.writerow([ID])
+            return True
+        except Exception as e:
+            print("Failed to save segments ID list: {}".format(e))
+            return False
 
-def segment_restart(segment_no):  # restart a specific segment
-    return segmentCommand(segment_no, "restart")
+    def clearSegmentID(self, segment_no):  # clear a segment ID from the list
+        return self.segmentCommand(segment_no, "restart") and self.removeSegmentID(segment_no)
 
+    def clearSegmentsID(self):  # stop all segments and clear the segments ID list
+        self.segmentMasterCommand("stop")
+        for segment_no in self.pairedSegments():
+            self.segmentUnSub(segment_no)
+        self.registry.load([])
+        self.forgetUploadedPayload()
+        self.forgetClockOffset()
+        return self.saveSegmentsID()
 
-def timesync_segment(segment_no):  # timesync a specific segment
-    return segmentCommand(segment_no, "timesync")
+    # ---------------------- Actuation Data Conversion ----------------------#
 
+    def loadExperiment(self):
+        experimentPath = self.actuationDataPath + '/' + self.experimentFileName
 
-def move_segment(segment_no, position):  # move a specific segment to a position
-    # check that the position is within the range of the segment 0-255
-    if int(position) > 255 or int(position) < 0:
-        print("Invalid position")
-        return False
-    else:
-        return segmentCommand(segment_no, "move::{}".format(position))
+        try:
+            stat = os.stat(experimentPath)
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self.experiment is not None and self.experiment["stat"] == stamp:
+                return self.experiment
+
+            # the experiment file is memory-mapped once and reopened only when it is replaced on disk
+            header, timestamps, values = mapExperimentFile(experimentPath)
+
+            self.experiment = {"stat": stamp, "header": header,
+                               "timestamps": timestamps, "values": values}
+            return self.experiment
+
+        except Exception as e:
+            print("Failed to load experiment file: {}".format(e))
+            self.experiment = None
+            return None
+
+    # function that slices one segment's column out of the experiment file and packs it
+    def loadSegmentExperiment(self, segment_no):
+        experiment = self.loadExperiment()
+        if experiment is None:
+            return None
+
+        segment_index = int(segment_no) - 1
+        if segment_index < 0 or segment_index >= experiment["header"]["segment_count"]:
+            print("Segment # {} is not in the experiment file".format(segment_no))
+            return None
 
+        try:
+            return packActuationData(experiment["timestamps"], experiment["values"][:, segment_index])
+        except Exception as e:
+            print("Failed to load segments data: {}".format(e))
+            return None
+
+    # get the path of the file the segment's payload is made from
+    #    the experiment file or a .bin file generated by GEN.py is used if present, otherwise the .csv file
+    def getSegmentDataSource(self, segment_no):
+        for sourcePath in (self.actuationDataPath + '/' + self.experimentFileName,
+                           self.actuationDataPath + '/' + str(segment_no) + ".bin"):
+            if os.path.isfile(sourcePath):
+                return sourcePath
+        return self.actuationDataPath + '/' + str(segment_no) + ".csv"
+
+    def clearPayloadCache(self, segment_no=None):  # drop the cached payload of one or all segments
+        if segment_no is None:
+            self.payloadCache.clear()
+        else:
+            self.payloadCache.pop(int(segment_no), None)
 
-def get_segment_status(segment_no):  # get the status of a specific segment
-    segmentCommand(segment_no, "status_report")
-    time.sleep(0.25)  # wait for the status report to be published
-    try:
-        return statusList[int(segment_no) - 1]
-    except IndexError:
-        return ("Segment does not have a reported status yet")
+    # function that returns the segment's payload, from the cache if the source file has not changed
+    def packageSegmentData(self, segment_no):
+        sourcePath = self.getSegmentDataSource(segment_no)
+        try:
+            stat = os.stat(sourcePath)
+            sourceKey = (sourcePath, stat.st_mtime_ns, stat.st_size, self.payloadFormat)
+        except OSError:
+            sourceKey = None
+
+        cached = self.payloadCache.get(int(segment_no))
+        if sourceKey is not None and cached is not None and cached[0] == sourceKey:
+            return cached[1]
+
+        packed_binary = self.convertSegmentPayload(segment_no, sourcePath)
+        if packed_binary is not None and self.payloadFormat == "compact":
+            packed_binary = encodeCompactPayload(packed_binary)
+        if sourceKey is not None and packed_binary is not None:
+            self.payloadCache[int(segment_no)] = (sourceKey, packed_binary)
+        else:
+            self.clearPayloadCache(segment_no)
+        return packed_binary
 
+    # function that takes the processed data and returns a struct formatted as binary uint16_t, uint8_t, ...
+    def convertSegmentPayload(self, segment_no, sourcePath):
+        if sourcePath.endswith(self.experimentFileName):
+            return self.loadSegmentExperiment(segment_no)
+        if sourcePath.endswith(".bin"):
+            return loadSegmentBinary(sourcePath)
+
+        # https://docs.python.org/3.7/library/struct.html#struct.pack_into
+        actuationDataArray = loadSegmentData(sourcePath)
+        if actuationDataArray is not None:
+            return packSegmentData(actuationDataArray)
+        # return packed byte struct
+        return None
+
+    # ---------------------- Individual Segment Functions ----------------------#
+    # functions to simplify ESP32 messages
+
+    def segmentPathFn(self, segment_no, whatToDo):
+        # there are five topics for each segment: command, return, data, chunk, and status
+        #    None if the segment is not paired or the topic does not exist
+        return self.registry.getTopic(int(segment_no), whatToDo)
+
+    # with wildcard subscriptions the segment topics are already covered, only the pairing is checked
+    def segmentSub(self, segment_no):
+        if self.getSegmentID(segment_no) != "Null":
+            if not self.useWildcardSubscriptions:
+                self.client.subscribe(self.segmentPathFn(segment_no, "status"), 1)
+                self.client.subscribe(self.segmentPathFn(segment_no, "return"), 1)
+            return True
+        else:
+            return False
 
-# ---------------------- Manual Commands ----------------------#
-if __name__ == "__main__":
-    main()
+    def segmentUnSub(self, segment_no):
+        if self.getSegmentID(segment_no) != "Null":
+            if not self.useWildcardSubscriptions:
+                self.client.unsubscribe(self.segmentPathFn(segment_no, "status"))
+                self.client.unsubscribe(self.segmentPathFn(segment_no, "return"))
+            return True
+        else:
+            return False
+
+    # sends a predefined command to an individual segment
+    def segmentCommand(self, segment_no, command):
+        if self.getSegmentID(segment_no) != "Null":
+            self.publish(self.segmentPathFn(segment_no, "command"), command, 1)
+            return True
+        else:
+            return False
+
+    def segmentAck(self, segment_no):  # the segment learns its number from the acknowledgement
+        return self.segmentCommand(segment_no, "ack::{}".format(int(segment_no)))
+
+    def segmentSendData(self, segment_no):
+        # send data to specific segment
+        data = self.packageSegmentData(segment_no)
+        # a plain upload is not acknowledged by the segment, the next patch upload starts over
+        self.forgetUploadedPayload(segment_no)
+        if self.getSegmentID(segment_no) != "Null" and data != None:
+            # loads, processes, and converts actuation data
+            self.publish(self.segmentPathFn(segment_no, "data"), data, 1)
+            self.telemetry.recordUpload(int(segment_no), len(data), True)
+            return True
+        else:
+            return False
+
+    def segmentMasterCommand(self, command):
+        # command to the overseer master topic that goes to all segments
+        self.publish(overseerCommandPath, command, 1)
+
+    def segment_reset(self, segment_no):  # reset a specific segment
+        self.forgetUploadedPayload(segment_no)
+        return self.segmentCommand(segment_no, "reset")
+
+    def segment_restart(self, segment_no):  # restart a specific segment
+        self.forgetUploadedPayload(segment_no)
+        self.forgetClockOffset(segment_no)
+        return self.segmentCommand(segment_no, "restart")
+
+    def move_segment(self, segment_no, position):  # move a specific segment to a position
+        # check that the position is within the range of the segment 0-255
+        if int(position) > 255 or int(position) < 0:
+            print("Invalid position")
+            return False
+        else:
+            return self.segmentCommand(segment_no, "move::{}".format(position))
+
+    # ---------------------- Bulk Segment Functions ----------------------#
+
+    # publish a list of (segment_no, topic, payload) messages and return {segment_no: (success, seconds)}
+    def publishBulk(self, messages, window=None, timeout=publishTimeout_s):
+        window = window or self.publishWindow
+        results = {}
+        inFlight = []  # [(segment_no, MQTTMessageInfo, publish start time)] oldest first
+
+        def waitForOldest():
+            segment_no, info, startTime = inFlight.pop(0)
+            try:
+                info.wait_for_publish(timeout)
+            except (ValueError, RuntimeError):  # the message was never queued, or the client disconnected
+                pass
+            results[segment_no] = (info.is_published(), time.perf_counter() - startTime)
+
+        for segment_no, topic, payload in messages:
+            if len(inFlight) >= window:
+                waitForOldest()
+            startTime = time.perf_counter()
+            info = self.publish(topic, payload, 1)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                results[segment_no] = (False, time.perf_counter() - startTime)
+            else:
+                inFlight.append((segment_no, info, startTime))
+
+        while inFlight:
+            waitForOldest()
+        return results
+
+    # upload the actuation data to all the given segments concurrently
+    def uploadSegments(self, segment_numbers, window=None):
+        results = {}
+        messages = []
+        for segment_no in segment_numbers:
+            self.forgetUploadedPayload(segment_no)
+            data = self.packageSegmentData(segment_no) if self.getSegmentID(
+                segment_no) != "Null" else None
+            if data is None:
+                results[int(segment_no)] = (False, 0.0)
+            else:
+                messages.append(
+                    (int(segment_no), self.segmentPathFn(segment_no, "data"), data))
+        results.update(self.publishBulk(messages, window))
+
+        for segment_no, topic, data in messages:
+            success, seconds = results[segment_no]
+            self.telemetry.recordUpload(segment_no, len(data), success, brokerSeconds=seconds)
+        return results
+
+    # send the same command to all the given segments concurrently
+    def commandSegments(self, segment_numbers, command, window=None):
+        results = {}
+        messages = []
+        for segment_no in segment_numbers:
+            if self.getSegmentID(segment_no) == "Null":
+                results[int(segment_no)] = (False, 0.0)
+            else:
+                messages.append(
+                    (int(segment_no), self.segmentPathFn(segment_no, "command"), command))
+        results.update(self.publishBulk(messages, window))
+        return results
+
+    # ---------------------- Chunked Upload ----------------------#
+
+    # called from the return message handler when a segment acknowledges a chunk
+    def chunkAcknowledged(self, segment_no, message):
+        try:
+            transferID, index = (int(field) for field in message.split("::")[1:3])
+        except ValueError:
+            return
+        with self.chunkTransferLock:
+            transfer = self.chunkTransfers.get(segment_no)
+            if transfer is None or transfer["id"] != transferID:
+                return  # an acknowledgement from an earlier transfer
+            transfer["missing"].discard(index)
+            if not transfer["missing"]:
+                transfer["done"].set()
+
+    # send the payload (or only the given byte ranges of it) in chunks, resending the ones that were not acknowledged
+    #    the payload is kept as the segment's base for patches once every chunk is acknowledged
+    def sendChunks(self, segment_no, data, size=chunkSize, ranges=None):
+        segment_no = int(segment_no)
+        with self.chunkTransferLock:
+            self.lastChunkTransferID = (self.lastChunkTransferID + 1) & 0xFFFF
+            chunks = makeChunks(data, self.lastChunkTransferID, size, ranges)
+            transfer = {"id": self.lastChunkTransferID, "missing": set(range(len(chunks))),
+                        "done": threading.Event()}
+            self.chunkTransfers[segment_no] = transfer
+
+        sentBytes = sum(len(chunk) - chunkHeaderSize for chunk in chunks)
+        topic = self.segmentPathFn(segment_no, "chunk")
+        startTime = time.perf_counter()
+        try:
+            for _ in range(chunkMaxRounds):
+                with self.chunkTransferLock:
+                    missing = sorted(transfer["missing"])
+                for index in missing:
+                    self.publish(topic, chunks[index], 1)
+                if transfer["done"].wait(chunkAckTimeout_s):
+                    self.uploadedPayloads[segment_no] = data
+                    self.telemetry.recordUpload(segment_no, sentBytes, True,
+                                                time.perf_counter() - startTime)
+                    return True
+            # some chunks may have landed, the segment's buffer is unknown now
+            self.uploadedPayloads.pop(segment_no, None)
+            self.telemetry.recordUpload(segment_no, sentBytes, False)
+            print("Chunked upload to segment # {} failed, {} of {} chunks missing".format(
+                segment_no, len(transfer["missing"]), len(chunks)))
+            return False
+        finally:
+            with self.chunkTransferLock:
+                if self.chunkTransfers.get(segment_no) is transfer:
+                    del self.chunkTransfers[segment_no]
+
+    # upload the actuation data to a segment in chunks, resending only the chunks that were not acknowledged
+    def segmentSendDataChunked(self, segment_no, size=chunkSize):
+        data = self.packageSegmentData(segment_no)
+        if self.getSegmentID(segment_no) == "Null" or data is None:
+            return False
+        return self.sendChunks(segment_no, data, size)
+
+    # upload only what changed since the segment's last acknowledged payload
+    #    returns the number of bytes sent (0 if nothing changed), None if the upload failed
+    def segmentSendDataPatch(self, segment_no, size=chunkSize):
+        data = self.packageSegmentData(segment_no)
+        if self.getSegmentID(segment_no) == "Null" or data is None:
+            return None
+
+        base = self.uploadedPayloads.get(int(segment_no))
+        if base == data:
+            return 0
+        ranges = diffPayloads(base, data) if base is not None else None
+        if ranges is not None:  # many scattered changes can give more ranges than the segment takes chunks
+            ranges = mergeRanges(ranges, len(data), size)
+        if ranges is not None and sum(end - start for start, end in ranges) > patchMaxFraction * len(data):
+            ranges = None
+        if not self.sendChunks(segment_no, data, size, ranges):
+            return None
+        return sum(end - start for start, end in ranges) if ranges is not None else len(data)
+
+    # chunked upload to all the given segments, running up to window transfers at the same time
+    def uploadSegmentsChunked(self, segment_numbers, window=None):
+        def timedUpload(segment_no):
+            startTime = time.perf_counter()
+            return self.segmentSendDataChunked(segment_no), time.perf_counter() - startTime
+
+        segment_numbers = [int(segment_no) for segment_no in segment_numbers]
+        with ThreadPoolExecutor(max_workers=window or self.publishWindow) as executor:
+            return dict(zip(segment_numbers, executor.map(timedUpload, segment_numbers)))
+
+    # patch upload to all the given segments, returns ({segment_no: (success, seconds)}, {segment_no: bytes sent})
+    def uploadSegmentsPatched(self, segment_numbers, window=None):
+        def timedUpload(segment_no):
+            startTime = time.perf_counter()
+            return self.segmentSendDataPatch(segment_no), time.perf_counter() - startTime
+
+        segment_numbers = [int(segment_no) for segment_no in segment_numbers]
+        with ThreadPoolExecutor(max_workers=window or self.publishWindow) as executor:
+            uploads = dict(zip(segment_numbers, executor.map(timedUpload, segment_numbers)))
+        return ({segment_no: (sent is not None, seconds) for segment_no, (sent, seconds) in uploads.items()},
+                {segment_no: sent for segment_no, (sent, seconds) in uploads.items() if sent is not None})
+
+    def forgetUploadedPayload(self, segment_no=None):  # the next patch upload sends the whole payload
+        if segment_no is None:
+            self.uploadedPayloads.clear()
+        else:
+            self.uploadedPayloads.pop(int(segment_no), None)
+
+    # ---------------------- Status Polling ----------------------#
+
+    def completeStatusRequests(self, segment_no, status):  # called from the status message handler
+        with self.statusRequestsLock:
+            requests = self.statusRequests.pop(segment_no, [])
+        receiveTime = time.perf_counter()
+        for future, requestTime in requests:
+            if not future.done():
+                future.set_result((status, receiveTime - requestTime))
+                self.telemetry.recordLatency(segment_no, receiveTime - requestTime)
+
+    # send "status_report" to all the given segments and return {segment_no: future of (status, latency seconds)}
+    def sendStatusRequests(self, segment_numbers):
+        futures = {}
+        for segment_no in segment_numbers:
+            segment_no = int(segment_no)
+            future = Future()
+            if self.getSegmentID(segment_no) == "Null":
+                future.set_result((None, None))
+            else:
+                with self.statusRequestsLock:
+                    self.statusRequests.setdefault(segment_no, []).append(
+                        (future, time.perf_counter()))
+            futures[segment_no] = future
+
+        self.commandSegments([segment_no for segment_no, future in futures.items() if not future.done()],
+                             "status_report")
+        return futures
+
+    def cancelStatusRequests(self, futures):  # forget the requests that were not answered in time
+        with self.statusRequestsLock:
+            for segment_no, future in futures.items():
+                if not future.done():
+                    self.telemetry.recordError(segment_no)
+                requests = self.statusRequests.get(segment_no, [])
+                requests[:] = [request for request in requests if request[0] is not future]
+                if not requests:
+                    self.statusRequests.pop(segment_no, None)
+                future.cancel()
+
+    @staticmethod
+    def collectStatusResults(futures):  # (None, None) for the segments that did not reply
+        return {segment_no: future.result() if future.done() and not future.cancelled() else (None, None)
+                for segment_no, future in futures.items()}
+
+    # poll the status of many segments at once, returns {segment_no: (status, latency seconds)}
+    #    as soon as every segment replied or the timeout ran out
+    def requestStatus(self, segment_numbers, timeout=statusTimeout_s):
+        futures = self.sendStatusRequests(segment_numbers)
+        wait(futures.values(), timeout)
+        results = self.collectStatusResults(futures)
+        self.cancelStatusRequests(futures)
+        return results
+
+    # asyncio version of requestStatus, does not block the event loop while waiting for the replies
+    async def requestStatusAsync(self, segment_numbers, timeout=statusTimeout_s):
+        futures = await asyncio.to_thread(self.sendStatusRequests, segment_numbers)
+        pending = [asyncio.wrap_future(future) for future in futures.values()]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        results = self.collectStatusResults(futures)
+        self.cancelStatusRequests(futures)
+        return results
+
+    def get_segment_status(self, segment_no):  # get the status of a specific segment
+        status, latency = self.requestStatus([segment_no])[int(segment_no)]
+        if status is None:
+            return ("Segment did not report its status in time")
+        return status
+
+    # ---------------------- Clock Synchronization ----------------------#
+
+    def pongReceived(self, segment_no, message, receiveTime):  # called from the return message handler
+        try:
+            _, sequence, segmentTime = message.split("::")
+            key = (segment_no, int(sequence))
+            segmentTime = int(segmentTime)
+        except ValueError:
+            return
+        with self.pingRequestsLock:
+            request = self.pingRequests.pop(key, None)
+        if request is not None and not request[0].done():
+            future, sendTime = request
+            future.set_result((sendTime, segmentTime, receiveTime * 1000))
+
+    def sendPings(self, segment_numbers):  # returns {segment_no: future of (t1, t2, t4) in ms}
+        with self.pingRequestsLock:
+            self.lastPingSequence = self.lastPingSequence % 65535 + 1
+            sequence = self.lastPingSequence
+        futures = {}
+        for segment_no in segment_numbers:
+            future = Future()
+            with self.pingRequestsLock:
+                self.pingRequests[(segment_no, sequence)] = (future, time.time() * 1000)
+            # QoS 0 keeps the broker's acknowledgement out of the round trip
+            self.publish(self.segmentPathFn(segment_no, "command"), "ping::{}".format(sequence), 0)
+            futures[segment_no] = future
+        return futures
+
+    def cancelPings(self, futures):  # forget the pings that were not answered in time
+        pending = set(futures.values())
+        with self.pingRequestsLock:
+            for key in [key for key, (future, sendTime) in self.pingRequests.items() if future in pending]:
+                del self.pingRequests[key]
+        for future in pending:
+            future.cancel()
+
+    # measure the clock offset of the given segments, several rounds of pings to all of them at once
+    #    returns {segment_no: (offset ms, round trip ms)}, segments that never replied are left out
+    def timesyncSegments(self, segment_numbers, samples=timesyncSamples, window=timesyncWindow,
+                         timeout=timesyncTimeout_s):
+        segment_numbers = [int(segment_no) for segment_no in segment_numbers
+                           if self.getSegmentID(segment_no) != "Null"]
+        best = {}  # segment number -> (round trip, offset)
+        for _ in range(samples):
+            # a few segments at a time, a burst to the whole fleet queues the pings but not the pongs
+            for group in range(0, len(segment_numbers), window):
+                futures = self.sendPings(segment_numbers[group:group + window])
+                wait(futures.values(), timeout)
+                for segment_no, future in futures.items():
+                    if future.done() and not future.cancelled():
+                        t1, t2, t4 = future.result()
+                        sample = (t4 - t1, t2 - (t1 + t4) / 2)
+                        self.telemetry.recordLatency(segment_no, sample[0] / 1000)
+                        best[segment_no] = min(best.get(segment_no, sample), sample)
+                self.cancelPings(futures)
+
+        syncTime = time.time()
+        for segment_no, (roundTrip, offset) in best.items():
+            self.clockOffsets[segment_no] = (offset, roundTrip, syncTime)
+        return {segment_no: (offset, roundTrip) for segment_no, (roundTrip, offset) in best.items()}
+
+    def forgetClockOffset(self, segment_no=None):  # start waits for a new timesync of the segment
+        if segment_no is None:
+            self.clockOffsets.clear()
+        else:
+            self.clockOffsets.pop(int(segment_no), None)
+
+    # start all paired segments at the same moment using their clock offsets
+    #    returns the publish results, or None when a paired segment has no fresh offset
+    def startSegments(self, countdown=None):
+        countdown = countdown or self.syncedCountdown_ms
+        segment_numbers = self.pairedSegments()
+        now = time.time()
+        if not segment_numbers or any(segment_no not in self.clockOffsets or
+                                      now - self.clockOffsets[segment_no][2] > timesyncMaxAge_s
+                                      for segment_no in segment_numbers):
+            return None
+
+        startTime = now * 1000 + countdown
+        return self.publishBulk([(segment_no, self.segmentPathFn(segment_no, "command"),
+                                  "start::{}".format(int(round(startTime + self.clockOffsets[segment_no][0]))))
+                                 for segment_no in segment_numbers])
+
+    # ---------------------- Streaming ----------------------#
+
+    # the position of every segment at every sample of the experiment file, as (timestamps, positions)
+    #    skipped samples (-100) hold the previous value, segments that are not in the file stay at 127
+    def experimentPositions(self):
+        experiment = self.loadExperiment()
+        if experiment is None:
+            return None
+        timestamps = np.asarray(experiment["timestamps"], dtype=np.int64)
+        values = np.asarray(experiment["values"])[:, :self.segment_count]
+        columns = np.arange(values.shape[1])
+
+        # row of the last sample with a value, per segment
+        held = np.where(values != -100, np.arange(len(values))[:, np.newaxis], 0)
+        np.maximum.accumulate(held, axis=0, out=held)
+        heldValues = values[held, columns]
+        positions = np.full((len(values), self.segment_count), 127, dtype=np.uint8)
+        positions[:, columns] = np.where(heldValues != -100, heldValues, 127)
+        return timestamps, positions
+
+    # positions of all segments at a time of the experiment in milliseconds, None without an experiment file
+    def experimentPositionsAt(self, time_ms):
+        experimentPositions = self.experimentPositions()
+        if experimentPositions is None:
+            return None
+        timestamps, positions = experimentPositions
+        if timestamps[-1] > 0:  # past the end the experiment starts over, as on the segments
+            time_ms = time_ms % timestamps[-1]
+        return positions[max(int(np.searchsorted(timestamps, time_ms, side='right')) - 1, 0)]
+
+    # frames of the experiment file in real time, looping like the uploaded experiment does
+    def experimentFrames(self, rate_hz=streamRate_hz, block=streamBlock):
+        experimentPositions = self.experimentPositions()
+        if experimentPositions is None:
+            return None
+        timestamps, positions = experimentPositions
+        loop_ms = timestamps[-1]
+
+        def frames():
+            blockStart = 0
+            while True:
+                t = (blockStart + np.arange(block)) * 1000 / rate_hz
+                if loop_ms > 0:
+                    t = t % loop_ms
+                yield from positions[np.maximum(np.searchsorted(timestamps, t, side='right') - 1, 0)]
+                blockStart += block
+        return frames()
+
+    # publish frames at a fixed rate until they run out, the duration is over or stop() is called
+    #    frames is any iterable of position vectors (one value 0-255 per segment), returns a report
+    def stream(self, frames, rate_hz=streamRate_hz, duration=None):
+        self.streamStopEvent.clear()
+        period = 1 / rate_hz
+        maxFrames = int(duration * rate_hz) if duration is not None else None
+        sent = 0
+        late = 0
+        maxDelay = 0.
+        startTime = time.perf_counter()
+        for positions in frames:
+            if sent == maxFrames:
+                break
+            frameTime = startTime + sent * period
+            # frames are scheduled from the start time, so a late frame does not delay the next ones
+            wait_s = frameTime - time.perf_counter()
+            if wait_s > 0 and self.streamStopEvent.wait(wait_s):
+                break
+            if self.streamStopEvent.is_set():
+                break
+            delay = time.perf_counter() - frameTime
+            maxDelay = max(maxDelay, delay)
+            if delay > period:
+                late += 1
+            self.publish(overseerStreamPath,
+                         packStreamFrame(sent, int(round(sent * period * 1e6)), positions), 0)
+            sent += 1
+
+        duration_s = time.perf_counter() - startTime
+        return {"frames": sent, "duration_s": duration_s, "rate_hz": sent / duration_s if duration_s > 0 else 0.,
+                "late": late, "max_delay_ms": maxDelay * 1000}
+
+    # ---------------------- Programmatic API ----------------------#
+    # one call per console command, segment_numbers=None means all segments of the rig
+
+    # {segment_no: (success, seconds)}, patch=True sends only what changed since the last acknowledged upload
+    def upload(self, segment_numbers=None, window=None, chunked=False, patch=False):
+        segment_numbers = self.allSegments() if segment_numbers is None else segment_numbers
+        if patch:
+            return self.uploadSegmentsPatched(segment_numbers, window)[0]
+        if chunked:
+            return self.uploadSegmentsChunked(segment_numbers, window)
+        return self.uploadSegments(segment_numbers, window)
+
+    # move every segment to its own position with one message, e.g. a row of K_g from GEN.py
+    #    positions holds one value 0-255 per segment, ordered by segment number
+    def move_all(self, positions):
+        positions = np.asarray(positions, dtype=float)
+        # NaN passes the range check (every comparison with it is False), so non-finite positions are rejected first
+        if (positions.shape != (self.segment_count,) or not np.isfinite(positions).all()
+                or positions.min() < 0 or positions.max() > 255):
+            print("Invalid positions, {} values between 0 and 255 are needed".format(self.segment_count))
+            return False
+        self.segmentMasterCommand(moveAllPrefix + np.rint(positions).astype(np.uint8).tobytes())
+        return True
+
+    def move(self, position, segment_no=None):  # move one or all segments to a position 0-255
+        if segment_no is not None:
+            return self.move_segment(segment_no, position)
+        if int(position) > 255 or int(position) < 0:
+            print("Invalid position")
+            return False
+        self.segmentMasterCommand("move::{}".format(position))
+        return True
+
+    # start the experiment, returns (countdown ms, per-segment publish results or None for a broadcast start)
+    #    with fresh clock offsets every segment gets its own start time and the countdown is short,
+    #    otherwise one start time is broadcast and the segments rely on their NTP clocks
+    def start(self):
+        results = self.startSegments()
+        if results is not None:
+            return self.syncedCountdown_ms, results
+        millisec = int((time.time() * 1000) + self.countdown_ms)
+        self.segmentMasterCommand("start::{}".format(millisec))
+        return self.countdown_ms, None
+
+    def stop(self):  # halt the experiment and any running stream on all segments immediately
+        self.streamStopEvent.set()
+        self.segmentMasterCommand("stop")
+
+    def reset(self):  # reset all segments to the pre-experiment stage
+        self.forgetUploadedPayload()
+        self.segmentMasterCommand("reset")
+
+    def restart(self, segment_numbers=None):  # {segment_no: (success, seconds)}
+        segment_numbers = self.allSegments() if segment_numbers is None else segment_numbers
+        for segment_no in segment_numbers:
+            self.forgetUploadedPayload(segment_no)
+            self.forgetClockOffset(segment_no)
+        return self.commandSegments(segment_numbers, "restart")
 
-while True:
-    # an infinite loop that waits for a command to control the whole shive machine
-    input_str = input("\nEnter a command: ").lower()
+    def status(self, segment_numbers=None, timeout=statusTimeout_s):  # {segment_no: (status, latency seconds)}
+        return self.requestStatus(self.allSegments() if segment_numbers is None else segment_numbers, timeout)
+
+    def timesync(self, segment_numbers=None):  # {segment_no: (offset ms, round trip ms)}
+        return self.timesyncSegments(self.allSegments() if segment_numbers is None else segment_numbers)
+
+
+# ---------------------- Manual Commands ----------------------#
+# the console runs on an asyncio loop: every command becomes a task and its blocking work runs in a worker thread
+#    so the next command can be typed while an upload is still running
+#    a command only waits for the running commands it conflicts with, each one names the parts of the rig it changes:
+#        payload: the segments' data buffers, the pairing and the kept payloads (uploads, reset, restart, pairing)
+#        clock:   the segment clocks and the measured offsets (timesync, restart, start uses them)
+#        stream:  the live stream, frames of two streams would mix; it is held for as long as the stream runs,
+#                 so a stream blocks no other command, and a second stream is refused instead of queued behind it
+#    commands not listed here (stop, status, stats, debug, capture, move, move_all) run at once,
+#    so an emergency stop never waits for an upload; "stop" also cancels the commands still waiting for their turn
+# the limit: the work of every command still runs in a worker thread and is not interrupted when its task is cancelled,
+#    and commands that do not conflict (e.g. an upload and a timesync) share the broker and the segments' bandwidth
+
+commandResources = {
+    "upload": ("payload",),
+    "reset": ("payload",),
+    "assign": ("payload",),
+    "clear_pairing": ("clock", "payload"),
+    "clear_cache": ("payload",),
+    "restart": ("clock", "payload"),
+    "timesync": ("clock",),
+    "start": ("clock", "payload"),
+    "stream": ("stream",),
+}
+
+
+def runCommand(overseer, input_str):  # run one console command, called from a worker thread
     match input_str.split():
         # global commands----------------------------overseer topic
         case ["stop"]:
-            segmentMasterCommand("stop")
+            overseer.stop()
             print("Stopping the experiment")
 
         case ["start"]:
-            # after the command is issued, it shall send T-5s to all segments
-            millisec = int((time.time() * 1000) + countdown_ms)
-            segmentMasterCommand("start::{}".format(millisec))
-            print("Starting the experiment in {} seconds".format(
-                countdown_ms / 1000))
+            countdown, results = overseer.start()
+            if results is not None:
+                printBulkReport(results, "Start")
+                print("Starting the experiment in {} seconds".format(countdown / 1000))
+            else:
+                print("Starting the experiment in {} seconds (not synced, run timesync first for a short countdown)".format(
+                    countdown / 1000))
 
         case ["reset"]:
-            segmentMasterCommand("reset")
+            overseer.reset()
             print("Resetting all segments")
 
+        case ["move_all", *args] if '-t' in args:  # move every segment to its position at a time of the experiment
+            time_ms = int(args[args.index('-t') + 1])
+            positions = overseer.experimentPositionsAt(time_ms)
+            if positions is not None and overseer.move_all(positions):
+                print("Moving all segments to the experiment at {} ms".format(time_ms))
+
+        case ["move_all", *args] if '-p' in args:  # one position per segment, missing ones are set to the last given
+            positions = [int(position) for position in args[args.index('-p') + 1:]]
+            positions += positions[-1:] * (overseer.segment_count - len(positions))
+            if overseer.move_all(positions):
+                print("Moving all segments to their positions")
+
         case ["move", *args] if ('-p' in args and '-s' not in args):
             position = args[args.index('-p') + 1]
-            if (int(position) > 255 or int(position) < 0):
-                print("Invalid position")
-            else:
-                segmentMasterCommand("move::{}".format(position))
+            if overseer.move(position):
                 print("Moving all segments")
         # all segment commands----------------------------segment topic
 
-        case ["upload"]:
+        case ["upload", *args] if '-d' in args and '-s' not in args:  # patch upload to all segments
+            window = int(args[args.index('-w') + 1]) if '-w' in args else None
+            print("Uploading the changes to all segments...")
+            startTime = time.perf_counter()
+            results, sentBytes = overseer.uploadSegmentsPatched(overseer.allSegments(), window)
+            printBulkReport(results, "Upload")
+            print("Upload took {:.3f} seconds, {} segments unchanged, {:.1f} kB sent".format(
+                time.perf_counter() - startTime, sum(1 for sent in sentBytes.values() if sent == 0),
+                sum(sentBytes.values()) / 1000))
+
+        case ["upload", *args] if '-s' not in args:
+            # the number of uploads in flight at once can be set with -w, e.g. "upload -w 16"
+            window = int(args[args.index('-w') + 1]) if '-w' in args else None
             print("Uploading data to all segments...")
-            for segment_no in range(1, segment_count + 1):
-                # programming technique that runs the upload and if it succeeds prints the message
-                if segmentSendData(str(segment_no)):
-                    print("✓ Upload success to segment # {}".format(segment_no))
-                else:
-                    print("✕ Upload failed to segment # {}".format(segment_no))
-                time.sleep(0.250)
-            # client.publish(overseerCommandPath, "upload::all")
+            startTime = time.perf_counter()
+            # -c: chunked uploads, several segments at a time
+            printBulkReport(overseer.upload(window=window, chunked='-c' in args), "Upload")
+            print("Upload took {:.3f} seconds".format(
+                time.perf_counter() - startTime))
+
+        case ["stream", *args]:  # stream the experiment file live instead of uploading it
+            rate = float(args[args.index('-r') + 1]) if '-r' in args else streamRate_hz
+            duration = float(args[args.index('-t') + 1]) if '-t' in args else None
+            frames = overseer.experimentFrames(rate)
+            if frames is not None:
+                print("Streaming the experiment at {} Hz, stop ends the stream".format(rate))
+                printStreamReport(overseer.stream(frames, rate, duration))
 
         case ["timesync"]:
             print("Syncing time in all segments")
-            # get the current time in UTC so there are no issues with timezones and daylight savings
-            now_utc = datetime.now(timezone.utc)
-            # client.publish(overseerCommandPath, "timesync::all", 1)
+            printClockOffsets(overseer.timesync())
 
         case ["restart"]:
             print("Restarting time in all segments")
-            for segment_no in range(1, segment_count + 1):
-                # programming technique that runs the upload and if it succeeds prints the message
-                if segment_restart(segment_no):
-                    print("✓ Restart success  on segment # {}".format(segment_no))
-                else:
-                    print("✕ Restart failed on segment # {}".format(segment_no))
-                time.sleep(0.250)
+            printBulkReport(overseer.restart(), "Restart")
+
+        case ["status"]:
+            printSegmentStatus(overseer, overseer.status())
+
+        case ["stats"]:
+            printTelemetry(overseer.telemetry)
+
+        case ["stats", *args] if '-o' in args:  # write the telemetry of all segments to a JSON file
+            statsPath = args[args.index('-o') + 1]
+            overseer.telemetry.dump(statsPath)
+            print("Telemetry written to {}".format(statsPath))
+
+        case ["capture", *args] if '-o' in args:  # append every published and received message to a capture file
+            capturePath = args[args.index('-o') + 1]
+            if overseer.startCapture(capturePath):
+                print("Capturing all messages to {}".format(capturePath))
+
+        case ["capture_stop"]:
+            overseer.stopCapture()
+            print("Capture stopped")
 
         case ["clear_pairing"]:
             print("Clearing all segment IDs")
-            clearSegmentsID()
+            if overseer.clearSegmentsID():
+                print("Segments ID list has been cleared")
+
+        case ["clear_cache"]:
+            overseer.clearPayloadCache()
+            print("Cleared the cached payloads of all segments")
 
         # individual segment commands----------------------------segment topic
 
+        case ["upload", *args] if '-s' in args and '-d' in args:  # patch upload to a specific segment
+            segment_no = args[args.index('-s') + 1]
+            sent = overseer.segmentSendDataPatch(segment_no)
+            if sent is None:
+                print("Upload failed to segment # {}".format(segment_no))
+            elif sent == 0:
+                print("Segment # {} is up to date".format(segment_no))
+            else:
+                print("Uploaded {} changed bytes to segment # {}".format(sent, segment_no))
+
+        case ["upload", *args] if '-s' in args and '-c' in args:  # chunked upload to a specific segment
+            segment_no = args[args.index('-s') + 1]
+            if int(segment_no) > overseer.segment_count or int(segment_no) < 1:
+                print("Invalid segment number")
+            elif overseer.segmentSendDataChunked(segment_no):
+                print("Uploaded data to segment # {} in chunks".format(segment_no))
+            else:
+                print("Upload failed to segment # {}".format(segment_no))
+
         case ["upload", *args] if '-s' in args:  # upload to a specific segment
             # get and verify the segment number validity
             segment_no = args[args.index('-s') + 1]
-            if int(segment_no) > segment_count or int(segment_no) < 1:
+            if int(segment_no) > overseer.segment_count or int(segment_no) < 1:
                 print("Invalid segment number")
             else:
                 # programming technique that runs the upload and if it succeeds prints the message
-                if segmentSendData(segment_no):
+                if overseer.segmentSendData(segment_no):
                     print("Uploaded data to segment # {}".format(segment_no))
                 else:
                     print("Upload failed to segment # {}".format(segment_no))
@@ -497,7 +1900,7 @@ while True:
         case ["move", *args] if '-s' and '-p' in args:  # move a specific segment
             segment_no = args[args.index('-s') + 1]
             position = args[args.index('-p') + 1]
-            if move_segment(segment_no, position):
+            if overseer.move(position, segment_no):
                 print("Moving the segment # {} to {}".format(
                     segment_no, position))
             else:
@@ -505,25 +1908,31 @@ while True:
 
         case ["timesync", *args] if '-s' in args:  # timesync an individual segment
             segment_no = args[args.index('-s') + 1]
-            # print("Syncing time in segment # {}".format(segment_no))
+            print("Syncing time in segment # {}".format(segment_no))
+            printClockOffsets(overseer.timesync([segment_no]))
+
+        case ["clear_cache", *args] if '-s' in args:  # drop the cached payload of a specific segment
+            segment_no = args[args.index('-s') + 1]
+            overseer.clearPayloadCache(segment_no)
+            print("Cleared the cached payload of segment # {}".format(segment_no))
 
         case ["clear_pairing", *args] if '-s' in args:  # clear a specific segment ID
             segment_no = args[args.index('-s') + 1]
-            if clearSegmentID(segment_no):
+            if overseer.clearSegmentID(segment_no):
                 print("Cleared the segment # {}".format(segment_no))
             else:
                 print("Clearing failed")
 
         case ["reset", *args] if '-s' in args:  # reset a specific segment
             segment_no = args[args.index('-s') + 1]
-            if segment_reset(segment_no):
+            if overseer.segment_reset(segment_no):
                 print("Reset the segment # {}".format(segment_no))
             else:
                 print("Reset failed")
 
         case ["restart", *args] if '-s' in args:  # restart a specific segment
             segment_no = args[args.index('-s') + 1]
-            if segment_restart(segment_no):
+            if overseer.segment_restart(segment_no):
                 print("Restarting the segment # {}".format(segment_no))
             else:
                 print("Restart failed")
@@ -531,12 +1940,12 @@ while True:
         case ["debug", *args] if '-s' in args:  # debug a specific segment
             segment_no = args[args.index('-s') + 1]
             print("Debugging segment # {}:".format(segment_no))
-            print(getSegmentID(segment_no))
-            print(get_segment_status(segment_no))
+            print(overseer.getSegmentID(segment_no))
+            print(overseer.get_segment_status(segment_no))
 
         case ["assign", *args] if '-s' in args:  # assign a segment an ID
             segment_no = args[args.index('-s') + 1]
-            if addSegmentID(segment_no):
+            if overseer.addSegmentID(segment_no):
                 print("Assignment successful")
             else:
                 print("Assignment failed")
@@ -545,13 +1954,90 @@ while True:
 
         case ["debug"]:
             print("Latest global message received: {}".format(
-                latestOverseerReturnMessage))
-
-        case ["exit" | "quit"]:
-            print("Exiting the program")
-            client.publish(overseerCommandPath, "stop", 1)
-            client.loop_stop()
-            quit()
+                overseer.latestReturnMessage()))
 
         case _:
             print("Invalid command\nPlease refer to readme.md")
+
+
+def printSegmentStatus(overseer, results):  # results of Overseer.status or requestStatusAsync
+    for segment_no, (status, latency) in results.items():
+        if overseer.getSegmentID(segment_no) == "Null":
+            continue
+        if status is None:
+            print("✕ Segment # {}: no reply".format(segment_no))
+        else:
+            print("✓ Segment # {}: {} ({:.1f} ms)".format(
+                segment_no, status, latency * 1000))
+
+
+# run one command once the parts of the rig it changes are free, waiting holds the task in waiting
+async def handleCommand(overseer, input_str, locks, waiting):
+    words = input_str.split()
+    task = asyncio.current_task()
+    try:
+        if words == ["status"]:  # the replies are awaited on the loop, no worker thread is needed
+            printSegmentStatus(overseer, await overseer.requestStatusAsync(overseer.allSegments()))
+            return
+
+        if words[0] == "stream" and locks["stream"].locked():  # a stream runs until stop, a second one would never start
+            print("A stream is already running, stop it first: {}".format(input_str))
+            return
+
+        resources = commandResources.get(words[0], ())  # sorted, the locks are always taken in the same order
+        if any(locks[resource].locked() for resource in resources):
+            print("Waiting for the running commands to finish: {}".format(input_str))
+        waiting.add(task)
+        async with contextlib.AsyncExitStack() as stack:
+            for resource in resources:
+                await stack.enter_async_context(locks[resource])
+            waiting.discard(task)
+            await asyncio.to_thread(runCommand, overseer, input_str)
+    except asyncio.CancelledError:
+        if task not in waiting:
+            raise
+        print("Cancelled: {}".format(input_str))
+    except Exception as error:  # a mistyped argument ends only this command, not the console
+        print("Command failed: {} ({})".format(input_str, error))
+    finally:
+        waiting.discard(task)
+
+
+async def console(overseer):  # an infinite loop that waits for a command to control the whole shive machine
+    locks = {resource: asyncio.Lock() for resources in commandResources.values() for resource in resources}
+    waiting = set()  # tasks of the commands that wait for a conflicting one, "stop" cancels them
+    tasks = set()
+    while True:
+        try:
+            input_str = (await asyncio.to_thread(input, "\nEnter a command: ")).lower()
+        except EOFError:
+            input_str = "exit"
+        if input_str.split() in (["exit"], ["quit"]):
+            break
+        if input_str.split() == ["stop"]:
+            for task in list(waiting):
+                task.cancel()
+        if input_str.split():
+            task = asyncio.create_task(handleCommand(overseer, input_str, locks, waiting))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    if tasks:
+        overseer.streamStopEvent.set()  # a stream without -t runs until stop, end it instead of waiting forever
+        print("Waiting for {} running commands to finish".format(len(tasks)))
+        await asyncio.gather(*tasks)
+    print("Exiting the program")
+    overseer.stop()
+    overseer.close()
+
+
+def main():  # connect with the default settings and open the console
+    overseer = Overseer()
+    if capturePath is not None:
+        overseer.startCapture(capturePath)
+    overseer.connect()
+    asyncio.run(console(overseer))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# © Jakub Jandus 2023
+# Replay of a captured overseer session against a broker
+# The messages of a capture file ("capture -o file" in the overseer console) are published again with their
+#    original topics and QoS, in real time or faster, so an incident can be reproduced or the message path
+#    loaded with real traffic
+#
+#     python replay.py session.shivecap          plays the session back in real time
+#     python replay.py session.shivecap 4        plays it four times faster
+#     python replay.py session.shivecap max      plays it as fast as possible
+#
+# the overseer's commands are replayed too, so point it at a test broker and not at the rig
+
+import sys
+import time
+import paho.mqtt.client as mqtt
+
+from overseer import broker, port, readCapture, setNoDelay
+
+
+# ---------------------- Settings ----------------------#
+
+# "sent" replays the overseer's messages (drives segments, e.g. segmentFleet.py),
+#    "received" the segments' messages (drives an overseer)
+replayDirections = ("sent", "received")
+replayWindow = 64  # QoS 1 and 2 messages in flight at once
+replayTimeout_s = 5.0  # seconds to wait for the broker's acknowledgement of each message
+lateThreshold_ms = 5.0  # messages published later than this behind their captured time count as late
+clientName = "Replay"
+
+
+# ---------------------- Replay ----------------------#
+
+# publish the messages of a capture file, speed 1 is real time and 0 as fast as possible, returns a report
+def replayCapture(path, speed=1., directions=replayDirections, broker=broker, port=port, clientName=clientName):
+    client = mqtt.Client(clientName)
+    client.on_socket_open = setNoDelay
+    client.max_inflight_messages_set(replayWindow)
+    client.connect(broker, port)
+    client.loop_start()
+
+    messages = 0
+    sentBytes = 0
+    late = 0
+    maxLag = 0.
+    failed = 0
+    inFlight = []  # MQTTMessageInfo of the unacknowledged messages, oldest first
+    firstTime = lastTime = None
+
+    def waitForOldest():
+        info = inFlight.pop(0)
+        try:
+            info.wait_for_publish(replayTimeout_s)
+        except (ValueError, RuntimeError):  # the message was never queued, or the client disconnected
+            pass
+        return info.is_published()
+
+    try:
+        startTime = time.perf_counter()
+        for captureTime, direction, topic, qos, payload in readCapture(path):
+            if direction not in directions:
+                continue
+            if firstTime is None:
+                firstTime = captureTime
+            lastTime = captureTime
+            if speed > 0:
+                # scheduled from the start, so a late message does not delay the next ones
+                scheduled = startTime + (captureTime - firstTime) / speed
+                wait_s = scheduled - time.perf_counter()
+                if wait_s > 0:
+                    time.sleep(wait_s)
+                lag = time.perf_counter() - scheduled
+                maxLag = max(maxLag, lag)
+                if lag * 1000 > lateThreshold_ms:
+                    late += 1
+
+            if len(inFlight) >= replayWindow and not waitForOldest():
+                failed += 1
+            info = client.publish(topic, payload, qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                failed += 1
+            elif qos > 0:
+                inFlight.append(info)
+            messages += 1
+            sentBytes += len(payload)
+
+        while inFlight:
+            if not waitForOldest():
+                failed += 1
+        duration_s = time.perf_counter() - startTime
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    return {"messages": messages, "bytes": sentBytes, "failed": failed, "duration_s": duration_s,
+            "capture_duration_s": lastTime - firstTime if firstTime is not None else 0.,
+            "rate_hz": messages / duration_s if duration_s > 0 else 0., "late": late, "max_lag_ms": maxLag * 1000}
+
+
+def printReplayReport(report):
+    print("Replayed {} messages ({:.1f} kB) in {:.2f} s, captured over {:.2f} s ({:.0f} messages/s), {} failed".format(
+        report["messages"], report["bytes"] / 1000, report["duration_s"], report["capture_duration_s"],
+        report["rate_hz"], report["failed"]))
+    print("{} published late, latest {:.2f} ms behind the captured timing".format(report["late"], report["max_lag_ms"]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python replay.py <capture file> [speed | max]")
+        sys.exit(1)
+    speed = 1.
+    if len(sys.argv) == 3:
+        speed = 0. if sys.argv[2] == "max" else float(sys.argv[2])
+    printReplayReport(replayCapture(sys.argv[1], speed))
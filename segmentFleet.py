@@ -0,0 +1,553 @@
+# © Jakub Jandus 2023
+# Simulated segment fleet for load testing the ShiveWorks overseer without hardware
+# Every virtual segment is its own MQTT client speaking the WaveSegment topic protocol, all of them run
+#    on one asyncio loop, so hundreds to thousands of segments fit in one process
+#
+#     python segmentFleet.py             runs the fleet until Ctrl+C, drive it from the overseer console
+#     python segmentFleet.py loadtest    pairs, uploads, polls, syncs, starts and moves the fleet from an
+#                                        Overseer in the same process and prints the report
+#
+# the fleet writes its IDs to fleetFilePath, point the overseer's filePath and segment_count at it to pair them
+
+import asyncio
+import csv
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+import paho.mqtt.client as mqtt
+from struct import unpack
+
+from overseer import (Overseer, broker, port, actuationDataPath, overseerCommandPath, overseerReturnPath,
+                      overseerStreamPath, segmentPath, payloadDtype, compactPayloadMagic, decodeCompactPayload, chunkHeaderFormat,
+                      chunkHeaderSize, moveAllPrefix, setNoDelay, unpackStreamFrame)
+
+
+# ---------------------- Settings ----------------------#
+
+fleetSize = 400  # number of virtual segments
+fleetFilePath = "fleetSegmentsID.csv"  # the fleet's IDs, one line per segment number, in the overseer's format
+idPrefix = "f1ee7"  # segment IDs are the prefix followed by the hexadecimal segment index, like the ESP32 MAC IDs
+clockSkew_ms = 20.  # every segment clock is off by up to this much, so timesync has something to correct
+restartDelay_s = 1.0  # time a restarted segment stays offline
+connectBatch = 50  # segments connected before the loop handles the first replies
+maxDataLength = 65535  # data buffer of the firmware, longer messages are rejected with a warning status
+reportInterval_s = 10.  # the standalone fleet prints a short summary this often
+
+# the load test generates an experiment of this length and tiles it over the whole fleet
+loadTestLength_ms = 10000
+loadTestProtocolPairing = 4  # segments paired by pressing their (virtual) button, the rest from the IDs file
+loadTestTimeout_s = 60.
+
+
+# ---------------------- Virtual Segment ----------------------#
+# follows handleMQTTmessage and the state machine of WaveSegment/src/main.cpp, including its quirks:
+#    the segment number is a uint8, the Ready status is not reported until "status_report",
+#    a chunk with a bad CRC is not acknowledged and a patch overwrites only its own byte ranges
+# every received message is logged by kind with its latency since the fleet's last mark()
+
+class VirtualSegment:
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index  # the segment number the overseer knows it by, the segment's own number is a uint8
+        self.ID = "{}{:04x}".format(idPrefix, index)
+        self.topics = {whatToDo: segmentPath + "/" + self.ID + "/" + whatToDo
+                       for whatToDo in ("command", "return", "data", "chunk", "status")}
+        self.clockOffset_ms = random.uniform(-clockSkew_ms, clockSkew_ms)
+        self.client = mqtt.Client(self.ID)
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.latencies = {}  # message kind -> [seconds since the fleet's mark]
+        self.errors = []
+        self.boot()
+
+    def boot(self):  # the state after power up, also after a restart
+        self.status = "Initializing"
+        self.segmentNumber = 0
+        self.acknowledged = False  # the firmware's mqttAck, kept until the segment is Connected or Pairing
+        self.buffer = bytearray()
+        self.dataLength = 0
+        self.chunkTransfer = None  # (transfer ID, set of received chunk indices) while a chunked upload runs
+        self.payload = None  # the decoded <HB records of the last complete payload
+        self.payloadValid = None
+        self.payloadMatches = None
+        self.startTime_ms = None  # start time of the experiment in the segment's clock
+        self.startMargin_ms = None  # time left until that start when the command arrived, negative if late
+        self.position = 127
+        self.lastStreamSequence = None
+
+    def clock_ms(self):  # the segment's NTP clock
+        return time.time() * 1000 + self.clockOffset_ms
+
+    # --- asyncio socket hooks, paho reads and writes when the loop says the socket is ready ---#
+
+    def on_socket_open(self, client, userdata, sock):
+        setNoDelay(client, userdata, sock)
+        self.fleet.loop.add_reader(sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.fleet.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.fleet.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.fleet.loop.remove_writer(sock)
+
+    def connect(self):
+        try:
+            self.client.connect(self.fleet.broker, self.fleet.port)
+        except OSError as e:
+            self.status = "Fault"
+            self.errors.append("Connection failed: {}".format(e))
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            self.status = "Fault"
+            self.errors.append("Connection refused: {}".format(rc))
+            return
+        client.subscribe([(overseerCommandPath, 1), (self.topics["command"], 1), (self.topics["data"], 1),
+                          (self.topics["chunk"], 1), (overseerStreamPath, 0)])
+        self.setStatus("Connected", report=True)
+
+    def restart(self):  # ESP.restart(): offline for restartDelay_s, then booting with empty buffers
+        self.client.disconnect()
+        self.boot()
+        self.fleet.loop.call_later(restartDelay_s, self.connect)
+
+    # --- status and pairing ---#
+
+    def setStatus(self, status, report=False):
+        self.status = status
+        if report:
+            self.sendStatus(status)
+        if status in ("Connected", "Pairing") and self.acknowledged:
+            self.acknowledged = False
+            self.setStatus("Paired", report=True)
+
+    def sendStatus(self, message):
+        self.client.publish(self.topics["status"], message)
+
+    def sendReturn(self, message):
+        self.client.publish(self.topics["return"], message)
+
+    def beginPairing(self):  # a click on the segment's button
+        if self.status in ("Pairing", "Estop", "Fault", "Running"):
+            self.status = "Fault"
+            return
+        self.client.publish(overseerReturnPath, "pairing::" + self.ID)
+        self.setStatus("Pairing", report=True)
+
+    # --- received messages ---#
+
+    def record(self, kind):
+        markTime = self.fleet.markTime
+        if markTime is not None:
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - markTime)
+
+    def on_message(self, client, userdata, message):
+        topic = message.topic
+        payload = message.payload
+        if topic == overseerStreamPath:
+            self.record("stream")
+            self.receiveStreamFrame(payload)
+        elif topic == overseerCommandPath and payload.startswith(moveAllPrefix):
+            self.record("move_all")
+            if 0 < self.segmentNumber and len(payload) >= len(moveAllPrefix) + self.segmentNumber:
+                self.position = payload[len(moveAllPrefix) + self.segmentNumber - 1]
+        elif len(payload) > maxDataLength - 1:
+            self.sendStatus("Warning: message is over maxDataLength set in mqtt.cpp")
+        elif topic == self.topics["data"]:
+            self.record("data")
+            self.buffer[:len(payload)] = payload
+            self.dataLength = len(payload)
+            self.handleActuationData()
+        elif topic == self.topics["chunk"]:
+            self.record("chunk")
+            self.receiveChunk(payload)
+        elif topic == overseerCommandPath:
+            self.record("broadcast")
+            self.handleBroadcast(payload.decode("utf-8", "replace"))
+        elif topic == self.topics["command"]:
+            self.record("command")
+            self.handleCommand(payload.decode("utf-8", "replace"))
+
+    def handleBroadcast(self, command):
+        if command == "stop":
+            self.status = "Estop"
+        elif command.startswith("start"):
+            self.startExperiment(command)
+        elif command == "reset":
+            self.reset()
+        elif command.startswith("move"):
+            self.position = toInt(command.split(":")[-1])
+
+    def handleCommand(self, command):
+        if command == "status_report":
+            self.sendStatus(self.status)
+        elif command.startswith("ack"):
+            self.segmentNumber = toInt(command.split(":")[-1]) & 0xFF  # a uint8 on the segment
+            if self.status in ("Connected", "Pairing"):
+                self.setStatus("Paired", report=True)
+            else:
+                self.acknowledged = True
+        elif command.startswith("ping"):
+            self.sendReturn("pong::{}::{}".format(command.split(":")[-1], int(self.clock_ms())))
+        elif command.startswith("start"):
+            self.startExperiment(command)
+        elif command == "restart":
+            self.restart()
+        elif command == "reset":
+            self.reset()
+        elif command.startswith("move"):
+            self.position = toInt(command.split(":")[-1])
+
+    def startExperiment(self, command):
+        if self.status != "Ready":
+            return
+        self.startTime_ms = toInt(command.split(":")[-1])
+        self.startMargin_ms = self.startTime_ms - self.clock_ms()
+        self.status = "Running"
+
+    def reset(self):
+        self.buffer[:self.dataLength] = bytes(self.dataLength)
+        self.chunkTransfer = None
+        self.startTime_ms = None
+        self.status = "Paired"
+
+    def receiveStreamFrame(self, payload):
+        if self.segmentNumber == 0 or len(payload) < 6 + self.segmentNumber:
+            return
+        sequence, frameTime_us, positions = unpackStreamFrame(payload)
+        if (self.lastStreamSequence is not None and sequence != 0 and
+                (sequence - self.lastStreamSequence + 0x8000) % 0x10000 - 0x8000 <= 0):
+            return  # older than the last frame
+        self.lastStreamSequence = sequence
+        if self.status in ("Paired", "Ready"):
+            self.position = int(positions[self.segmentNumber - 1])
+
+    def receiveChunk(self, payload):
+        if len(payload) < chunkHeaderSize:
+            return
+        transferID, index, count, offset, totalLength, crc = unpack(chunkHeaderFormat, payload[:chunkHeaderSize])
+        data = payload[chunkHeaderSize:]
+        if (index >= count or totalLength > maxDataLength or offset + len(data) > totalLength or
+                zlib.crc32(data) != crc):
+            self.errors.append("Rejected chunk {} of transfer {}".format(index, transferID))
+            return  # not acknowledged, the overseer sends it again
+
+        if self.chunkTransfer is None or self.chunkTransfer[0] != transferID:
+            self.chunkTransfer = (transferID, set())
+            self.status = "Downloading"
+        if len(self.buffer) < totalLength:
+            self.buffer.extend(bytes(totalLength - len(self.buffer)))
+        self.buffer[offset:offset + len(data)] = data
+        self.chunkTransfer[1].add(index)
+        self.sendReturn("chunk_ack::{}::{}".format(transferID, index))
+
+        if len(self.chunkTransfer[1]) >= count:
+            self.chunkTransfer = None
+            self.dataLength = totalLength
+            self.record("payload")
+            self.handleActuationData()
+
+    # the whole payload is in the buffer: decode it like the segment would and check it against the expected one
+    def handleActuationData(self):
+        data = bytes(self.buffer[:self.dataLength])
+        records = decodePayload(data)
+        if records is None:
+            self.payload = None
+            self.payloadValid = False
+            self.payloadMatches = False
+            self.sendStatus("Warning: unknown payload format")
+            return
+        self.payload = records
+        # timestamps must rise, the last one is where the experiment loops
+        self.payloadValid = bool(len(records) > 0 and np.all(np.diff(records['timestamp'].astype(np.int64)) >= 0))
+        expected = self.fleet.expected.get(self.index)
+        self.payloadMatches = None if expected is None else bool(np.array_equal(records, expected))
+        if len(records):
+            self.position = int(records['value'][0])  # pre-move to the starting position
+        self.status = "Ready"
+
+    def summary(self):  # machine-readable statistics of one segment
+        stats = {
+            "ID": self.ID,
+            "segment": self.index,
+            "segment_number": self.segmentNumber,
+            "status": self.status,
+            "messages": {kind: len(latencies) for kind, latencies in self.latencies.items()},
+            "payload_points": None if self.payload is None else len(self.payload),
+            "payload_valid": self.payloadValid,
+            "payload_matches": self.payloadMatches,
+            "start_margin_ms": self.startMargin_ms,
+            # the start in real time, the segment clock's offset taken out
+            "start_time_ms": None if self.startTime_ms is None else self.startTime_ms - self.clockOffset_ms,
+            "position": self.position,
+            "errors": list(self.errors),
+        }
+        for kind, latencies in self.latencies.items():
+            stats[kind + "_latency_max_ms"] = max(latencies) * 1000
+        return stats
+
+
+def toInt(text):  # Arduino's String.toInt(): the leading integer of the text, 0 if there is none
+    match = re.match(r"\s*[-+]?\d+", text)
+    return int(match.group()) if match else 0
+
+
+# the <HB records of a legacy or compact payload, None if the segment would not accept it
+def decodePayload(data):
+    if len(data) % 3 != 0:
+        if len(data) < 3 or data[0] != compactPayloadMagic:
+            return None
+        try:
+            data = decodeCompactPayload(data)
+        except (ValueError, IndexError):
+            return None
+    return np.frombuffer(data, dtype=payloadDtype)
+
+
+# ---------------------- Fleet ----------------------#
+
+# the fleet needs about three file descriptors per segment (paho keeps a socket pair next to the connection)
+def raiseFileLimit(needed):
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+
+class SegmentFleet:
+
+    def __init__(self, count=fleetSize, broker=broker, port=port):
+        self.broker = broker
+        self.port = port
+        self.loop = None
+        raiseFileLimit(3 * count + 256)
+        self.segments = [VirtualSegment(self, index) for index in range(1, count + 1)]
+        self.expected = {}  # segment number -> expected <HB records
+        self.markTime = None
+        self.miscTask = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    async def start(self):  # connect every segment, they report Connected as they come up
+        self.loop = asyncio.get_running_loop()
+        for batch in range(0, len(self.segments), connectBatch):
+            for segment in self.segments[batch:batch + connectBatch]:
+                segment.connect()
+            await asyncio.sleep(0)
+        self.miscTask = asyncio.create_task(self.misc())
+
+    async def misc(self):  # keepalive pings and timeouts of all clients
+        while True:
+            await asyncio.sleep(1)
+            for segment in self.segments:
+                segment.client.loop_misc()
+
+    async def stop(self):
+        if self.miscTask is not None:
+            self.miscTask.cancel()
+        for segment in self.segments:
+            segment.client.disconnect()
+        await asyncio.sleep(0.1)  # let the disconnect messages go out
+
+    def mark(self):  # received messages are timed from now on, call it right before the overseer acts
+        self.markTime = time.perf_counter()
+        for segment in self.segments:
+            segment.latencies = {}
+
+    def expectPayloads(self, payloads):  # {segment number: payload bytes} the segments should receive, by fleet order
+        self.expected = {int(segment_no): decodePayload(payload) for segment_no, payload in payloads.items()}
+
+    def writeSegmentsID(self, filePath=fleetFilePath, unpaired=0):
+        # the first unpaired segment numbers are left empty, those segments have to be paired with their button
+        with open(filePath, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=' ')
+            for index, segment in enumerate(self.segments):
+                writer.writerow(["Null" if index < unpaired else segment.ID])
+
+    # wait until condition(segment) holds for every segment, returns the seconds it took or None on timeout
+    async def waitFor(self, condition, timeout=loadTestTimeout_s):
+        startTime = time.perf_counter()
+        while not all(condition(segment) for segment in self.segments):
+            if time.perf_counter() - startTime > timeout:
+                return None
+            await asyncio.sleep(0.01)
+        return time.perf_counter() - startTime
+
+    def report(self):
+        summaries = [segment.summary() for segment in self.segments]
+        statuses = {}
+        for summary in summaries:
+            statuses[summary["status"]] = statuses.get(summary["status"], 0) + 1
+
+        latencies = {}
+        for segment in self.segments:
+            for kind, values in segment.latencies.items():
+                latencies.setdefault(kind, []).extend(values)
+        startTimes = [summary["start_time_ms"] for summary in summaries if summary["start_time_ms"] is not None]
+        startMargins = [summary["start_margin_ms"] for summary in summaries if summary["start_margin_ms"] is not None]
+
+        return {
+            "segments": len(summaries),
+            "statuses": statuses,
+            "latency_ms": {kind: {"messages": len(values),
+                                  "p50": float(np.percentile(values, 50) * 1000),
+                                  "p99": float(np.percentile(values, 99) * 1000),
+                                  "max": float(np.max(values) * 1000)}
+                           for kind, values in latencies.items()},
+            "payloads": sum(1 for summary in summaries if summary["payload_points"] is not None),
+            "payloads_invalid": sum(1 for summary in summaries if summary["payload_valid"] is False),
+            "payloads_matching": sum(1 for summary in summaries if summary["payload_matches"] is True),
+            "payloads_mismatching": [summary["segment"] for summary in summaries
+                                     if summary["payload_matches"] is False],
+            "started": len(startTimes),
+            "start_spread_ms": float(np.ptp(startTimes)) if startTimes else None,
+            "start_margin_min_ms": float(np.min(startMargins)) if startMargins else None,
+            "errors": sum(len(summary["errors"]) for summary in summaries),
+            "per_segment": summaries,
+        }
+
+
+def printLatencies(report):
+    for kind, stats in sorted(report["latency_ms"].items()):
+        print("  {:10s} {:6d} messages, latency p50 {:8.1f} ms, p99 {:8.1f} ms, max {:8.1f} ms".format(
+            kind, stats["messages"], stats["p50"], stats["p99"], stats["max"]))
+
+
+def printReport(report):
+    print("{} segments: {}".format(report["segments"], ", ".join(
+        "{} {}".format(count, status) for status, count in sorted(report["statuses"].items()))))
+    printLatencies(report)
+    print("  Payloads: {} received, {} matching, {} mismatching, {} invalid".format(
+        report["payloads"], report["payloads_matching"], len(report["payloads_mismatching"]),
+        report["payloads_invalid"]))
+    if report["payloads_mismatching"]:
+        print("  Mismatching payloads on segments {}".format(report["payloads_mismatching"][:20]))
+    if report["started"]:
+        print("  Started: {} segments, spread {:.1f} ms, tightest margin {:.1f} ms".format(
+            report["started"], report["start_spread_ms"], report["start_margin_min_ms"]))
+    if report["errors"]:
+        print("  {} segment errors".format(report["errors"]))
+
+
+# the payloads the overseer would send to each segment from an actuation data folder
+def expectedPayloads(actuationDataPath, segment_count):
+    rig = Overseer(segment_count=segment_count, actuationDataPath=actuationDataPath)
+    if os.path.isfile(actuationDataPath + '/' + rig.experimentFileName):
+        experiment = rig.loadExperiment()
+        available = range(1, min(segment_count, experiment["header"]["segment_count"]) + 1) if experiment else []
+    else:
+        available = [segment_no for segment_no in rig.allSegments()
+                     if os.path.isfile(rig.getSegmentDataSource(segment_no))]
+    payloads = {segment_no: rig.packageSegmentData(segment_no) for segment_no in available}
+    return {segment_no: payload for segment_no, payload in payloads.items() if payload is not None}
+
+
+# ---------------------- Running ----------------------#
+
+async def runFleet(count=fleetSize):  # serve the fleet until Ctrl+C, a summary every reportInterval_s
+    fleet = SegmentFleet(count)
+    fleet.writeSegmentsID()
+    fleet.expectPayloads(expectedPayloads(actuationDataPath, count))
+    await fleet.start()
+    fleet.mark()
+    print("{} virtual segments on {}:{}, their IDs are in {}".format(count, fleet.broker, fleet.port, fleetFilePath))
+    try:
+        while True:
+            await asyncio.sleep(reportInterval_s)
+            report = fleet.report()
+            report.pop("per_segment")
+            printReport(report)
+    finally:
+        printReport(fleet.report())
+        await fleet.stop()
+
+
+# one round of every overseer operation against the fleet, the overseer runs in worker threads
+#    every step prints how long the fleet took to get there after the overseer's call returned,
+#    and the latency of the messages the segments received since the call began
+async def loadTest(count=fleetSize):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PropertyControlFunctions"))
+    import GEN
+
+    with tempfile.TemporaryDirectory() as folder:
+        params = GEN.defaultParameters({"Tf": loadTestLength_ms / 1000})
+        K_g = GEN.generate(params)
+        K_g = np.tile(K_g, (1, -(-count // K_g.shape[1])))[:, :count]
+        GEN.makeExperimentFile(K_g, params, folder)
+
+        fleet = SegmentFleet(count)
+        IDsPath = folder + "/segmentsID.csv"
+        fleet.writeSegmentsID(IDsPath, unpaired=loadTestProtocolPairing)
+        fleet.expectPayloads(expectedPayloads(folder, count))
+        rig = Overseer(segment_count=count, actuationDataPath=folder, filePath=IDsPath,
+                       clientName="Fleet Load Test")
+        rig.connect()
+
+        async def step(name, action, condition, timeout=loadTestTimeout_s):
+            fleet.mark()
+            result = await action() if asyncio.iscoroutinefunction(action) else await asyncio.to_thread(action)
+            seconds = await fleet.waitFor(condition, timeout)
+            print("{:12s} {}".format(name, "timed out" if seconds is None else
+                                     "{:.3f} s after the call returned".format(seconds)))
+            printLatencies(fleet.report())
+            return result
+
+        async def pairByButton():
+            await fleet.waitFor(lambda segment: segment.status != "Initializing")
+            for segment_no, segment in enumerate(fleet.segments[:loadTestProtocolPairing], 1):
+                segment.beginPairing()
+                await fleet.waitFor(lambda _: rig.latestReturnMessage() == "pairing::" + segment.ID, 5)
+                await asyncio.to_thread(rig.addSegmentID, segment_no)
+
+        try:
+            await step("Connect", fleet.start, lambda segment: segment.status != "Initializing")
+            await step("Pair", pairByButton, lambda segment: segment.status == "Paired")
+            await step("Upload", rig.upload, lambda segment: segment.status == "Ready")
+            results = await step("Status", rig.status, lambda segment: "command" in segment.latencies)
+            replies = [latency for status, latency in results.values() if status is not None]
+            print("  {} of {} replied to the overseer, slowest in {:.1f} ms".format(
+                len(replies), count, max(replies) * 1000 if replies else float("nan")))
+            offsets = await step("Timesync", rig.timesync, lambda segment: True)
+            print("  {} of {} synced".format(len(offsets), count))
+            await step("Start", rig.start, lambda segment: segment.status == "Running")
+            # the segments pick their byte of move_all by their uint8 number, as the firmware does,
+            #    so beyond 255 segments some of them end up at another segment's position
+            positions = rig.experimentPositionsAt(loadTestLength_ms // 2)
+            await step("Move all", lambda: rig.move_all(positions),
+                       lambda segment: segment.position == positions[segment.index - 1], timeout=5)
+            print("  {} of {} segments at their position".format(
+                sum(segment.position == positions[segment.index - 1] for segment in fleet.segments), count))
+            await step("Stop", rig.stop, lambda segment: segment.status == "Estop")
+            report = fleet.report()
+            printReport(report)
+            return report
+        finally:
+            rig.close()
+            await fleet.stop()
+
+
+if __name__ == "__main__":
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "loadtest":
+            asyncio.run(loadTest())
+        else:
+            asyncio.run(runFleet())
+    except KeyboardInterrupt:
+        pass
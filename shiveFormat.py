@@ -0,0 +1,89 @@
+# © Jakub Jandus 2023
+# Data formats shared by the ShiveWorks generator (PropertyControlFunctions/GEN.py) and the overseer
+# GEN.py writes the files and the overseer reads them and sends them on, both import the formats from here
+#    so the two sides cannot drift apart
+
+import json
+import numpy as np
+
+
+# ---------------------- Segment Payload ----------------------#
+
+# the ESP32 payload format: little-endian records of a 2-byte unsigned timestamp and a 1-byte unsigned value
+payloadDtype = np.dtype([('timestamp', '<u2'), ('value', 'u1')])
+
+
+# function that packs timestamp and value arrays into the binary payload while type-checking
+#    rows with the value -100 are dropped, the first and last row are kept the same way as
+#    overseer.loadSegmentData does for the .csv files
+def packActuationData(timestamps, values):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+
+    if timestamps.min() < 0 or timestamps.max() > 65535:
+        raise ValueError("Invalid timestamp in range: {} - {}".format(
+            timestamps.min(), timestamps.max()))
+
+    keep = values != -100
+    if np.any((values[keep] > 255) | (values[keep] < 0)):
+        raise ValueError("Actuation value is out of range")
+
+    records = np.empty(np.count_nonzero(keep) + 2, dtype=payloadDtype)
+    start = 0
+    # if the first row is value-empty, then write the default middle value
+    if not keep[0]:
+        records[0] = (timestamps[0], 127)
+        start = 1
+    end = start + np.count_nonzero(keep)
+    records['timestamp'][start:end] = timestamps[keep]
+    records['value'][start:end] = values[keep]
+
+    # copy the last actuation value at the final timestamp if it was dropped
+    if records['timestamp'][end - 1] != timestamps[-1]:
+        records[end] = (timestamps[-1], records['value'][end - 1])
+        end = end + 1
+
+    return records[:end].tobytes()
+
+
+# ---------------------- Experiment File ----------------------#
+# a single file holding the whole K_g array of an experiment and its metadata
+#    layout: 8-byte magic, uint32 header length, JSON header (padded to 16 bytes), then the body:
+#        uint16 timestamps [n_samples], int16 values [n_samples, segment_count] in C order (-100 = skip)
+#    the overseer memory-maps the file and slices out one segment column on demand
+
+experimentMagic = b"SHIVEXP1"
+
+
+# the magic, header length and JSON header that start an experiment file
+def experimentFileHeader(params, n_samples, segment_count):
+    header = {
+        "n_samples": int(n_samples),
+        "segment_count": int(segment_count),
+        "sample_period_ms": params["t_SampPeri"] * 1000,
+        "parameters": params,
+    }
+    headerBytes = json.dumps(header).encode("utf-8")
+    # pad the header so that the body starts 16-byte aligned
+    headerBytes += b" " * (-(len(experimentMagic) + 4 + len(headerBytes)) % 16)
+    return experimentMagic + np.uint32(len(headerBytes)).astype('<u4').tobytes() + headerBytes
+
+
+# read the header of an experiment file, returns (header dictionary, offset of the body)
+def readExperimentHeader(file):
+    if file.read(len(experimentMagic)) != experimentMagic:
+        raise ValueError("Not a ShiveWorks experiment file")
+    headerLength = int(np.frombuffer(file.read(4), dtype='<u4')[0])
+    header = json.loads(file.read(headerLength).decode("utf-8"))
+    return header, len(experimentMagic) + 4 + headerLength
+
+
+# memory-map an experiment file, returns (header, timestamps [n_samples], values [n_samples, segment_count])
+def mapExperimentFile(filePath):
+    with open(filePath, 'rb') as file:
+        header, offset = readExperimentHeader(file)
+    n_samples = header["n_samples"]
+    timestamps = np.memmap(filePath, dtype='<u2', mode='r', offset=offset, shape=(n_samples,))
+    values = np.memmap(filePath, dtype='<i2', mode='r', offset=offset + 2 * n_samples,
+                       shape=(n_samples, header["segment_count"]))
+    return header, timestamps, values
@@ -0,0 +1,132 @@
+# © Jakub Jandus 2023
+# Fake segment for the streaming mode of the ShiveWorks overseer
+# It listens to the stream frames like a segment would and measures how evenly they arrive
+#    run it next to the overseer, start a stream ("stream -t 10") and the report is printed when it ends
+
+import paho.mqtt.client as mqtt
+import threading
+import time
+import numpy as np
+
+from overseer import broker, port, overseerStreamPath, setNoDelay, unpackStreamFrame
+
+
+# ---------------------- Settings ----------------------#
+
+segment_no = 1  # the position of this segment is taken out of every frame
+idleTimeout_s = 2.0  # seconds without a frame after which the stream counts as finished
+clientName = "Stream Monitor"
+
+
+# ---------------------- Monitor ----------------------#
+# every frame is logged with its arrival time, the report compares the arrivals with the frame times:
+#    interval: time between two arrivals, ideally the frame period
+#    jitter:   arrival time minus frame time, relative to the fastest frame, so the clock offset drops out
+
+class StreamMonitor:
+
+    def __init__(self, segment_no=segment_no, broker=broker, port=port, clientName=clientName):
+        self.segment_no = segment_no
+        self.broker = broker
+        self.port = port
+        self.client = mqtt.Client(clientName)
+        self.lock = threading.Lock()
+        self.lastFrame = 0.
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.arrivals = []
+            self.sequences = []
+            self.frameTimes = []
+            self.positions = []
+
+    def on_message(self, client, userdata, message):
+        arrival = time.perf_counter()
+        sequence, frameTime_us, positions = unpackStreamFrame(message.payload)
+        with self.lock:
+            self.arrivals.append(arrival)
+            self.sequences.append(sequence)
+            self.frameTimes.append(frameTime_us)
+            self.positions.append(positions[self.segment_no - 1] if len(positions) >= self.segment_no else -1)
+            self.lastFrame = arrival
+
+    def start(self):
+        self.client.on_message = self.on_message
+        self.client.on_socket_open = setNoDelay
+        self.client.connect(self.broker, self.port)
+        self.client.subscribe(overseerStreamPath, 0)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    # wait for a stream to start and end, or for timeout seconds at most
+    def waitForStream(self, timeout=None):
+        startTime = time.perf_counter()
+        while timeout is None or time.perf_counter() - startTime < timeout:
+            time.sleep(0.1)
+            with self.lock:
+                if self.arrivals and time.perf_counter() - self.lastFrame > idleTimeout_s:
+                    return True
+        return False
+
+    def report(self):  # statistics of the frames received so far
+        with self.lock:
+            arrivals = np.array(self.arrivals)
+            sequences = np.array(self.sequences, dtype=np.int64)
+            frameTimes = np.array(self.frameTimes, dtype=np.int64)
+            positions = np.array(self.positions)
+        if len(arrivals) < 2:
+            return {"segment": self.segment_no, "frames": len(arrivals)}
+
+        # the sequence and frame time wrap around, unwrap them from the steps between frames
+        sequenceSteps = (np.diff(sequences) + 0x8000) % 0x10000 - 0x8000
+        frameTimes = np.concatenate(([0], np.cumsum(np.diff(frameTimes) % 0x100000000)))
+        delays = (arrivals - arrivals[0]) - frameTimes / 1e6
+        jitter = (delays - delays.min()) * 1000
+        intervals = np.diff(arrivals) * 1000
+        period = np.median(np.diff(frameTimes)) / 1000
+
+        return {
+            "segment": self.segment_no,
+            "frames": len(arrivals),
+            "lost": int(np.sum(sequenceSteps[sequenceSteps > 1] - 1)),
+            "reordered": int(np.sum(sequenceSteps < 1)),
+            "period_ms": float(period),
+            "rate_hz": float((len(arrivals) - 1) / (arrivals[-1] - arrivals[0])),
+            "interval_mean_ms": float(intervals.mean()),
+            "interval_std_ms": float(intervals.std()),
+            "interval_max_ms": float(intervals.max()),
+            "jitter_p50_ms": float(np.percentile(jitter, 50)),
+            "jitter_p99_ms": float(np.percentile(jitter, 99)),
+            "jitter_max_ms": float(jitter.max()),
+            "position_changes": int(np.count_nonzero(np.diff(positions))),
+        }
+
+
+def printReport(report):
+    if report["frames"] < 2:
+        print("Received {} frames, nothing to report".format(report["frames"]))
+        return
+    print("Received {} frames at {:.1f} Hz (period {:.2f} ms), {} lost, {} reordered".format(
+        report["frames"], report["rate_hz"], report["period_ms"], report["lost"], report["reordered"]))
+    print("Interval: mean {:.2f} ms, std {:.2f} ms, max {:.2f} ms".format(
+        report["interval_mean_ms"], report["interval_std_ms"], report["interval_max_ms"]))
+    print("Jitter:   p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        report["jitter_p50_ms"], report["jitter_p99_ms"], report["jitter_max_ms"]))
+    print("Segment # {} changed position {} times".format(report["segment"], report["position_changes"]))
+
+
+if __name__ == "__main__":
+    monitor = StreamMonitor()
+    monitor.start()
+    print("Waiting for a stream on {} as segment # {}...".format(overseerStreamPath, segment_no))
+    try:
+        while True:
+            monitor.waitForStream()
+            printReport(monitor.report())
+            monitor.clear()
+    except KeyboardInterrupt:
+        monitor.stop()
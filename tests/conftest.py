@@ -0,0 +1,7 @@
+# the tests import the scripts of the repo directly, as benchmark.py and segmentFleet.py do
+import os
+import sys
+
+repoPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoPath)
+sys.path.insert(1, os.path.join(repoPath, "PropertyControlFunctions"))
@@ -0,0 +1,36 @@
+# the capture file is written out by its flushing thread, also when no further message arrives
+import os
+import time
+
+import overseer
+from overseer import CaptureWriter, captureReceived, captureSent, readCapture
+
+
+def test_capture_is_flushed_without_further_messages(tmp_path, monkeypatch):
+    monkeypatch.setattr(overseer, "captureFlushInterval_s", 0.05)
+    path = str(tmp_path / "session.shivecap")
+    capture = CaptureWriter(path)
+    try:
+        capture.write(captureSent, "ShiveWorks/overseer/command", 1, b"stop")
+        deadline = time.monotonic() + 5
+        while os.path.getsize(path) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # read while the writer is still open, as after a crash
+        assert [message[1:] for message in readCapture(path)] == [
+            ("sent", "ShiveWorks/overseer/command", 1, b"stop")]
+    finally:
+        capture.close()
+
+
+def test_capture_is_continued_after_close(tmp_path):
+    path = str(tmp_path / "session.shivecap")
+    capture = CaptureWriter(path)
+    capture.write(captureSent, "a", 1, b"one")
+    capture.close()
+    capture.close()  # closing twice is harmless
+    capture = CaptureWriter(path)
+    capture.write(captureReceived, "a", 0, "two")
+    capture.write(captureReceived, "b", 2, None)
+    capture.close()
+    assert [message[1:] for message in readCapture(path)] == [
+        ("sent", "a", 1, b"one"), ("received", "a", 0, b"two"), ("received", "b", 2, b"")]
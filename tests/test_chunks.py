@@ -0,0 +1,228 @@
+# chunked uploads against an in-process fake segment, no broker needed
+#    the overseer's publish goes straight to the fake segment, its acknowledgements come back
+#    through the overseer's return message handler on a separate thread, like paho's network thread
+import os
+import queue
+import re
+import threading
+import zlib
+from struct import unpack
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import overseer
+from overseer import Overseer, chunkHeaderFormat, chunkHeaderSize, chunkMaxCount, diffPayloads, segmentPath
+
+segmentID = "fake1"
+
+
+def firmwareConstant(name):  # a constant of the WaveSegment firmware, read from its source
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "WaveSegment", "src", "mqtt.h")
+    with open(path) as file:
+        return int(re.search(r"\b" + name + r"\s*=\s*(\d+)", file.read()).group(1))
+
+
+firmwareMaxChunkCount = firmwareConstant("maxChunkCount")
+
+
+class FakeSegment:
+    # keeps the data buffer the way the firmware does: every intact chunk is copied to its offset and
+    #    acknowledged, the buffer length follows the total length of the transfer
+    #    damage(transfer ID, chunk index, delivery) returns None, "drop", "corrupt" or "lose_ack"
+
+    def __init__(self, rig, damage=None):
+        self.rig = rig
+        self.damage = damage or (lambda transferID, index, delivery: None)
+        self.buffer = bytearray()
+        self.deliveries = {}  # (transfer ID, chunk index) -> number of times the chunk was published
+        self.received = []  # (transfer ID, chunk index, offset, length) of every published chunk
+        self.acks = queue.Queue()
+        self.thread = threading.Thread(target=self.sendAcks, daemon=True)
+        self.thread.start()
+
+    def publish(self, topic, payload, qos):
+        assert topic == segmentPath + "/" + segmentID + "/chunk"
+        transferID, index, count, offset, total, crc = unpack(chunkHeaderFormat, payload[:chunkHeaderSize])
+        data = bytearray(payload[chunkHeaderSize:])
+        delivery = self.deliveries.get((transferID, index), 0)
+        self.deliveries[(transferID, index)] = delivery + 1
+        self.received.append((transferID, index, offset, len(data)))
+        if count > firmwareMaxChunkCount:
+            return  # the firmware rejects the whole transfer
+
+        damage = self.damage(transferID, index, delivery)
+        if damage == "drop":
+            return
+        if damage == "corrupt" and data:
+            data[0] ^= 0xFF
+        if zlib.crc32(data) != crc:
+            return  # a damaged chunk is not acknowledged
+        del self.buffer[total:]
+        self.buffer.extend(bytes(total - len(self.buffer)))
+        self.buffer[offset:offset + len(data)] = data
+        if damage != "lose_ack":
+            self.acks.put("chunk_ack::{}::{}".format(transferID, index).encode("utf-8"))
+
+    def sendAcks(self):
+        while True:
+            payload = self.acks.get()
+            if payload is None:
+                return
+            message = SimpleNamespace(topic=segmentPath + "/" + segmentID + "/return", payload=payload, qos=1)
+            self.rig.on_message(self.rig.client, None, message)
+
+    def close(self):
+        self.acks.put(None)
+        self.thread.join()
+
+    def resent(self, transferID):  # chunk indexes of a transfer that were published more than once
+        return {index for (ID, index), count in self.deliveries.items() if ID == transferID and count > 1}
+
+    def chunksOf(self, transferID):  # (offset, length) of the chunks of a transfer
+        return [(offset, length) for ID, index, offset, length in self.received if ID == transferID]
+
+
+@pytest.fixture
+def rig(tmp_path, monkeypatch):
+    monkeypatch.setattr(overseer, "chunkAckTimeout_s", 0.2)
+    rig = Overseer(segment_count=1, filePath=str(tmp_path / "segmentsID.csv"))
+    rig.registry.load([segmentID])
+    yield rig
+    rig.close()
+
+
+def makeSegment(rig, monkeypatch, damage=None):
+    segment = FakeSegment(rig, damage)
+    monkeypatch.setattr(rig.client, "publish", segment.publish)
+    return segment
+
+
+def randomBytes(seed, length):
+    return np.random.default_rng(seed).integers(0, 256, length, dtype=np.uint8).tobytes()
+
+
+def test_chunked_upload_without_loss(rig, monkeypatch):
+    segment = makeSegment(rig, monkeypatch)
+    data = randomBytes(0, 3 * 10000)
+    try:
+        assert rig.sendChunks(1, data, size=1000)
+    finally:
+        segment.close()
+    assert bytes(segment.buffer) == data
+    assert segment.resent(rig.lastChunkTransferID) == set()
+    assert rig.uploadedPayloads[1] == data
+
+
+@pytest.mark.parametrize("damage", ["drop", "corrupt", "lose_ack"])
+def test_chunked_upload_resends_only_the_damaged_chunks(rig, monkeypatch, damage):
+    damaged = {0, 7, 8, 29}
+    segment = makeSegment(rig, monkeypatch,
+                          lambda transferID, index, delivery: damage if index in damaged and delivery == 0 else None)
+    data = randomBytes(1, 3 * 10000)
+    try:
+        assert rig.sendChunks(1, data, size=1000)
+    finally:
+        segment.close()
+    transferID = rig.lastChunkTransferID
+    assert segment.resent(transferID) == damaged
+    assert all(count == 2 for (ID, index), count in segment.deliveries.items() if index in damaged)
+    assert bytes(segment.buffer) == data
+
+
+def test_chunked_upload_resends_over_several_rounds(rig, monkeypatch):
+    # chunk 3 is damaged twice, chunk 5 once: three rounds, the last one with chunk 3 only
+    segment = makeSegment(rig, monkeypatch, lambda transferID, index, delivery:
+                          "corrupt" if (index == 3 and delivery < 2) or (index == 5 and delivery == 0) else None)
+    data = randomBytes(2, 9000)
+    try:
+        assert rig.sendChunks(1, data, size=1000)
+    finally:
+        segment.close()
+    transferID = rig.lastChunkTransferID
+    assert segment.deliveries[(transferID, 3)] == 3
+    assert segment.deliveries[(transferID, 5)] == 2
+    assert segment.resent(transferID) == {3, 5}
+    assert bytes(segment.buffer) == data
+
+
+def test_chunked_upload_fails_after_chunkMaxRounds(rig, monkeypatch):
+    segment = makeSegment(rig, monkeypatch, lambda transferID, index, delivery: "drop" if index == 2 else None)
+    data = randomBytes(3, 6000)
+    rig.uploadedPayloads[1] = data
+    try:
+        assert not rig.sendChunks(1, data, size=1000)
+    finally:
+        segment.close()
+    assert segment.deliveries[(rig.lastChunkTransferID, 2)] == overseer.chunkMaxRounds
+    assert segment.resent(rig.lastChunkTransferID) == {2}
+    assert 1 not in rig.uploadedPayloads  # the segment's buffer is unknown now
+
+
+def test_patch_upload_sends_and_resends_only_the_changed_ranges(rig, monkeypatch):
+    old = randomBytes(4, 3 * 8000)
+    new = bytearray(old)
+    new[100:110] = bytes(10)
+    new[12000:12003] = b"\x01\x02\x03"
+    new += randomBytes(5, 300)  # the payload grows at the end
+    new = bytes(new)
+
+    # the first chunk of the patch (the second transfer) is damaged, so it has to come again, and only it
+    patchTransferID = rig.lastChunkTransferID + 2
+    segment = makeSegment(rig, monkeypatch, lambda transferID, index, delivery:
+                          "corrupt" if (transferID, index, delivery) == (patchTransferID, 0, 0) else None)
+    try:
+        assert rig.sendChunks(1, old, size=1000)
+        ranges = diffPayloads(old, new)
+        assert rig.sendChunks(1, new, size=1000, ranges=ranges)
+    finally:
+        segment.close()
+
+    transferID = rig.lastChunkTransferID
+    assert transferID == patchTransferID
+    sent = sorted(set(segment.chunksOf(transferID)))
+    assert sent == [(start, end - start) for start, end in ranges]
+    assert segment.resent(transferID) == {0}
+    assert bytes(segment.buffer) == new
+    assert rig.uploadedPayloads[1] == new
+
+
+def test_chunkMaxCount_matches_the_firmware():
+    assert chunkMaxCount == firmwareMaxChunkCount
+
+
+def test_scattered_patch_fits_into_the_firmware_chunk_limit(rig, monkeypatch):
+    # one changed byte every 45 bytes of a full 64 kB payload: about 1460 ranges further apart than patchMergeGap,
+    #    only 2.2 % of the bytes, so the patch is sent, but as one chunk per range the segment would reject it
+    old = randomBytes(6, 3 * 21845)
+    new = bytearray(old)
+    for offset in range(0, len(new), 45):
+        new[offset] ^= 0xFF
+    new = bytes(new)
+    assert len(diffPayloads(old, new)) > chunkMaxCount
+
+    segment = makeSegment(rig, monkeypatch)
+    try:
+        assert rig.sendChunks(1, old)
+        monkeypatch.setattr(rig, "packageSegmentData", lambda segment_no: new)
+        sent = rig.segmentSendDataPatch(1)
+    finally:
+        segment.close()
+    assert sent is not None and sent < len(new) * overseer.patchMaxFraction
+    transferID = rig.lastChunkTransferID
+    assert len(segment.chunksOf(transferID)) <= chunkMaxCount
+    assert bytes(segment.buffer) == new
+
+
+def test_upload_latency_is_kept_apart_from_the_broker_acknowledgement(rig, monkeypatch):
+    segment = makeSegment(rig, monkeypatch)
+    try:
+        assert rig.sendChunks(1, randomBytes(7, 3000), size=1000)
+    finally:
+        segment.close()
+    rig.telemetry.recordUpload(1, 3000, True, brokerSeconds=0.004)  # a plain upload
+    stats = rig.telemetry.summary(1)
+    assert stats["uploads"] == 2
+    assert rig.telemetry.latencyCount[0] == 1  # the chunked upload only
+    assert stats["broker_ack_max_ms"] == pytest.approx(4.)
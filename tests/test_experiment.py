@@ -0,0 +1,34 @@
+# GEN.py's block-by-block generation must give exactly what the whole-matrix path gives
+import numpy as np
+import pytest
+
+import GEN
+
+parameterSets = {
+    "keyframes cbd": {"Tf": 1.},
+    "keyframes lam": {"Tf": 1., "geometry": "fg_lam"},
+    "gradient cbd": {"Tf": 1., "simplify": "gradient"},
+    "gradient lam": {"Tf": 1., "geometry": "fg_lam", "simplify": "gradient"},
+    "wide tolerance": {"Tf": 1., "KeyTol": 4.},
+}
+
+
+@pytest.mark.parametrize("params", parameterSets.values(), ids=parameterSets.keys())
+@pytest.mark.parametrize("blockElements", [GEN.N_SpatElem, 7 * GEN.N_SpatElem, 1 << 18])
+def test_blocks_stack_to_generate(params, blockElements):
+    params = GEN.defaultParameters(params)
+    blocks = list(GEN.generateBlocks(params, blockElements))
+    starts = [start for start, t_SampTime, K_g in blocks]
+    assert starts == sorted(starts) and starts[0] == 0
+    assert np.array_equal(np.concatenate([t_SampTime for start, t_SampTime, K_g in blocks]),
+                          GEN.sampleGrid(params)[1])
+    assert np.array_equal(np.concatenate([K_g for start, t_SampTime, K_g in blocks]), GEN.generate(params))
+
+
+@pytest.mark.parametrize("params", parameterSets.values(), ids=parameterSets.keys())
+def test_streamed_file_is_byte_identical(tmp_path, params):
+    params = GEN.defaultParameters(params)
+    assert GEN.makeExperimentFile(GEN.generate(params), params, str(tmp_path), "whole.shive")
+    assert GEN.makeExperimentFileStreamed(params, str(tmp_path), "streamed.shive", blockElements=5 * GEN.N_SpatElem)
+    assert (tmp_path / "whole.shive").read_bytes() == (tmp_path / "streamed.shive").read_bytes()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["streamed.shive", "whole.shive"]  # no .tmp left
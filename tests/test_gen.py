@@ -0,0 +1,44 @@
+# parameter sweeps of GEN.py: the parameter sets, their folder names and the checks done before any work starts
+import pytest
+
+import GEN
+
+
+def test_parameterGrid_gives_every_combination():
+    grid = GEN.parameterGrid(smt_t=[.1, .5], KeyTol=[1, 2, 3])
+    assert len(grid) == 6
+    assert {(params["smt_t"], params["KeyTol"]) for params in grid} == {
+        (smt_t, KeyTol) for smt_t in (.1, .5) for KeyTol in (1, 2, 3)}
+    assert GEN.parameterGrid() == [{}]
+
+
+def test_experimentName():
+    assert GEN.experimentName({}) == "default"
+    assert GEN.experimentName({"smt_t": GEN.smt_t}) == "default"  # a default value does not show
+    assert GEN.experimentName({"smt_t": .1, "KeyTol": 2}) == "KeyTol=2_smt_t=0.1"
+    assert GEN.experimentName({"smt_t": .1, "name": "slow"}) == "slow"
+
+
+def test_experimentName_rejects_misspelled_parameters():
+    with pytest.raises(ValueError, match="Unknown parameters: smtt"):
+        GEN.experimentName({"smtt": .1})
+    with pytest.raises(ValueError, match="Unknown parameters: smtt"):
+        GEN.experimentName({"smtt": .1, "name": "slow"})
+
+
+def test_sweep_checks_the_parameter_sets_before_generating(tmp_path):
+    with pytest.raises(ValueError, match="same name"):
+        GEN.sweep([{"smt_t": .1}, {"smt_t": .1}], str(tmp_path))
+    with pytest.raises(ValueError, match="same name"):
+        GEN.sweep([{"smt_t": .1, "name": "a"}, {"smt_t": .5, "name": "a"}], str(tmp_path))
+    with pytest.raises(ValueError, match="Unknown parameters: smtt"):
+        GEN.sweep([{"smt_t": .1}, {"smtt": .5}], str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sweep_writes_each_parameter_set_to_its_own_folder(tmp_path):
+    paramSets = GEN.parameterGrid(Tf=[.2], smt_t=[.1, .5])
+    results = GEN.sweep(paramSets, str(tmp_path), max_workers=2)
+    assert results == [(str(tmp_path / GEN.experimentName(params)), True) for params in paramSets]
+    for params, (folder, success) in zip(paramSets, results):
+        assert GEN.loadExperimentFile(folder).shape == (GEN.sampleCount(GEN.defaultParameters(params)), GEN.N_SpatElem)
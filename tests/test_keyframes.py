@@ -0,0 +1,70 @@
+# the keyframes GEN.py keeps must play back, held until the next one, within KeyTol of the full pattern Z_g
+import numpy as np
+import pytest
+
+import GEN
+from shiveFormat import packActuationData, payloadDtype
+
+smallGrids = {
+    "cbd": {"Tf": 1., "N_SpatElem": 8},
+    "lam": {"Tf": 1., "N_SpatElem": 8, "geometry": "fg_lam"},
+    "sharp cbd": {"Tf": 1., "N_SpatElem": 8, "smt_t": .05, "smt_x": .05},
+}
+
+
+def syntheticZ_g():  # constant, ramps, a step, a sine and noise, one segment each
+    t = np.arange(500)
+    rng = np.random.default_rng(0)
+    return np.column_stack([np.full(500, 127.3), t * 255 / 499, 255 - t * 0.37, np.where(t < 250, 10., 240.),
+                            127.5 + 127.5 * np.sin(t / 30), rng.uniform(0, 255, 500)])
+
+
+def payloadPlayback(payload, timestamps):  # what the firmware plays at every sample time, holding each record
+    records = np.frombuffer(payload, dtype=payloadDtype)
+    index = np.searchsorted(records['timestamp'], timestamps, side='right') - 1
+    return records['value'][index].astype(float)
+
+
+@pytest.mark.parametrize("KeyTol", [.5, 1., 3.])
+@pytest.mark.parametrize("grid", smallGrids.values(), ids=smallGrids.keys())
+def test_hold_playback_stays_within_KeyTol(grid, KeyTol):
+    params = GEN.defaultParameters({**grid, "KeyTol": KeyTol})
+    Z_g = GEN.makeZ_g(params)
+    K_g = GEN.generate(params)
+    report = GEN.keyframeReport(K_g, Z_g)
+    assert report["max_error"] <= KeyTol + 1e-9
+    assert np.all(np.abs(GEN.holdPlayback(K_g) - Z_g) <= KeyTol + 1e-9)
+    assert report["points_min"] >= 1 and report["samples"] == Z_g.size
+
+
+@pytest.mark.parametrize("KeyTol", [.5, 1., 2.5])
+def test_hold_playback_of_synthetic_patterns(KeyTol):
+    Z_g = syntheticZ_g()
+    K_g, held = GEN.makeKeyframes(Z_g, KeyTol)
+    assert GEN.keyframeReport(K_g, Z_g)["max_error"] <= KeyTol + 1e-9
+    assert np.array_equal(held, GEN.holdPlayback(K_g)[-1])
+    points = np.count_nonzero(K_g != -100, axis=0)
+    assert points[0] == 1  # a constant needs a single point
+    assert np.all(points < len(Z_g))
+    assert np.all((K_g == -100) | ((K_g == np.rint(K_g)) & (K_g >= 0) & (K_g <= 255)))
+
+
+@pytest.mark.parametrize("grid", smallGrids.values(), ids=smallGrids.keys())
+def test_every_segment_keeps_its_first_and_last_sample(grid):
+    params = GEN.defaultParameters(grid)
+    Z_g = GEN.makeZ_g(params)
+    K_g = GEN.generate(params)
+    timestamps = np.rint(GEN.sampleGrid(params)[1] * 1000).astype(np.int64)
+    assert np.all(K_g[0] != -100)  # every segment has a point at the first sample
+    for segment in range(K_g.shape[1]):
+        payload = packActuationData(timestamps, np.rint(K_g[:, segment]).astype(np.int64))
+        records = np.frombuffer(payload, dtype=payloadDtype)
+        assert records['timestamp'][0] == timestamps[0] and records['timestamp'][-1] == timestamps[-1]
+        played = payloadPlayback(payload, timestamps)
+        assert np.array_equal(played, GEN.holdPlayback(K_g)[:, segment])
+        assert np.max(np.abs(played - Z_g[:, segment])) <= params["KeyTol"] + 1e-9
+
+
+def test_KeyTol_below_half_is_rejected():
+    with pytest.raises(ValueError):
+        GEN.makeKeyframes(syntheticZ_g(), .4)
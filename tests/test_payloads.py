@@ -0,0 +1,133 @@
+# the packed segment payloads must stay byte-identical to what the ESP32 firmware reads
+from struct import pack
+
+import numpy as np
+import pytest
+
+from overseer import (compactPayloadMagic, compactPayloadVersion, decodeCompactPayload, encodeCompactPayload,
+                      loadSegmentData, packSegmentData, payloadDtype)
+
+
+def packSegmentDataLoop(actuationDataArray):  # the original packing, one pack() per row
+    packed_binary = bytes()
+    for i in range(len(actuationDataArray)):
+        packed_binary += pack('<' + 'HB', actuationDataArray[i][0], actuationDataArray[i][1])
+    return packed_binary
+
+
+def writeCSV(path, rows):
+    path.write_text("".join("{},{}\n".format(timestamp, value) for timestamp, value in rows))
+    return str(path)
+
+
+def randomRows(seed, count=2000):
+    rng = np.random.default_rng(seed)
+    timestamps = np.sort(rng.choice(65536, count, replace=False))
+    values = rng.integers(0, 256, count)
+    values[rng.random(count) < 0.3] = -100
+    return list(zip(timestamps.tolist(), values.tolist()))
+
+
+edgeCases = {
+    "first row skipped": [(0, -100), (1, 10), (2, 20), (3, 30)],
+    "last row skipped": [(0, 10), (1, 20), (2, -100), (3, -100)],
+    "first and last row skipped": [(0, -100), (1, 0), (2, 255), (3, -100)],
+    "values 0 and 255": [(0, 0), (1, 255), (2, 0), (3, 255)],
+    "timestamp 65535": [(0, 127), (65534, 200), (65535, 255)],
+    "last row skipped at 65535": [(0, 0), (40000, 255), (65535, -100)],
+    "single row": [(65535, 255)],
+    "single skipped row": [(0, -100)],
+    "mostly skipped": [(0, 5)] + [(t, -100) for t in range(1, 1000)] + [(1000, 6)],
+}
+
+
+@pytest.mark.parametrize("rows", edgeCases.values(), ids=edgeCases.keys())
+def test_packSegmentData_matches_loop_on_edge_rows(tmp_path, rows):
+    actuationDataArray = loadSegmentData(writeCSV(tmp_path / "1.csv", rows))
+    assert packSegmentData(actuationDataArray) == packSegmentDataLoop(actuationDataArray)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_packSegmentData_matches_loop_on_random_rows(tmp_path, seed):
+    actuationDataArray = loadSegmentData(writeCSV(tmp_path / "1.csv", randomRows(seed)))
+    assert packSegmentData(actuationDataArray) == packSegmentDataLoop(actuationDataArray)
+
+
+# ---------------------- Compact Payload Format ----------------------#
+
+def legacyPayload(timestamps, values):
+    records = np.empty(len(timestamps), dtype=payloadDtype)
+    records['timestamp'] = timestamps
+    records['value'] = values
+    return records.tobytes()
+
+
+def randomPayload(seed):
+    rng = np.random.default_rng(seed)
+    count = int(rng.integers(1, 3000))
+    timestamps = np.sort(rng.integers(0, 65536, count))
+    return legacyPayload(timestamps, rng.integers(0, 256, count))
+
+
+compactCases = {
+    "single record": legacyPayload([0], [127]),
+    "single record at 65535": legacyPayload([65535], [255]),
+    "two records": legacyPayload([0, 65535], [0, 255]),
+    "long constant run": legacyPayload(np.arange(0, 60000, 3), np.full(20000, 200)),
+    "rising ramp": legacyPayload(np.arange(256) * 10, np.arange(256)),
+    "falling ramp": legacyPayload(np.arange(256) * 7, np.arange(255, -1, -1)),
+    "ramp up and down": legacyPayload(np.arange(511), np.concatenate((np.arange(256), np.arange(254, -1, -1)))),
+    "full range steps": legacyPayload(np.arange(6) * 1000, [0, 255, 0, 255, 0, 255]),
+    "equal timestamps": legacyPayload([5, 5, 5, 5, 9], [1, 2, 3, 4, 5]),
+    "runs shorter than compactMinRun": legacyPayload([0, 1, 2, 4, 6, 9, 12], [0, 1, 2, 4, 6, 9, 12]),
+    "mixed runs": legacyPayload(np.concatenate((np.arange(100), 100 + np.arange(50) * 2, [400, 401, 65535])),
+                                np.concatenate((np.full(100, 50), 50 + np.arange(50), [0, 255, 255]))),
+}
+
+
+@pytest.mark.parametrize("payload", compactCases.values(), ids=compactCases.keys())
+def test_compact_payload_round_trip(payload):
+    compact = encodeCompactPayload(payload)
+    assert compact[0] == compactPayloadMagic and compact[1] == compactPayloadVersion
+    assert len(compact) % 3 != 0
+    assert decodeCompactPayload(compact) == payload
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_compact_payload_round_trip_random(seed):
+    payload = randomPayload(seed)
+    compact = encodeCompactPayload(payload)
+    assert len(compact) % 3 != 0
+    assert decodeCompactPayload(compact) == payload
+
+
+def test_compact_payload_padding():
+    # a single point at 100 ms is 6 bytes (magic, version, count, 2-byte dt, value), a multiple of 3,
+    #    so a zero byte is appended to tell it apart from a legacy payload
+    payload = legacyPayload([100], [42])
+    compact = encodeCompactPayload(payload)
+    assert len(compact) == 7 and compact[-1] == 0
+    assert decodeCompactPayload(compact) == payload
+
+    # without padding the length stays as it is
+    payload = legacyPayload([10], [42])
+    assert len(encodeCompactPayload(payload)) == 5
+    assert decodeCompactPayload(encodeCompactPayload(payload)) == payload
+
+
+def test_compact_payload_round_trip_short_random():
+    # short payloads come out at every length, so some of them are padded
+    for seed in range(200):
+        rng = np.random.default_rng(seed)
+        count = int(rng.integers(1, 40))
+        payload = legacyPayload(np.sort(rng.integers(0, 65536, count)), rng.integers(0, 256, count))
+        compact = encodeCompactPayload(payload)
+        assert len(compact) % 3 != 0
+        assert decodeCompactPayload(compact) == payload
+
+
+def test_compact_payload_rejects_legacy_and_decreasing_timestamps():
+    with pytest.raises(ValueError):
+        decodeCompactPayload(legacyPayload([0, 1], [0, 1]))
+    with pytest.raises(ValueError):
+        encodeCompactPayload(legacyPayload([10, 5], [0, 1]))
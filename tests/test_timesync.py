@@ -0,0 +1,77 @@
+# a segment that restarts or reboots syncs its NTP clock again, so its measured offset must not be used to start it
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from overseer import Overseer, segmentPath
+
+segmentIDs = ["fake1", "fake2"]
+
+
+class FakeClient:  # records what is published, every message counts as acknowledged by the broker
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos):
+        self.published.append((topic, payload))
+        return SimpleNamespace(rc=0, wait_for_publish=lambda timeout: None, is_published=lambda: True)
+
+
+@pytest.fixture
+def rig(tmp_path, monkeypatch):
+    rig = Overseer(segment_count=len(segmentIDs), filePath=str(tmp_path / "segmentsID.csv"))
+    rig.registry.load(segmentIDs)
+    client = FakeClient()
+    monkeypatch.setattr(rig.client, "publish", client.publish)
+    rig.published = client.published
+    # offsets as a timesync of both segments would leave them
+    for segment_no in rig.allSegments():
+        rig.clockOffsets[segment_no] = (12.5 * segment_no, 3.0, time.time())
+    yield rig
+    rig.close()
+
+
+def startMessages(rig):
+    return [payload for topic, payload in rig.published if payload.startswith("start::")]
+
+
+def statusMessage(segment_no, status):
+    return SimpleNamespace(topic=segmentPath + "/" + segmentIDs[segment_no - 1] + "/status",
+                           payload=status.encode("utf-8"), qos=1)
+
+
+def test_synced_segments_start_with_their_offsets(rig):
+    assert rig.startSegments() is not None
+    assert len(startMessages(rig)) == 2
+
+
+@pytest.mark.parametrize("restart", [
+    lambda rig: rig.restart([1]),
+    lambda rig: rig.restart(),
+    lambda rig: rig.segment_restart(1),
+], ids=["restart", "restart all", "segment_restart"])
+def test_restart_invalidates_the_clock_offset(rig, restart):
+    restart(rig)
+    assert 1 not in rig.clockOffsets
+    assert rig.startSegments() is None  # no start until a new timesync
+    assert startMessages(rig) == []
+
+
+@pytest.mark.parametrize("status", ["Initializing", "Connected"])
+def test_reboot_status_invalidates_the_clock_offset(rig, status):
+    rig.on_segment_status(rig.client, None, statusMessage(2, status))
+    assert 2 not in rig.clockOffsets and 1 in rig.clockOffsets
+    assert rig.startSegments() is None
+
+
+@pytest.mark.parametrize("status", ["Paired", "Ready", "Running"])
+def test_other_statuses_keep_the_clock_offset(rig, status):
+    rig.on_segment_status(rig.client, None, statusMessage(2, status))
+    assert 2 in rig.clockOffsets
+    assert rig.startSegments() is not None
+
+
+def test_unpairing_invalidates_the_clock_offset(rig):
+    assert rig.removeSegmentID(1)
+    assert 1 not in rig.clockOffsets